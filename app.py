@@ -1,46 +1,91 @@
-from flask import Flask, redirect, render_template, session, g, flash
+from flask import Flask, Blueprint, abort, current_app, request, redirect, render_template, session, g, flash
+import asyncio
+import click
+import httpx
 import requests
-from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
-from models import db, connect_db, User, Recipe, Preference
+from models import db, connect_db, User, Recipe, Preference, RecipeDetail, SearchResult, IngredientSubstitute, SimilarRecipes, ShoppingList, ShoppingListItem, Job, SchemaMigration
+from cache import TTLCache
+from spoonacular import spoonacular, async_spoonacular, limiter
+from quota import QuotaExceeded
+from tracing import init_tracing, span
+from provisioning import provision_user, schedule_provisioning
+from prefetch import Prefetcher
+from fridge import FridgeCatalog
+from jobs import enqueue, work, SHOPPING_LIST_ADD, SHOPPING_LIST_ADD_MANY, SHOPPING_LIST_DELETE
 from forms import RegisterForm, LoginForm, ByIngredientsForm, ComplexSearchForm, UpdateUserForm, UpdatePreferencesForm
 # from secret import API_KEY, key
 import json
+import logging
 import os
+import re
+from typing import NamedTuple
 
 
 CURR_USER_KEY = 'curr_user'
-API_BASE_URL = 'https://api.spoonacular.com/'
+SEARCH_RESULTS_KEY = 'search_results'
+# informationBulk accepts a comma-separated list of ids, keep the URL a sane length
+BULK_CHUNK_SIZE = 50
+MAX_CONCURRENT_FETCHES = 8
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'migrations')
+
+# Settings that differ between the profiles create_app can build the app with
+PROFILES = {
+    'dev': {'SQLALCHEMY_ECHO': os.environ.get('SQLALCHEMY_ECHO') == '1',
+            'DEBUG_TB_INTERCEPT_REDIRECTS': False,
+            'DEBUG_TOOLBAR': True},
+    'test': {'TESTING': True,
+             'WTF_CSRF_ENABLED': False,
+             'BCRYPT_LOG_ROUNDS': 4,
+             'SQLALCHEMY_ECHO': False,
+             'DEBUG_TB_HOSTS': ['dont-show-debug-toolbar'],
+             'DEBUG_TOOLBAR': False},
+    'prod': {'SQLALCHEMY_ECHO': False,
+             'SQLALCHEMY_ENGINE_OPTIONS': {'pool_pre_ping': True},
+             'DEBUG_TOOLBAR': False},
+}
+
+main = Blueprint('main', __name__, cli_group=None)
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
-    'DATABASE_URL').replace("://", "ql://", 1)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['API_KEY'] = os.environ.get('API_KEY')
 
-API_KEY = os.environ.get('API_KEY')
+# *********************************************************************** #
+# Login/Logout/Keep user logged in
 
-connect_db(app)
-app.app_context().push()
-db.create_all()
 
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+class CurrentUser(NamedTuple):
+    """The logged in user as kept in g.user: the id and username are all the views and
+    templates need, anything else is loaded with User.query when it is used."""
+    id: int
+    username: str
 
-debug = DebugToolbarExtension(app)
 
-# *********************************************************************** #
-# Login/Logout/Keep user logged in
+def invalidate_current_user(user_id):
+    """Drops a user from this worker's user cache after their details change."""
+    current_app.extensions['user_cache'].delete(user_id)
 
 
-@app.before_request
+@main.before_app_request
 def add_user_to_g():
-    """If user is logged in, add curr_user to Flask global."""
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-    else:
+    """If user is logged in, add curr_user to Flask global.
+
+    Users are kept in a per-worker cache for USER_CACHE_TTL seconds, so most requests
+    do not touch the database to find out who is logged in."""
+    user_id = session.get(CURR_USER_KEY)
+    if user_id is None or request.endpoint == 'static':
         g.user = None
+        return
+    user_cache = current_app.extensions['user_cache']
+    with span('auth'):
+        g.user = user_cache.get(user_id)
+        if g.user is None:
+            user = User.query.get(user_id)
+            if user:
+                g.user = CurrentUser(user.id, user.username)
+                user_cache.set(user_id, g.user)
 
 
 def do_login(user):
@@ -52,18 +97,20 @@ def do_logout():
     """Logout user."""
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+    if SEARCH_RESULTS_KEY in session:
+        del session[SEARCH_RESULTS_KEY]
 
 # *********************************************************************** #
 # Homepage and Handling Signup/Login/Logout
 
 
-@app.route('/')
+@main.route('/')
 def homepage():
     """Renders homepage for app."""
     return render_template('homepage.html', user=g.user)
 
 
-@app.route('/signup', methods=['GET', 'POST'])
+@main.route('/signup', methods=['GET', 'POST'])
 def signup():
     """Shows signup page and handles form submission."""
 
@@ -85,6 +132,7 @@ def signup():
             flash("Username already taken. Please try another.", 'danger')
             return render_template('signup.html', form=form)
 
+        schedule_provisioning(user.id)
         do_login(user)
 
         return redirect('/')
@@ -93,7 +141,7 @@ def signup():
         return render_template('signup.html', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     """Handle user login."""
 
@@ -113,7 +161,7 @@ def login():
     return render_template('login.html', form=form)
 
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     """Handle user logout."""
     do_logout()
@@ -121,7 +169,7 @@ def logout():
     return redirect('/login')
 
 
-@app.route('/user/<int:user_id>')
+@main.route('/user/<int:user_id>')
 def show_user_profile(user_id):
     """Shows the user profile."""
     if not g.user or g.user.id != user_id:
@@ -157,7 +205,93 @@ def create_search_string(data):
     return query_string
 
 
-@app.route('/recipes/search', methods=["GET", "POST"])
+# Free text fields holding comma-separated ingredient lists
+INGREDIENT_LIST_FIELDS = ('ingredients', 'includeIngredients', 'excludeIngredients')
+
+
+def normalize_search_data(data):
+    """Puts search choices in a canonical form so identical searches build identical query strings.
+
+    Keys are sorted, list values are lowercased and sorted and ingredient lists are trimmed."""
+    normalized = {}
+    for k in sorted(data):
+        v = data[k]
+        if k in INGREDIENT_LIST_FIELDS:
+            if isinstance(v, list):
+                v = ",".join(v)
+            v = sorted({i.strip().lower() for i in str(v).split(",") if i.strip()})
+        elif isinstance(v, list):
+            v = sorted({str(i).strip().lower() for i in v})
+        elif isinstance(v, str):
+            v = v.strip().lower()
+        normalized[k] = v
+    return normalized
+
+
+def get_search_results(endpoint, data, results_key=None):
+    """Returns the recipes found by a search endpoint, using the search cache before the API."""
+    search_cache = current_app.extensions['search_cache']
+    cache_key = f"{endpoint}?{create_search_string(normalize_search_data(data))}"
+    recipes = search_cache.get(cache_key)
+    if recipes is None:
+        res = spoonacular.get(endpoint, params=normalize_search_data(data))
+        res.raise_for_status()
+        recipes = res.json()
+        if results_key:
+            recipes = recipes[results_key]
+        search_cache.set(cache_key, recipes)
+    return recipes
+
+
+def complex_search(data):
+    """Returns the recipes found by complexSearch, from the local search index or the API.
+
+    With LOCAL_SEARCH_FIRST the stored recipes answer every search they have enough
+    matches for. Otherwise they are only searched when the API fails or is out of points."""
+    choices = normalize_search_data(data)
+    number = choices.get('number') or 10
+    if current_app.config['LOCAL_SEARCH_FIRST']:
+        recipes = RecipeDetail.search(choices, number)
+        if len(recipes) >= number:
+            return recipes
+    try:
+        return get_search_results('recipes/complexSearch', data, results_key='results')
+    except (QuotaExceeded, requests.RequestException, ValueError) as exc:
+        logger.warning("complexSearch failed, searching stored recipes: %r", exc)
+        return RecipeDetail.search(choices, number)
+
+
+def store_search_results(recipes):
+    """Saves the recipes returned by a search and keeps the id of the result set in the session.
+
+    The details of the top PREFETCH_RESULTS recipes are fetched in the background, as
+    users nearly always go on to one of the first few."""
+    result = SearchResult.save(recipes, user_id=g.user.id if g.user else None,
+                               max_age=current_app.config['SEARCH_RESULTS_MAX_AGE'],
+                               max_per_user=current_app.config['SEARCH_RESULTS_PER_USER'])
+    session[SEARCH_RESULTS_KEY] = result.id
+    top_ids = [recipe['id'] for recipe in recipes[:current_app.config['PREFETCH_RESULTS']]]
+    # only a check for what to prefetch, so it is not counted in the cache's hit rate
+    recipe_cache = current_app.extensions['recipe_cache']
+    top_ids = [recipe_id for recipe_id in top_ids if recipe_cache.peek(recipe_id) is None]
+    if top_ids:
+        current_app.extensions['prefetcher'].submit(
+            ('recipes', tuple(top_ids)), prefetch_recipes, top_ids)
+
+
+def prefetch_recipes(recipe_ids):
+    """Fetches recipes into the recipe cache and the recipe_details table ahead of their pages."""
+    asyncio.run(get_recipes_information(recipe_ids))
+
+
+def load_search_results():
+    """Returns the recipes of the last search in this session, or [] if there are none."""
+    recipes = SearchResult.lookup(session.get(SEARCH_RESULTS_KEY),
+                                  max_age=current_app.config['SEARCH_RESULTS_MAX_AGE'])
+    return recipes or []
+
+
+@main.route('/recipes/search', methods=["GET", "POST"])
 def search_recipes():
     """Show search form and handle form submission for general recipe search."""
     form = ComplexSearchForm()
@@ -168,12 +302,8 @@ def search_recipes():
             if choice != 'csrf_token' and form.data[choice] != [] and form.data[choice] != None and form.data[choice] != '' and choice != 'save':
                 data[choice] = form.data[choice]
 
-        query_string = create_search_string(data)
-
-        res = requests.get(
-            f"{API_BASE_URL}recipes/complexSearch?{query_string}", params={'apiKey': API_KEY})
-        recipes = res.json()['results']
-        session['recipes'] = recipes
+        recipes = complex_search(data)
+        store_search_results(recipes)
         if g.user and form.data['save'] == True:
             try:
                 save_preferences = Preference(
@@ -188,13 +318,14 @@ def search_recipes():
         return render_template('recipes/complex_search.html', form=form)
 
 
-@app.route('/recipes')
+@main.route('/recipes')
 def show_recipes():
     """Shows the recipes collected from the complexSearch results."""
-    if session['recipes'] == []:
+    recipes = load_search_results()
+    if recipes == []:
         flash("Sorry, no recipes were found that match your search criteria. Please ammend your search and try again.", "info")
         return redirect('/recipes/search')
-    return render_template('recipes/show.html', recipes=session['recipes'])
+    return render_template('recipes/show.html', recipes=recipes)
 
 
 def get_saved_recipe_ids(recipes):
@@ -205,20 +336,148 @@ def get_saved_recipe_ids(recipes):
     return user_recipes
 
 
-@app.route('/recipes/<int:recipe_id>')
-def get_recipe(recipe_id):
+async def fetch_recipe_information(recipe_id):
+    """Fetches the information for a single recipe from the API, returns None on failure."""
+    try:
+        res = await async_spoonacular.recipe_information(recipe_id)
+        res.raise_for_status()
+        return res.json()
+    except (httpx.HTTPError, QuotaExceeded, ValueError):
+        return None
+
+
+async def fetch_recipe_information_chunk(recipe_ids, limit):
+    """Fetches the information for a chunk of recipes with one informationBulk call.
+
+    If the bulk call fails, falls back to fetching each recipe in the chunk on its own,
+    with at most limit calls in flight."""
+    async def fetch_one(recipe_id):
+        async with limit:
+            return await fetch_recipe_information(recipe_id)
+
+    if len(recipe_ids) > 1:
+        try:
+            async with limit:
+                res = await async_spoonacular.recipe_information_bulk(recipe_ids)
+            res.raise_for_status()
+            return res.json()
+        except (httpx.HTTPError, QuotaExceeded, ValueError):
+            pass
+    recipes = await asyncio.gather(*(fetch_one(recipe_id) for recipe_id in recipe_ids))
+    return [recipe for recipe in recipes if recipe is not None]
+
+
+async def fetch_recipes_information(recipe_ids):
+    """Fetches the information for many recipes, keeping the order of recipe_ids.
+
+    Ids are sent to the informationBulk endpoint in chunks of BULK_CHUNK_SIZE, with the
+    chunks requested concurrently so the page waits for roughly one round trip."""
+    if not recipe_ids:
+        return []
+    limit = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    chunks = [recipe_ids[i:i + BULK_CHUNK_SIZE]
+              for i in range(0, len(recipe_ids), BULK_CHUNK_SIZE)]
+    fetched = {}
+    for recipes in await asyncio.gather(*(fetch_recipe_information_chunk(chunk, limit) for chunk in chunks)):
+        for recipe in recipes:
+            fetched[recipe['id']] = recipe
+    return [fetched[recipe_id] for recipe_id in recipe_ids if recipe_id in fetched]
+
+
+async def get_recipes_information(recipe_ids):
+    """Returns the information for many recipes, keeping the order of recipe_ids.
+
+    Looks in the recipe cache first, then the recipe_details table, and only fetches
+    from the API the recipes that are missing or stale. Fetched recipes are written
+    back to both. A stale copy is still used if the API could not refresh it."""
+    recipe_cache = current_app.extensions['recipe_cache']
+    recipes = recipe_cache.get_many(recipe_ids)
+    missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in recipes]
+    stale = {}
+    if missing:
+        details = RecipeDetail.query.filter(
+            RecipeDetail.recipe_id.in_(missing)).all()
+        for detail in details:
+            if detail.is_stale(current_app.config['RECIPE_CATALOG_MAX_AGE']):
+                stale[detail.recipe_id] = detail.data
+            else:
+                recipes[detail.recipe_id] = detail.data
+                recipe_cache.set(detail.recipe_id, detail.data)
+        missing = [recipe_id for recipe_id in missing if recipe_id not in recipes]
+    if missing:
+        fetched = await fetch_recipes_information(missing)
+        RecipeDetail.store(fetched)
+        for recipe in fetched:
+            recipe_cache.set(recipe['id'], recipe)
+            recipes[recipe['id']] = recipe
+    for recipe_id, recipe in stale.items():
+        recipes.setdefault(recipe_id, recipe)
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+async def get_recipe_information(recipe_id):
+    """Returns the information for a recipe, or None if it could not be found."""
+    recipes = await get_recipes_information([recipe_id])
+    return recipes[0] if recipes else None
+
+
+@main.route('/recipes/<int:recipe_id>')
+async def get_recipe(recipe_id):
     """Shows detailed information for the chosen recipe."""
-    res = requests.get(
-        f"{API_BASE_URL}recipes/{recipe_id}/information", params={'apiKey': API_KEY})
-    recipe = res.json()
+    recipe = await get_recipe_information(recipe_id)
+    if recipe is None:
+        flash("Sorry, that recipe could not be found.", "danger")
+        return redirect('/recipes/search')
+    # so the Show Similar Recipes button does not wait on the API
+    current_app.extensions['prefetcher'].submit(
+        ('similar', recipe_id), warm_similar_recipes, recipe_id)
+    # substitutes already stored are shown inline, SUBSTITUTE_PREFETCH fetches the rest in one batch
+    substitutes = await get_substitutes([ingredient['id'] for ingredient in recipe.get('extendedIngredients', [])
+                                         if ingredient.get('id')],
+                                        fetch=current_app.config['SUBSTITUTE_PREFETCH'])
     if g.user:
         saved_recipes = Recipe.query.filter_by(user_id=g.user.id).all()
         saved_recipes_ids = get_saved_recipe_ids(saved_recipes)
-        return render_template('recipes/details.html', recipe=recipe, saved_recipes=saved_recipes_ids)
-    return render_template('recipes/details.html', recipe=recipe)
-
-
-@app.route('/recipes/byIngredients', methods=["GET", "POST"])
+        return render_template('recipes/details.html', recipe=recipe, saved_recipes=saved_recipes_ids,
+                               substitutes=substitutes)
+    return render_template('recipes/details.html', recipe=recipe, substitutes=substitutes)
+
+
+def load_fridge_recipes():
+    """Returns the stored recipes in the shape FridgeIndex is built from."""
+    details = RecipeDetail.query.with_entities(
+        RecipeDetail.recipe_id, RecipeDetail.title, RecipeDetail.image, RecipeDetail.ingredients,
+        RecipeDetail.data['imageType'].as_string(), RecipeDetail.data['aggregateLikes'].as_integer())
+    return [{"id": recipe_id, "title": title, "image": image, "extendedIngredients": ingredients,
+             "imageType": image_type, "aggregateLikes": likes}
+            for (recipe_id, title, image, ingredients, image_type, likes) in details]
+
+
+def match_fridge(choices):
+    """Answers findByIngredients from this worker's index of the stored recipes."""
+    return current_app.extensions['fridge_index'].current().match(
+        choices['ingredients'], ranking=choices.get('ranking') or 1,
+        number=choices.get('number') or 10)
+
+
+def find_by_ingredients(data):
+    """Returns the recipes found by findByIngredients, from the stored recipes or the API.
+
+    The stored recipes are used like in complex_search: first with LOCAL_SEARCH_FIRST
+    when they have enough matches, otherwise when the API fails or is out of points."""
+    choices = normalize_search_data(data)
+    if current_app.config['LOCAL_SEARCH_FIRST']:
+        recipes = match_fridge(choices)
+        if len(recipes) >= (choices.get('number') or 10):
+            return recipes
+    try:
+        return get_search_results('recipes/findByIngredients', data)
+    except (QuotaExceeded, requests.RequestException, ValueError) as exc:
+        logger.warning("findByIngredients failed, matching stored recipes: %r", exc)
+        return match_fridge(choices)
+
+
+@main.route('/recipes/byIngredients', methods=["GET", "POST"])
 def get_byIngredients():
     """Show search form for What's in you fridge? and handles submission."""
     if not g.user:
@@ -231,87 +490,155 @@ def get_byIngredients():
         for choice in form.data:
             if choice != 'csrf_token':
                 choices[choice] = form.data[choice]
-        query_string = create_search_string(choices)
+        choices['ignorePantry'] = 'true'
 
-        res = requests.get(
-            f"{API_BASE_URL}recipes/findByIngredients?{query_string}&ignorePantry=true", params={'apiKey': API_KEY})
-        recipes = res.json()
-        session['recipes'] = recipes
+        recipes = find_by_ingredients(choices)
+        store_search_results(recipes)
         return redirect('/recipes/results')
     else:
         return render_template('recipes/byIngredients.html', form=form)
 
 
-@app.route('/recipes/results')
+@main.route('/recipes/results')
 def show_byIngredients_recipes():
     """Shows the recipes collected from the byIngredients search results."""
-    if session['recipes'] == []:
+    recipes = load_search_results()
+    if recipes == []:
         flash("Sorry, no recipes were found that match your search criteria. Please ammend your search and try again.", "info")
         return redirect('/recipes/byIngredients')
-    return render_template('recipes/show_byIngredients.html', recipes=session['recipes'])
+    return render_template('recipes/show_byIngredients.html', recipes=recipes)
 
 
-@app.route('/recipes/<int:recipe_id>/saved', methods=["POST"])
+@main.route('/recipes/<int:recipe_id>/saved', methods=["POST"])
 def save_recipe(recipe_id):
     """Allows user to save a chosen recipe."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
 
-    saved_recipe = Recipe(user_id=g.user.id, recipe_id=recipe_id)
-    db.session.add(saved_recipe)
-    db.session.commit()
+    Recipe.save(g.user.id, recipe_id)
     return redirect(f"/user/{g.user.id}/saved-recipes")
 
 
-@app.route('/recipes/<int:recipe_id>/favourite', methods=["POST"])
+@main.route('/recipes/<int:recipe_id>/favourite', methods=["POST"])
 def add_favourite(recipe_id):
     """Allow users to favourite a recipe."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
 
-    recipe = Recipe.query.get_or_404(recipe_id)
-    recipe.favourite = True
-    db.session.commit()
+    if not Recipe.set_favourite(g.user.id, recipe_id, True):
+        abort(404)
     return redirect(f"/user/{g.user.id}/favourite-recipes")
 
 
-@app.route('/recipes/<int:recipe_id>/favourite/remove', methods=["POST"])
+@main.route('/recipes/<int:recipe_id>/favourite/remove', methods=["POST"])
 def remove_favourite(recipe_id):
     """Removes favourite from user's favourite recipes and updates db."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
 
-    recipe = Recipe.query.get_or_404(recipe_id)
-    recipe.favourite = False
-    db.session.commit()
+    if not Recipe.set_favourite(g.user.id, recipe_id, False):
+        abort(404)
     return redirect(f"/user/{g.user.id}/favourite-recipes")
 
 
-@app.route('/ingredient/<int:ingredient_id>')
-def get_ingredient_substitutes(ingredient_id):
+async def fetch_ingredient_substitutes(ingredient_id, limit):
+    """Fetches the substitutes for an ingredient from the API, returns None on failure."""
+    try:
+        async with limit:
+            res = await async_spoonacular.ingredient_substitutes(ingredient_id)
+        res.raise_for_status()
+        return res.json()
+    except (httpx.HTTPError, QuotaExceeded, ValueError):
+        return None
+
+
+async def get_substitutes(ingredient_ids, fetch=True):
+    """Returns {ingredient_id: substitutes} for the ingredients, as answered by the API.
+
+    Substitutes hardly ever change, so they are kept in the ingredient_substitutes
+    table for SUBSTITUTE_MAX_AGE seconds. Missing or stale ones are fetched from the
+    API concurrently, unless fetch is False. A stale copy is still used if the API could
+    not refresh it."""
+    ingredient_ids = list(dict.fromkeys(ingredient_ids))
+    if not ingredient_ids:
+        return {}
+    substitutes = {}
+    stale = {}
+    for stored in IngredientSubstitute.query.filter(IngredientSubstitute.ingredient_id.in_(ingredient_ids)):
+        if stored.is_stale(current_app.config['SUBSTITUTE_MAX_AGE']):
+            stale[stored.ingredient_id] = stored.data
+        else:
+            substitutes[stored.ingredient_id] = stored.data
+    missing = [ingredient_id for ingredient_id in ingredient_ids
+               if ingredient_id not in substitutes]
+    if missing and fetch:
+        limit = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        fetched = await asyncio.gather(*(fetch_ingredient_substitutes(ingredient_id, limit)
+                                         for ingredient_id in missing))
+        fetched = {ingredient_id: data for (ingredient_id, data)
+                   in zip(missing, fetched) if data is not None}
+        IngredientSubstitute.store(fetched)
+        substitutes.update(fetched)
+    for ingredient_id, data in stale.items():
+        substitutes.setdefault(ingredient_id, data)
+    return substitutes
+
+
+@main.route('/ingredient/<int:ingredient_id>')
+async def get_ingredient_substitutes(ingredient_id):
     """Display substitutes for a given ingredient."""
-    res = requests.get(
-        f"{API_BASE_URL}food/ingredients/{ingredient_id}/substitutes", params={'apiKey': API_KEY})
-    substitutes = res.json()
+    substitutes = (await get_substitutes([ingredient_id])).get(ingredient_id)
+    if substitutes is None:
+        flash("Sorry, substitutes could not be found right now. Please try again later.", "danger")
+        return redirect(request.referrer or '/')
     return render_template('recipes/ingredients.html', substitutes=substitutes)
 
 
-@app.route('/recipes/<int:recipe_id>/similar')
-def get_similar_recipes(recipe_id):
-    """Display similar recipes for a given recipe."""
-    res = requests.get(
-        f"{API_BASE_URL}recipes/{recipe_id}/similar", params={'apiKey': API_KEY})
-    recipes = res.json()
+def stored_similar_recipes(recipe_id):
+    """Returns the stored list of similar recipes and whether it needs fetching again."""
+    stored = SimilarRecipes.query.get(recipe_id)
+    if stored is None:
+        return (None, True)
+    return (stored.recipes, stored.is_stale(current_app.config['SIMILAR_RECIPES_MAX_AGE']))
+
+
+def warm_similar_recipes(recipe_id):
+    """Fetches and stores the similar recipes of a recipe, unless a fresh list is stored."""
+    (recipes, stale) = stored_similar_recipes(recipe_id)
+    if stale:
+        res = spoonacular.similar_recipes(recipe_id)
+        res.raise_for_status()
+        SimilarRecipes.store(recipe_id, res.json())
+
+
+@main.route('/recipes/<int:recipe_id>/similar')
+async def get_similar_recipes(recipe_id):
+    """Display similar recipes for a given recipe.
+
+    Lists are kept in the similar_recipes table for SIMILAR_RECIPES_MAX_AGE seconds,
+    and get_recipe fetches them in the background, so this rarely waits on the API.
+    A stale list is still shown if the API could not refresh it."""
+    (recipes, stale) = stored_similar_recipes(recipe_id)
+    if stale:
+        try:
+            res = await async_spoonacular.similar_recipes(recipe_id)
+            res.raise_for_status()
+            recipes = res.json()
+            SimilarRecipes.store(recipe_id, recipes)
+        except (httpx.HTTPError, QuotaExceeded, ValueError):
+            if recipes is None:
+                flash("Sorry, similar recipes could not be found right now. Please try again later.", "danger")
+                return redirect(f"/recipes/{recipe_id}")
     return render_template('recipes/show.html', recipes=recipes)
 
 # *********************************************************************** #
 # User related views: updating profile and preferences, saving/favourite recpes, and managing shopping lists
 
 
-@app.route('/user/<int:user_id>/update', methods=["GET", "POST"])
+@main.route('/user/<int:user_id>/update', methods=["GET", "POST"])
 def update_user_profile(user_id):
     """Update user details on profile page and in database."""
     if not g.user or g.user.id != user_id:
@@ -329,6 +656,7 @@ def update_user_profile(user_id):
             user.email = form.email.data
             user.image_url = form.image_url.data
             db.session.commit()
+            invalidate_current_user(user.id)
             return redirect(f"/user/{user.id}")
         elif taken.id == user_id:
             user.username = form.username.data
@@ -337,6 +665,7 @@ def update_user_profile(user_id):
             user.email = form.email.data
             user.image_url = form.image_url.data
             db.session.commit()
+            invalidate_current_user(user.id)
             return redirect(f"/user/{user.id}")
         else:
             flash("Username already taken. Please try another.", 'danger')
@@ -345,7 +674,7 @@ def update_user_profile(user_id):
         return render_template('users/update.html', form=form)
 
 
-@app.route('/user/<int:user_id>/preferences', methods=["GET", "POST"])
+@main.route('/user/<int:user_id>/preferences', methods=["GET", "POST"])
 def update_user_preferences(user_id):
     """Update user preferences on profile page and in database."""
     if not g.user or g.user.id != user_id:
@@ -376,49 +705,124 @@ def update_user_preferences(user_id):
         return render_template('users/update-preferences.html', form=form)
 
 
-@app.route('/user/<int:user_id>/shoppinglist')
-def get_user_shoppinglist(user_id):
-    """Retrieves user's shopping list from API and displays."""
+@main.route('/user/<int:user_id>/shoppinglist')
+async def get_user_shoppinglist(user_id):
+    """Displays user's shopping list from its local copy.
+
+    The copy is synced from the API when it is older than SHOPPING_LIST_MAX_AGE, or
+    when asked with ?refresh=1. The app's own changes are made to it directly. The
+    copy is still shown if the API could not sync it."""
     if not g.user or g.user.id != user_id:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
     user = User.query.get_or_404(user_id)
-    username = user.api_username
-    hash = user.hash
-    res = requests.get(f"{API_BASE_URL}mealplanner/{username}/shopping-list",
-                       params={'apiKey': API_KEY, 'username': username, 'hash': hash})
-    shoppinglist = res.json()['aisles']
+    if not user.is_provisioned:
+        schedule_provisioning(user.id)
+        return render_template('users/shoppinglist.html', shoppinglist=ShoppingListItem.aisles_for(user.id),
+                               provisioning=True)
+    shopping_list = ShoppingList.query.get(user.id)
+    if (request.args.get('refresh') or shopping_list is None
+            or shopping_list.is_stale(current_app.config['SHOPPING_LIST_MAX_AGE'])):
+        username = user.api_username
+        hash = user.hash
+        try:
+            res = await async_spoonacular.shopping_list(username, hash)
+            res.raise_for_status()
+            aisles = res.json()['aisles']
+        except (httpx.HTTPError, QuotaExceeded, KeyError, ValueError) as exc:
+            logger.warning("Syncing the shopping list of user %s failed: %r", user.id, exc)
+            if request.args.get('refresh'):
+                flash("Sorry, your shopping list could not be refreshed right now. Showing the last copy.", "info")
+        else:
+            deleting = {job.payload['id'] for job in Job.pending_for(
+                user.id, [SHOPPING_LIST_DELETE])}
+            ShoppingList.sync(user.id, aisles, deleting)
+        if request.args.get('refresh'):
+            return redirect(f"/user/{user.id}/shoppinglist")
 
-    return render_template('users/shoppinglist.html', shoppinglist=shoppinglist)
+    return render_template('users/shoppinglist.html', shoppinglist=ShoppingListItem.aisles_for(user.id))
 
 
-@app.route('/shoppinglist/add/<ingredient_name>', methods=["GET", "POST"])
+@main.route('/shoppinglist/add/<ingredient_name>', methods=["GET", "POST"])
 def add_to_shoppinglist(ingredient_name):
-    """Add an item to a user's shopping list."""
+    """Add an item to a user's shopping list.
+
+    The item goes on the local copy straight away and the API call is queued for the
+    worker. Adding the same item again before it is on the API adds it once."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(g.user.id)
-    username = user.api_username
-    hash = user.hash
-    items = {"item": ingredient_name, "parse": True}
-    res = requests.post(f"{API_BASE_URL}mealplanner/{username}/shopping-list/items",
-                        params={'apiKey': API_KEY, 'username': username, 'hash': hash}, json=items)
+    if not ShoppingListItem.query.filter(ShoppingListItem.user_id == g.user.id, ShoppingListItem.upstream_id.is_(None),
+                                         db.func.lower(ShoppingListItem.name) == ingredient_name.lower()).count():
+        item = ShoppingListItem(user_id=g.user.id, name=ingredient_name)
+        db.session.add(item)
+        db.session.flush()
+        enqueue(SHOPPING_LIST_ADD, {"item": ingredient_name, "local_id": item.id}, user_id=g.user.id,
+                idempotency_key=f"{SHOPPING_LIST_ADD}:{g.user.id}:{item.id}")
 
     return redirect(f"/user/{g.user.id}/shoppinglist")
 
 
-@app.route('/shoppinglist/delete/<int:ingredient_id>', methods=["GET", "DELETE"])
-def delete_from_shoppinglist(ingredient_id):
-    """Delete an item from a user's shopping list."""
+@main.route('/recipes/<int:recipe_id>/shoppinglist', methods=["POST"])
+async def add_recipe_to_shoppinglist(recipe_id):
+    """Add all of a recipe's ingredients, or the chosen ones, to a user's shopping list.
+
+    Ingredients with the same name and unit are added up, with each other and with the
+    items already on the list, and the API calls are queued as one job."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(g.user.id)
-    username = user.api_username
-    hash = user.hash
-    res = requests.delete(f"{API_BASE_URL}mealplanner/{username}/shopping-list/items/{ingredient_id}",
-                          params={'apiKey': API_KEY, 'username': username, 'hash': hash})
+    recipe = await get_recipe_information(recipe_id)
+    if recipe is None:
+        flash("Sorry, that recipe could not be found.", "danger")
+        return redirect('/recipes/search')
+    ingredients = recipe.get('extendedIngredients', [])
+    selection = "all"
+    if 'selected' in request.form:
+        chosen = set(request.form.getlist('ingredient'))
+        ingredients = [ingredient for (i, ingredient) in enumerate(ingredients)
+                       if str(i) in chosen]
+        selection = ",".join(str(i) for i in sorted(
+            int(i) for i in chosen if i.isdigit()))
+    if not ingredients:
+        flash("Please choose the ingredients to add.", "danger")
+        return redirect(f"/recipes/{recipe_id}")
+    key = f"{SHOPPING_LIST_ADD_MANY}:{g.user.id}:{recipe_id}:{selection}"
+    if Job.query.filter(Job.idempotency_key == key, Job.status.in_(('pending', 'running'))).count():
+        # submitted twice, the ingredients are already on their way
+        flash("These ingredients are already being added to your shopping list.", "info")
+        return redirect(f"/user/{g.user.id}/shoppinglist")
+
+    (items, replaced) = ShoppingListItem.add_ingredients(g.user.id, ingredients)
+    for upstream_id in replaced:
+        enqueue(SHOPPING_LIST_DELETE, {"id": upstream_id}, user_id=g.user.id,
+                idempotency_key=f"{SHOPPING_LIST_DELETE}:{g.user.id}:{upstream_id}")
+    enqueue(SHOPPING_LIST_ADD_MANY, {"recipe_id": recipe_id,
+                                     "items": [{"local_id": item.id, "name": item.name}
+                                               for item in items]},
+            user_id=g.user.id, idempotency_key=key)
+    flash(f"Added {len(items)} ingredients to your shopping list.", "success")
+    return redirect(f"/user/{g.user.id}/shoppinglist")
+
+
+@main.route('/shoppinglist/delete/<int:item_id>', methods=["GET", "DELETE"])
+def delete_from_shoppinglist(item_id):
+    """Delete an item from a user's shopping list.
+
+    The item leaves the local copy straight away and the API call is queued for the worker."""
+    if not g.user:
+        flash("Unauthorized access. Please login.", "danger")
+        return redirect("/")
+    item = ShoppingListItem.query.filter_by(
+        id=item_id, user_id=g.user.id).first()
+    if item:
+        db.session.delete(item)
+        if item.upstream_id is None:
+            # not on the API yet, the queued add sees the item is gone and removes it again
+            db.session.commit()
+        else:
+            enqueue(SHOPPING_LIST_DELETE, {"id": item.upstream_id}, user_id=g.user.id,
+                    idempotency_key=f"{SHOPPING_LIST_DELETE}:{g.user.id}:{item.upstream_id}")
     return redirect(f"/user/{g.user.id}/shoppinglist")
 
 
@@ -431,8 +835,8 @@ def get_recipe_ids(recipes):
     return user_recipes
 
 
-@app.route('/user/<int:user_id>/saved-recipes')
-def get_user_saved_recipes(user_id):
+@main.route('/user/<int:user_id>/saved-recipes')
+async def get_user_saved_recipes(user_id):
     """Shows user's saved recipes."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
@@ -442,16 +846,13 @@ def get_user_saved_recipes(user_id):
         flash("No recipes currently saved.", "info")
         return redirect('/')
     user_recipes = get_recipe_ids(all_user_recipes)
-    recipes = []
-    for recipe in all_user_recipes:
-        res = requests.get(
-            f"{API_BASE_URL}recipes/{recipe.recipe_id}/information", params={'apiKey': API_KEY})
-        recipes.append(res.json())
+    recipes = await get_recipes_information(
+        get_saved_recipe_ids(all_user_recipes))
     return render_template('users/saved-or-favourite.html', recipes=recipes, user_recipes=user_recipes)
 
 
-@app.route('/user/<int:user_id>/favourite-recipes')
-def get_user_favourite_recipes(user_id):
+@main.route('/user/<int:user_id>/favourite-recipes')
+async def get_user_favourite_recipes(user_id):
     """Shows user's favourite recipes."""
     if not g.user:
         flash("Unauthorized access. Please login.", "danger")
@@ -462,17 +863,27 @@ def get_user_favourite_recipes(user_id):
         flash("No recipes currently in favourites.", "info")
         return redirect('/')
     user_recipes = get_recipe_ids(full_user_recipes)
-    recipes = []
-    for recipe in full_user_recipes:
-        res = requests.get(
-            f"{API_BASE_URL}recipes/{recipe.recipe_id}/information", params={'apiKey': API_KEY})
-        recipes.append(res.json())
+    recipes = await get_recipes_information(
+        get_saved_recipe_ids(full_user_recipes))
     return render_template('users/saved-or-favourite.html', recipes=recipes, user_recipes=user_recipes)
 
 # *********************************************************************** #
 
 
-@app.after_request
+@main.app_errorhandler(QuotaExceeded)
+def handle_quota_exceeded(error):
+    """Lets the user know the recipe service is unavailable when the API budget has run out."""
+    flash("Our recipe service is very busy right now. Please try again a little later.", "info")
+    return redirect("/")
+
+
+@main.cli.command('quota')
+def show_quota():
+    """Print the remaining API budget, burn rate and points used per endpoint and route."""
+    print(json.dumps(limiter.status(), indent=2))
+
+
+@main.after_app_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
@@ -481,3 +892,192 @@ def add_header(req):
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
     return req
+
+
+@main.cli.command('provision-users')
+def provision_users():
+    """Connect the users that signed up without getting an API account to the API."""
+    users = User.query.filter(User.hash.is_(None)).all()
+    provisioned = sum(1 for user in users if provision_user(user.id))
+    print(f"Provisioned {provisioned} of {len(users)} users.")
+
+
+@main.cli.command('worker')
+@click.option('--once', is_flag=True, help="Exit once no job is due instead of polling.")
+@click.option('--poll-interval', default=1.0, help="Seconds to wait when no job is due.")
+def worker(once, poll_interval):
+    """Run the queued API writes, retrying failed ones with backoff."""
+    ran = work(once=once, poll_interval=poll_interval)
+    print(f"Ran {ran} jobs.")
+
+
+@main.cli.command('jobs')
+@click.option('--limit', default=20, help="Most pending and failed jobs to list.")
+def show_jobs(limit):
+    """Print the number of jobs per status and the pending and failed jobs."""
+    counts = dict(db.session.query(Job.status, db.func.count()).group_by(Job.status).all())
+    print(", ".join(f"{status}: {counts.get(status, 0)}" for status in Job.STATUSES))
+    jobs = (Job.query.filter(Job.status.in_(('pending', 'running', 'failed')))
+            .order_by(Job.run_at).limit(limit).all())
+    for job in jobs:
+        print(f"{job.id:>8} {job.status:<8} {job.kind:<22} user {job.user_id} attempts {job.attempts}/"
+              f"{job.max_attempts} due {job.run_at:%Y-%m-%d %H:%M:%S} {job.last_error or ''}")
+
+
+def migration_names():
+    """Returns the names of the SQL migrations in MIGRATIONS_DIR, in the order to apply them."""
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+
+
+def apply_migrations():
+    """Applies the SQL migrations that have not been applied to the database yet."""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = {m.name for m in SchemaMigration.query.all()}
+    for name in migration_names():
+        if name in applied:
+            continue
+        try:
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                db.session.connection().exec_driver_sql(f.read())
+            db.session.add(SchemaMigration(name=name))
+            db.session.commit()
+        except Exception:
+            # leave the session usable, the migration is retried on the next run
+            db.session.rollback()
+            raise
+        print(f"Applied {name}.")
+
+
+@main.cli.command('init-db')
+def init_db():
+    """Create the database tables, or bring an existing database up to date."""
+    if inspect(db.engine).has_table(User.__tablename__):
+        # tables created from older models only catch up through the migrations
+        apply_migrations()
+        print("Database tables already exist, migrations applied.")
+        return
+    db.create_all()
+    # a schema created from the models is already up to date with every migration
+    db.session.add_all(SchemaMigration(name=name) for name in migration_names())
+    db.session.commit()
+    print("Database tables created.")
+
+
+@main.cli.command('migrate')
+def migrate():
+    """Apply the SQL migrations that have not been applied to the database yet."""
+    apply_migrations()
+
+
+# *********************************************************************** #
+# App factory
+
+
+def create_app(profile=None):
+    """Creates the app with the settings of a profile: dev, test or prod.
+
+    The profile defaults to APP_PROFILE, or dev. Tables are not created here, run
+    `flask init-db` once per database instead."""
+    profile = profile or os.environ.get('APP_PROFILE', 'dev')
+    app = Flask(__name__)
+    app.config['PROFILE'] = profile
+    database_url = os.environ.get(
+        'DATABASE_URL', 'postgresql:///fridge_raiders-test' if profile == 'test' else None)
+    if not database_url:
+        raise RuntimeError(f"DATABASE_URL must be set for the {profile} profile")
+    # Heroku hands out postgres:// urls, which SQLAlchemy no longer accepts
+    app.config['SQLALCHEMY_DATABASE_URI'] = re.sub(
+        r'^postgres://', 'postgresql://', database_url)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['API_KEY'] = os.environ.get('API_KEY')
+    # Recipe details rarely change upstream, so they can be kept for a long time
+    app.config['RECIPE_CACHE_TTL'] = int(
+        os.environ.get('RECIPE_CACHE_TTL', 60 * 60 * 24))
+    app.config['RECIPE_CACHE_MAX_SIZE'] = int(
+        os.environ.get('RECIPE_CACHE_MAX_SIZE', 2000))
+    # Age after which recipe details stored in the database are refreshed from the API
+    app.config['RECIPE_CATALOG_MAX_AGE'] = int(
+        os.environ.get('RECIPE_CATALOG_MAX_AGE', 60 * 60 * 24 * 7))
+    # Substitutes for an ingredient are close to static, keep them for a month
+    app.config['SUBSTITUTE_MAX_AGE'] = int(
+        os.environ.get('SUBSTITUTE_MAX_AGE', 60 * 60 * 24 * 30))
+    # Fetch the substitutes of every ingredient on a recipe page along with it, at a
+    # point per ingredient the first time it is seen
+    app.config['SUBSTITUTE_PREFETCH'] = os.environ.get(
+        'SUBSTITUTE_PREFETCH') == '1'
+    # Similar recipes only change as recipes are added upstream
+    app.config['SIMILAR_RECIPES_MAX_AGE'] = int(
+        os.environ.get('SIMILAR_RECIPES_MAX_AGE', 60 * 60 * 24 * 7))
+    # Threads per worker fetching API data in the background ahead of the requests needing it
+    app.config['PREFETCH_WORKERS'] = int(
+        os.environ.get('PREFETCH_WORKERS', 2))
+    # Search results whose details are prefetched, 0 turns it off
+    app.config['PREFETCH_RESULTS'] = int(
+        os.environ.get('PREFETCH_RESULTS', 3))
+    # Answer searches from the recipes stored so far when they have enough matches,
+    # instead of only when the API fails
+    app.config['LOCAL_SEARCH_FIRST'] = os.environ.get(
+        'LOCAL_SEARCH_FIRST') == '1'
+    # Age in seconds after which a worker rebuilds its fridge index from the stored recipes
+    app.config['FRIDGE_INDEX_MAX_AGE'] = int(
+        os.environ.get('FRIDGE_INDEX_MAX_AGE', 60 * 10))
+    # Search results change as recipes are added upstream, so only keep them briefly
+    app.config['SEARCH_CACHE_TTL'] = int(
+        os.environ.get('SEARCH_CACHE_TTL', 60 * 10))
+    app.config['SEARCH_CACHE_MAX_SIZE'] = int(
+        os.environ.get('SEARCH_CACHE_MAX_SIZE', 500))
+    # Result sets of searches are kept server side, the session only holds their id
+    app.config['SEARCH_RESULTS_MAX_AGE'] = int(
+        os.environ.get('SEARCH_RESULTS_MAX_AGE', 60 * 60))
+    app.config['SEARCH_RESULTS_PER_USER'] = int(
+        os.environ.get('SEARCH_RESULTS_PER_USER', 5))
+    # How long a worker trusts its cached copy of the logged in user
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+    app.config['USER_CACHE_MAX_SIZE'] = int(
+        os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+    # Attempts and initial backoff in seconds for connecting new users to the API
+    app.config['PROVISION_RETRIES'] = int(
+        os.environ.get('PROVISION_RETRIES', 5))
+    app.config['PROVISION_BACKOFF'] = float(
+        os.environ.get('PROVISION_BACKOFF', 1))
+    # Age after which the local copy of a shopping list is synced from the API again
+    app.config['SHOPPING_LIST_MAX_AGE'] = int(
+        os.environ.get('SHOPPING_LIST_MAX_AGE', 60 * 60))
+    # Attempts, initial backoff and lease in seconds for the jobs run by `flask worker`
+    app.config['JOB_MAX_ATTEMPTS'] = int(
+        os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_BACKOFF'] = float(os.environ.get('JOB_BACKOFF', 2))
+    app.config['JOB_LEASE'] = int(os.environ.get('JOB_LEASE', 60))
+    # bcrypt work factor, and how many hashes a worker computes at once
+    app.config['BCRYPT_LOG_ROUNDS'] = int(
+        os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', 2))
+    # Append the span traces of every request to this JSON lines file, if set
+    app.config['TRACE_FILE'] = os.environ.get('TRACE_FILE')
+    app.config.update(PROFILES[profile])
+
+    connect_db(app)
+    app.register_blueprint(main)
+    init_tracing(app, db)
+
+    app.extensions['recipe_cache'] = TTLCache(ttl=app.config['RECIPE_CACHE_TTL'],
+                                              maxsize=app.config['RECIPE_CACHE_MAX_SIZE'])
+    app.extensions['search_cache'] = TTLCache(ttl=app.config['SEARCH_CACHE_TTL'],
+                                              maxsize=app.config['SEARCH_CACHE_MAX_SIZE'])
+    app.extensions['fridge_index'] = FridgeCatalog(
+        load_fridge_recipes, max_age=app.config['FRIDGE_INDEX_MAX_AGE'])
+    app.extensions['prefetcher'] = Prefetcher(
+        app, workers=app.config['PREFETCH_WORKERS'])
+    app.extensions['user_cache'] = TTLCache(ttl=app.config['USER_CACHE_TTL'],
+                                            maxsize=app.config['USER_CACHE_MAX_SIZE'])
+
+    if app.config['DEBUG_TOOLBAR']:
+        # only imported where it is used, it is a sizeable import for every worker
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    return app
+
+
+app = create_app()
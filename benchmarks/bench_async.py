@@ -0,0 +1,112 @@
+"""Benchmark the async upstream fan-out against the sync client for Fridge Raiders app (CAPSTONE ONE).
+
+Starts a local stand-in for Spoonacular that answers recipes/{id}/information after a
+fixed delay, then fetches the same ids with:
+
+* sync-sequential: one blocking call after another, as the views used to do
+* sync-threads: the sync client on a thread pool of MAX_CONCURRENT_FETCHES threads
+* async: the async client with asyncio.gather, as the async views now do
+
+Run from the repository root:
+
+    python benchmarks/bench_async.py --ids 40 --latency 0.2
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spoonacular import SpoonacularClient, AsyncSpoonacularClient  # noqa: E402
+
+MAX_CONCURRENT_FETCHES = 8
+
+
+def start_upstream(latency):
+    """Starts the stand-in upstream in a thread and returns its base url."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            recipe_id = self.path.split('/')[2]
+            body = json.dumps({"id": int(recipe_id), "title": f"Recipe {recipe_id}"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def sync_sequential(client, ids):
+    """Fetches the recipes one after another."""
+    return [client.recipe_information(i).json() for i in ids]
+
+
+def sync_threads(client, ids):
+    """Fetches the recipes on a bounded thread pool."""
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as executor:
+        return list(executor.map(lambda i: client.recipe_information(i).json(), ids))
+
+
+def run_async(client, ids):
+    """Fetches the recipes concurrently on an event loop, bounded by a semaphore."""
+    async def fetch_all():
+        limit = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def fetch_one(i):
+            async with limit:
+                return (await client.recipe_information(i)).json()
+        return await asyncio.gather(*(fetch_one(i) for i in ids))
+    return asyncio.run(fetch_all())
+
+
+def main():
+    """Runs every mode and prints the median time of each."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--ids", type=int, default=40,
+                        help="number of recipes fetched per run")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="upstream latency in seconds")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per mode, the median is reported")
+    args = parser.parse_args()
+
+    base_url = start_upstream(args.latency)
+    ids = list(range(1, args.ids + 1))
+    modes = {"sync-sequential": (sync_sequential, SpoonacularClient(base_url=base_url, api_key="bench")),
+             "sync-threads": (sync_threads, SpoonacularClient(base_url=base_url, api_key="bench")),
+             "async": (run_async, AsyncSpoonacularClient(base_url=base_url, api_key="bench"))}
+
+    print(f"{args.ids} recipes, {args.latency * 1000:.0f} ms upstream latency")
+    print(f"{'mode':<16}{'median s':>10}{'recipes/s':>12}")
+    for name, (run, client) in modes.items():
+        run(client, ids[:2])  # warm up connections
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            recipes = run(client, ids)
+            timings.append(time.perf_counter() - start)
+            assert len(recipes) == len(ids)
+        median = statistics.median(timings)
+        print(f"{name:<16}{median:>10.3f}{len(ids) / median:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark the in-process fridge matcher for Fridge Raiders app (CAPSTONE ONE).
+
+Builds a synthetic catalog of recipes for every size, with ingredient names drawn
+from a shared vocabulary the way common ingredients (salt, onion) turn up far more
+often than rare ones, and answers random fridges of a few ingredients with:
+
+* scan: a pure Python loop over every recipe, matching words like the index does
+* index: FridgeIndex, the inverted index scored with NumPy used by the app
+
+Prints the index build time and p50/p95 latency per search for both rankings. No
+database or API is needed. Run from the repository root:
+
+    python benchmarks/bench_fridge.py --recipes 10000 100000 --searches 200
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fridge import FridgeIndex, contains, tokens  # noqa: E402
+
+
+def percentile(samples, pct):
+    """Returns the nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def make_catalog(size, vocabulary, rng):
+    """Returns size recipes of 5 to 15 ingredients, common names picked most often."""
+    names = [f"ingredient {i:05d}" for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    recipes = []
+    for recipe_id in range(size):
+        picked = set(rng.choices(names, weights=weights, k=rng.randint(5, 15)))
+        recipes.append({"id": recipe_id, "title": f"Recipe {recipe_id}", "image": None,
+                        "aggregateLikes": rng.randint(0, 1000),
+                        "extendedIngredients": [{"id": int(name.split()[1]), "name": name,
+                                                 "amount": 1, "unit": ""} for name in picked]})
+    return (recipes, names)
+
+
+def scan_catalog(recipes):
+    """Returns (id, ingredient words, likes) for every recipe, the words split once up front."""
+    return [(recipe['id'], [tokens(i['name']) for i in recipe['extendedIngredients']],
+             recipe['aggregateLikes']) for recipe in recipes]
+
+
+def scan(catalog, ingredients, ranking, number):
+    """Matches a fridge by looping over every recipe, returning (id, used, missed, likes) tuples."""
+    phrases = [tokens(i) for i in ingredients]
+    found = []
+    for (recipe_id, names, likes) in catalog:
+        used = sum(1 for name in names if any(contains(name, phrase) for phrase in phrases))
+        if used:
+            found.append((recipe_id, used, len(names) - used, likes))
+    if ranking == 2:
+        found.sort(key=lambda r: (r[2], -r[1], -r[3]))
+    else:
+        found.sort(key=lambda r: (-r[1], r[2], -r[3]))
+    return found[:number]
+
+
+def time_searches(search, fridges):
+    """Runs search on every fridge and returns the latencies in ms."""
+    latencies = []
+    for fridge in fridges:
+        started = time.perf_counter()
+        search(fridge)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def main():
+    """Benchmarks every catalog size and prints a row per engine and ranking."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--recipes", type=int, nargs="+", default=[10000, 100000],
+                        help="catalog sizes to compare")
+    parser.add_argument("--vocabulary", type=int, default=5000,
+                        help="distinct ingredient names in the catalog")
+    parser.add_argument("--searches", type=int, default=200,
+                        help="fridges searched per engine and ranking")
+    parser.add_argument("--scan-searches", type=int, default=20,
+                        help="of those, fridges searched by the much slower scan")
+    parser.add_argument("--number", type=int, default=10,
+                        help="recipes returned per search")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'recipes':<9}{'engine':<7}{'ranking':>8}{'build ms':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for size in args.recipes:
+        rng = random.Random(args.seed)
+        (recipes, names) = make_catalog(size, args.vocabulary, rng)
+        fridges = [rng.sample(names[:500], rng.randint(3, 8)) for _ in range(args.searches)]
+
+        started = time.perf_counter()
+        index = FridgeIndex(recipes)
+        build_ms = (time.perf_counter() - started) * 1000
+        catalog = scan_catalog(recipes)
+
+        for ranking in (1, 2):
+            for (engine, build, searched, search) in (
+                    ("scan", 0, fridges[:args.scan_searches],
+                     lambda fridge: scan(catalog, fridge, ranking, args.number)),
+                    ("index", build_ms, fridges,
+                     lambda fridge: index.match(fridge, ranking, args.number))):
+                latencies = time_searches(search, searched)
+                print(f"{size:<9}{engine:<7}{ranking:>8}{build:>10.1f}"
+                      f"{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
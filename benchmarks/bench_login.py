@@ -0,0 +1,100 @@
+"""Benchmark login throughput per bcrypt work factor for Fridge Raiders app (CAPSTONE ONE).
+
+For every cost, builds the app with BCRYPT_LOG_ROUNDS set to it, adds a user whose
+password is hashed at that cost and logs in from concurrent clients, the way a burst of
+logins hits a gthread worker. Prints the time of a single hash, logins per second and
+p50/p95 login latency, to pick the highest cost the hardware can afford. Needs
+DATABASE_URL and SECRET_KEY like the app itself and the tables created with
+`flask init-db`. Run from the repository root:
+
+    python benchmarks/bench_login.py --rounds 10 11 12 13 --clients 8 --logins 64
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import math
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub_api  # noqa: E402
+
+os.environ.setdefault('API_BASE_URL', stub_api.serve_in_background())
+
+from app import create_app  # noqa: E402
+from models import db, User  # noqa: E402
+from passwords import bcrypt  # noqa: E402
+
+PASSWORD = "benchmark"
+
+
+def percentile(samples, pct):
+    """Returns the nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def measure(rounds, workers, clients, logins):
+    """Logs in concurrently at one cost and returns hash ms, logins/s, p50 and p95 ms."""
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(rounds)
+    os.environ['BCRYPT_WORKERS'] = str(workers)
+    app = create_app('prod')
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    started = time.perf_counter()
+    hashed = bcrypt.generate_password_hash(PASSWORD, rounds).decode('UTF-8')
+    hash_time = time.perf_counter() - started
+
+    username = f"bench{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        db.session.add(User(username=username, first_name="Bench", last_name="Mark",
+                            email=f"{username}@example.com", password=hashed,
+                            hash="benchmark", api_username=username))
+        db.session.commit()
+
+    def login(_):
+        client = app.test_client()
+        start = time.perf_counter()
+        res = client.post('/login', data={'username': username, 'password': PASSWORD})
+        assert res.status_code == 302, res.status_code
+        return time.perf_counter() - start
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            latencies = list(executor.map(login, range(logins)))
+        wall_time = time.perf_counter() - started
+    finally:
+        with app.app_context():
+            User.query.filter_by(username=username).delete()
+            db.session.commit()
+            db.engine.dispose()
+    return (hash_time * 1000, logins / wall_time,
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000)
+
+
+def main():
+    """Measures every cost and prints a row for each."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13],
+                        help="bcrypt work factors to compare")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="hashing threads per worker, BCRYPT_WORKERS")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="concurrent logins, like the threads of a gthread worker")
+    parser.add_argument("--logins", type=int, default=64,
+                        help="logins per cost")
+    args = parser.parse_args()
+
+    print(f"{'rounds':<8}{'hash ms':>9}{'logins/s':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for rounds in args.rounds:
+        (hash_ms, throughput, p50, p95) = measure(rounds, args.workers,
+                                                  args.clients, args.logins)
+        print(f"{rounds:<8}{hash_ms:>9.1f}{throughput:>10.1f}{p50:>9.1f}{p95:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
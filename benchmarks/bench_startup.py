@@ -0,0 +1,62 @@
+"""Benchmark worker boot time and per-request overhead for Fridge Raiders app (CAPSTONE ONE).
+
+Boots the app in a fresh interpreter for each profile, the way a gunicorn worker imports
+app:app, and times the import. Then serves the homepage through the test client and
+times the mean request. Needs DATABASE_URL and SECRET_KEY like the app itself. Run from
+the repository root:
+
+    python benchmarks/bench_startup.py --profiles dev prod --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter, prints the import time and mean request time in seconds
+CHILD = """
+import json, time
+started = time.perf_counter()
+from app import app
+booted = time.perf_counter() - started
+client = app.test_client()
+client.get('/')
+started = time.perf_counter()
+for _ in range({requests}):
+    client.get('/')
+print(json.dumps([booted, (time.perf_counter() - started) / {requests}]))
+"""
+
+
+def measure(profile, requests):
+    """Boots the app with a profile in a new interpreter and returns its timings."""
+    env = {**os.environ, 'APP_PROFILE': profile}
+    out = subprocess.run([sys.executable, '-c', CHILD.format(requests=requests)], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    """Measures every profile and prints the median of each."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--profiles", nargs="+", default=["dev", "prod"])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="boots per profile, the median is reported")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="homepage requests per boot")
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'boot ms':>10}{'request ms':>12}")
+    for profile in args.profiles:
+        timings = [measure(profile, args.requests) for _ in range(args.repeat)]
+        boot = statistics.median(t[0] for t in timings)
+        request = statistics.median(t[1] for t in timings)
+        print(f"{profile:<10}{boot * 1000:>10.1f}{request * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
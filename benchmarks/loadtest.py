@@ -0,0 +1,259 @@
+"""Route-level load test for Fridge Raiders app (CAPSTONE ONE).
+
+Drives concurrent virtual users through the journey a real user takes: signup, logout
+and login, a recipe search, the recipe details, saving and favouriting it, a fridge
+search, the shopping list and similar recipes. Reports throughput and p50/p95/p99
+latency per route, along with the database queries and upstream calls each route made.
+
+Query and upstream call counts are read from the Server-Timing header of every
+response. By default app:app is served in-process against the offline stand-in API
+(stub_api.py) with the prod profile, which needs DATABASE_URL and SECRET_KEY like the
+app itself and the tables created with `flask init-db`. Pass --url to load an app that
+is already running instead. Run from the repository root:
+
+    python benchmarks/loadtest.py run --users 8 --journeys 4 --out before.json
+    python benchmarks/loadtest.py run --users 8 --journeys 4 --out after.json
+    python benchmarks/loadtest.py compare before.json after.json --threshold 0.1
+
+compare exits with status 1 when a route got slower or lost throughput beyond the
+threshold, so it can gate a deploy.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from tracing import parse_server_timing  # noqa: E402
+
+CUISINES = ['spanish', 'french', 'italian', 'indian', 'british', 'american']
+FRIDGE = ['peas', 'cheese', 'chicken', 'garlic', 'tomatoes', 'butter', 'onion']
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+RECIPE_LINK = re.compile(r'href="/recipes/(\d+)"')
+USER_LINK = re.compile(r'href="/user/(\d+)/saved-recipes"')
+INGREDIENT_LINK = re.compile(r'href="/shoppinglist/add/([^"]+)"')
+
+
+def percentile(samples, pct):
+    """Returns the nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class VirtualUser:
+    """A browser session going through the app, timing every request by route."""
+
+    def __init__(self, base_url, samples, lock):
+        self.base_url = base_url.rstrip('/')
+        self.http = requests.Session()
+        self.samples = samples
+        self.lock = lock
+
+    def request(self, method, route, path, data=None):
+        """Sends one request without following redirects and records it under route."""
+        start = time.perf_counter()
+        res = self.http.request(method, self.base_url + path, data=data,
+                                allow_redirects=False)
+        elapsed = time.perf_counter() - start
+        timing = parse_server_timing(res.headers.get('Server-Timing'))
+        sample = {"route": f"{method} {route}", "seconds": elapsed, "status": res.status_code,
+                  "queries": int(timing.get('db', (0, '0'))[1]),
+                  "upstream": int(timing.get('upstream', (0, '0'))[1])}
+        with self.lock:
+            self.samples.append(sample)
+        return res
+
+    def submit(self, route, path, data):
+        """Loads a form page and posts it back with its CSRF token."""
+        page = self.request('GET', route, path)
+        token = CSRF_TOKEN.search(page.text)
+        if token:
+            data = {**data, 'csrf_token': token.group(1)}
+        return self.request('POST', route, path, data=data)
+
+    def journey(self, username):
+        """Goes through the app the way a new user would."""
+        password = "loadtest"
+        self.submit('/signup', '/signup', {'username': username, 'first_name': "Load", 'last_name': "Test",
+                                           'email': f"{username}@example.com", 'password': password})
+        self.request('GET', '/logout', '/logout')
+        self.submit('/login', '/login',
+                    {'username': username, 'password': password})
+        home = self.request('GET', '/', '/')
+        user_id = USER_LINK.search(home.text).group(1)
+
+        self.submit('/recipes/search', '/recipes/search',
+                    {'cuisine': random.choice(CUISINES), 'maxReadyTime': 60, 'number': 5})
+        results = self.request('GET', '/recipes', '/recipes')
+        recipe_ids = RECIPE_LINK.findall(results.text) or ['1095841']
+        recipe_id = random.choice(recipe_ids)
+        details = self.request('GET', '/recipes/<id>', f"/recipes/{recipe_id}")
+        self.request('POST', '/recipes/<id>/saved',
+                     f"/recipes/{recipe_id}/saved")
+        self.request('POST', '/recipes/<id>/favourite',
+                     f"/recipes/{recipe_id}/favourite")
+        self.request('GET', '/user/<id>/saved-recipes',
+                     f"/user/{user_id}/saved-recipes")
+        self.request('GET', '/user/<id>/favourite-recipes',
+                     f"/user/{user_id}/favourite-recipes")
+
+        self.submit('/recipes/byIngredients', '/recipes/byIngredients',
+                    {'ingredients': ",".join(random.sample(FRIDGE, 3)), 'ranking': 2, 'number': 5})
+        self.request('GET', '/recipes/results', '/recipes/results')
+
+        ingredients = INGREDIENT_LINK.findall(details.text) or ['peas']
+        self.request('GET', '/shoppinglist/add/<name>',
+                     f"/shoppinglist/add/{random.choice(ingredients)}")
+        self.request('GET', '/user/<id>/shoppinglist',
+                     f"/user/{user_id}/shoppinglist")
+        self.request('GET', '/recipes/<id>/similar',
+                     f"/recipes/{recipe_id}/similar")
+
+
+def serve_app():
+    """Serves app:app in-process against the stand-in API.
+
+    Returns the base url and a cleanup function."""
+    import stub_api
+    os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+    os.environ.setdefault('APP_PROFILE', 'prod')
+
+    from werkzeug.serving import make_server
+    from app import app
+    from models import db, User
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def cleanup(prefix):
+        with app.app_context():
+            User.query.filter(User.username.startswith(prefix)).delete(
+                synchronize_session=False)
+            db.session.commit()
+        server.shutdown()
+    return f"http://127.0.0.1:{server.server_port}", cleanup
+
+
+def summarize(samples, wall_time):
+    """Returns throughput, latency percentiles and mean counts per route."""
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample["route"], []).append(sample)
+    summary = {}
+    for route, route_samples in sorted(routes.items()):
+        seconds = [s["seconds"] for s in route_samples]
+        summary[route] = {"requests": len(route_samples),
+                          "errors": sum(1 for s in route_samples if s["status"] >= 500),
+                          "throughput": len(route_samples) / wall_time,
+                          "p50": percentile(seconds, 50),
+                          "p95": percentile(seconds, 95),
+                          "p99": percentile(seconds, 99),
+                          "queries": sum(s["queries"] for s in route_samples) / len(route_samples),
+                          "upstream": sum(s["upstream"] for s in route_samples) / len(route_samples)}
+    return summary
+
+
+def print_summary(result):
+    """Prints a run as a table."""
+    print(f"{result['users']} users x {result['journeys']} journeys, {result['requests']} requests "
+          f"in {result['wall_time']:.2f} s ({result['requests'] / result['wall_time']:.1f} req/s)")
+    print(f"{'route':<36}{'reqs':>6}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'queries':>9}{'upstream':>10}")
+    for route, stats in result["routes"].items():
+        print(f"{route:<36}{stats['requests']:>6}{stats['errors']:>5}{stats['throughput']:>8.1f}"
+              f"{stats['p50'] * 1000:>9.1f}{stats['p95'] * 1000:>9.1f}{stats['p99'] * 1000:>9.1f}"
+              f"{stats['queries']:>9.1f}{stats['upstream']:>10.1f}")
+
+
+def run(args):
+    """Runs the journeys and prints, and optionally saves, the results."""
+    cleanup = None
+    base_url = args.url
+    if base_url is None:
+        base_url, cleanup = serve_app()
+    prefix = f"load{uuid.uuid4().hex[:8]}"
+    samples = []
+    lock = threading.Lock()
+
+    def user_journeys(user):
+        for journey in range(args.journeys):
+            VirtualUser(base_url, samples, lock).journey(
+                f"{prefix}u{user}j{journey}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        list(executor.map(user_journeys, range(args.users)))
+    wall_time = time.perf_counter() - start
+    if cleanup:
+        cleanup(prefix)
+
+    result = {"users": args.users, "journeys": args.journeys, "requests": len(samples),
+              "wall_time": wall_time, "routes": summarize(samples, wall_time)}
+    print_summary(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+def compare(args):
+    """Compares two saved runs route by route and flags regressions."""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = []
+    print(f"{'route':<36}{'p95 ms':>16}{'change':>9}{'req/s':>14}{'change':>9}")
+    for route, stats in new["routes"].items():
+        old = base["routes"].get(route)
+        if old is None:
+            continue
+        p95_change = stats["p95"] / old["p95"] - 1
+        throughput_change = stats["throughput"] / old["throughput"] - 1
+        flag = ""
+        if p95_change > args.threshold or throughput_change < -args.threshold:
+            regressions.append(route)
+            flag = "  REGRESSION"
+        print(f"{route:<36}{old['p95'] * 1000:>7.1f} -> {stats['p95'] * 1000:<6.1f}{p95_change:>+9.0%}"
+              f"{old['throughput']:>6.1f} -> {stats['throughput']:<5.1f}{throughput_change:>+9.0%}{flag}")
+    if regressions:
+        print(f"{len(regressions)} route(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the load test")
+    run_parser.add_argument("--users", type=int, default=8,
+                            help="concurrent virtual users")
+    run_parser.add_argument("--journeys", type=int, default=4,
+                            help="journeys per virtual user")
+    run_parser.add_argument("--url", help="base url of a running app to load instead of "
+                                          "serving app:app in-process")
+    run_parser.add_argument("--out", help="save the results as JSON, for compare")
+    run_parser.set_defaults(handler=run)
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative change in p95 or throughput counted as a regression")
+    compare_parser.set_defaults(handler=compare)
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""In-process "What's in your fridge?" matcher for Fridge Raiders app (CAPSTONE ONE).
+
+Answers findByIngredients from the recipes stored in recipe_details. Every ingredient
+name is mapped to the recipes using it in an inverted index kept as flat NumPy arrays,
+so a search only touches the recipes sharing an ingredient with the fridge and is
+scored for the whole catalog at once. A fridge ingredient is found in every recipe
+ingredient containing its words in order, plural or not: "cheese" matches "parmesan
+cheese" and "egg" matches "eggs", but "egg" does not match "eggplant". Each worker
+keeps its own index and rebuilds it from the database every FRIDGE_INDEX_MAX_AGE
+seconds.
+"""
+
+from threading import Lock
+import numpy as np
+import re
+import time
+
+# Fields of a recipe's extendedIngredients kept for the results page
+INGREDIENT_FIELDS = ('id', 'name', 'amount', 'unit', 'image', 'original')
+
+
+def singular(word):
+    """Returns a word without a plain English plural ending, "tomatoes" -> "tomato"."""
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('oes') or word.endswith('ches') or word.endswith('shes'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def tokens(name):
+    """Returns the words of an ingredient name, lowercased and singular."""
+    return tuple(singular(word) for word in re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def contains(words, phrase):
+    """Returns True if the words hold every word of phrase, in order and next to each other."""
+    size = len(phrase)
+    return size > 0 and any(words[i:i + size] == phrase for i in range(len(words) - size + 1))
+
+
+class FridgeIndex:
+    """An inverted index from ingredient names to the recipes using them."""
+
+    def __init__(self, recipes):
+        """Builds the index from recipes shaped like the API's recipe information."""
+        self.recipes = []
+        terms = {}
+        postings = []
+        for recipe in recipes:
+            row = len(self.recipes)
+            ingredients = {}
+            for ingredient in recipe.get('extendedIngredients') or []:
+                name = (ingredient.get('name') or '').lower()
+                if name and name not in ingredients:
+                    ingredients[name] = {k: ingredient.get(k) for k in INGREDIENT_FIELDS}
+            for name in ingredients:
+                term = terms.setdefault(name, len(terms))
+                if term == len(postings):
+                    postings.append([])
+                postings[term].append(row)
+            self.recipes.append({"id": recipe['id'], "title": recipe.get('title', ''),
+                                 "image": recipe.get('image'),
+                                 "imageType": recipe.get('imageType') or 'jpg',
+                                 "likes": recipe.get('aggregateLikes') or 0,
+                                 "ingredients": ingredients})
+        self.term_words = [tokens(name) for name in terms]
+        # the ingredient names with each word, to find the names holding a fridge ingredient
+        by_word = {}
+        for (term, words) in enumerate(self.term_words):
+            for word in set(words):
+                by_word.setdefault(word, []).append(term)
+        self.words = {word: np.array(terms, dtype=np.int64) for (word, terms) in by_word.items()}
+        # the recipes using term t are rows[offsets[t]:offsets[t + 1]]
+        self.offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in postings], out=self.offsets[1:])
+        self.rows = np.fromiter((row for rows in postings for row in rows),
+                                dtype=np.int32, count=int(self.offsets[-1]))
+        self.ingredient_counts = np.array([len(r['ingredients']) for r in self.recipes],
+                                          dtype=np.int32)
+        self.likes = np.array([r['likes'] for r in self.recipes], dtype=np.int64)
+
+    def __len__(self):
+        """Returns the number of recipes indexed."""
+        return len(self.recipes)
+
+    def terms_matching(self, name):
+        """Returns the ids of the ingredient names containing the words of name."""
+        phrase = tokens(name)
+        if not phrase or any(word not in self.words for word in phrase):
+            return np.zeros(0, dtype=np.int64)
+        terms = self.words[phrase[0]]
+        for word in phrase[1:]:
+            terms = np.intersect1d(terms, self.words[word], assume_unique=True)
+        if len(phrase) == 1:
+            return terms
+        return np.array([t for t in terms if contains(self.term_words[t], phrase)], dtype=np.int64)
+
+    def recipes_using(self, terms):
+        """Returns the rows of the recipes using the ingredients terms, once per ingredient."""
+        if not len(terms):
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([self.rows[self.offsets[t]:self.offsets[t + 1]] for t in terms])
+
+    def match(self, ingredients, ranking=1, number=10):
+        """Returns the recipes using the most of ingredients, in the shape of findByIngredients.
+
+        ranking 1 puts the recipes using the most ingredients first, ranking 2 the ones
+        missing the fewest. Ties go to the most liked recipe."""
+        names = list(dict.fromkeys(i.strip().lower() for i in ingredients if i.strip()))
+        size = len(self.recipes)
+        if not names or not size:
+            return []
+        # a bitset per fridge ingredient of the recipes it is used in
+        uses = np.zeros((len(names), size), dtype=bool)
+        matched = []
+        for (n, name) in enumerate(names):
+            terms = self.terms_matching(name)
+            uses[n, self.recipes_using(terms)] = True
+            matched.append(terms)
+        used = np.bincount(self.recipes_using(np.unique(np.concatenate(matched))),
+                           minlength=size)
+        missed = self.ingredient_counts - used
+        unused = len(names) - uses.sum(axis=0)
+
+        candidates = np.flatnonzero(used)
+        likes = self.likes[candidates]
+        if ranking == 2:
+            order = np.lexsort((-likes, -used[candidates], missed[candidates]))
+        else:
+            order = np.lexsort((-likes, missed[candidates], -used[candidates]))
+        return [self.result(row, names, used[row], missed[row], unused[row])
+                for row in candidates[order[:number]]]
+
+    def result(self, row, names, used, missed, unused):
+        """Returns a recipe as findByIngredients lists it."""
+        recipe = self.recipes[row]
+        phrases = [tokens(n) for n in names]
+        words = {name: tokens(name) for name in recipe['ingredients']}
+        used_ingredients = []
+        missed_ingredients = []
+        for (name, ingredient) in recipe['ingredients'].items():
+            if any(contains(words[name], phrase) for phrase in phrases):
+                used_ingredients.append(ingredient)
+            else:
+                missed_ingredients.append(ingredient)
+        return {"id": recipe['id'], "title": recipe['title'], "image": recipe['image'],
+                "imageType": recipe['imageType'], "likes": recipe['likes'],
+                "usedIngredientCount": int(used), "missedIngredientCount": int(missed),
+                "unusedIngredientCount": int(unused),
+                "usedIngredients": used_ingredients, "missedIngredients": missed_ingredients,
+                "unusedIngredients": [{"name": n} for (n, phrase) in zip(names, phrases)
+                                      if not any(contains(w, phrase) for w in words.values())]}
+
+
+class FridgeCatalog:
+    """A worker's FridgeIndex over the stored recipes, rebuilt once it is max_age seconds old.
+
+    While one thread rebuilds it the others keep using the old index."""
+
+    def __init__(self, load, max_age):
+        """load returns the recipes to index."""
+        self.load = load
+        self.max_age = max_age
+        self.index = None
+        self.built_at = 0
+        self.lock = Lock()
+
+    def current(self):
+        """Returns the index, building it first if it is missing or too old."""
+        index = self.index
+        if index is not None and time.monotonic() - self.built_at < self.max_age:
+            return index
+        if self.lock.acquire(blocking=index is None):
+            try:
+                if self.index is index:
+                    self.index = FridgeIndex(self.load())
+                    self.built_at = time.monotonic()
+            finally:
+                self.lock.release()
+        return self.index
+
+    def clear(self):
+        """Drops the index, so the next search rebuilds it."""
+        self.index = None
@@ -0,0 +1,177 @@
+"""Durable background jobs for Fridge Raiders app (CAPSTONE ONE).
+
+Writes to the Spoonacular API that the user does not need to wait for, like adding to or
+deleting from their shopping list, are queued in the jobs table and the request returns
+straight away. `flask worker` runs them, as many worker processes as needed side by
+side. A failed job is retried with exponential backoff until it runs out of attempts,
+then it is kept as failed with its last error. `flask jobs` shows what is queued.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, Job, ShoppingListItem, User
+from quota import QuotaExceeded
+from spoonacular import spoonacular
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SHOPPING_LIST_ADD = 'shopping_list.add'
+SHOPPING_LIST_ADD_MANY = 'shopping_list.add_many'
+SHOPPING_LIST_DELETE = 'shopping_list.delete'
+
+# API calls a job makes at once, e.g. adding all the ingredients of a recipe
+MAX_CONCURRENT_WRITES = 4
+
+# functions running each kind of job, they take the job and raise to have it retried
+HANDLERS = {}
+
+
+def handler(kind):
+    """Registers the decorated function as the handler for a kind of job."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload, user_id=None, idempotency_key=None):
+    """Queues a job with the configured number of attempts. Returns True if it was queued."""
+    return Job.enqueue(kind, payload, current_app.config['JOB_MAX_ATTEMPTS'],
+                       user_id=user_id, idempotency_key=idempotency_key)
+
+
+def run_job(job):
+    """Runs a claimed job and records whether it is done, due again or failed."""
+    try:
+        HANDLERS[job.kind](job)
+    except QuotaExceeded as exc:
+        # out of API points is not the job's fault, wait for the budget without using an attempt
+        db.session.rollback()
+        job.attempts -= 1
+        job.status = 'pending'
+        job.run_at = datetime.utcnow() + timedelta(
+            seconds=current_app.config['JOB_BACKOFF'])
+        job.last_error = repr(exc)
+    except Exception as exc:
+        db.session.rollback()
+        logger.warning("Job %s failed, attempt %s of %s", job.id, job.attempts,
+                       job.max_attempts, exc_info=True)
+        job.last_error = repr(exc)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=current_app.config['JOB_BACKOFF'] * 2 ** (job.attempts - 1))
+    else:
+        job.status = 'done'
+        job.last_error = None
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def work(once=False, poll_interval=1.0):
+    """Runs due jobs, sleeping poll_interval seconds when there are none.
+
+    With once, returns as soon as no job is due. Returns the number of jobs run."""
+    ran = 0
+    while True:
+        job = Job.claim(current_app.config['JOB_LEASE'])
+        if job is None:
+            if once:
+                return ran
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        ran += 1
+
+
+# *********************************************************************** #
+# Shopping list writes
+
+
+def api_user(job):
+    """Returns the user a job is for, connecting them to the API first if need be."""
+    user = User.query.get(job.user_id)
+    if not user.is_provisioned:
+        user.provision()
+    return user
+
+
+def add_items(job, entries):
+    """Adds items to a user's API shopping list, at most MAX_CONCURRENT_WRITES at a time.
+
+    Each entry has the local_id of its local copy. The item text sent to the API is built
+    from the local copy as it is now, so amounts merged into it after the job was queued
+    are sent too. The local copies are locked until the job is done, and items that were
+    added are recorded on them, so a retry after a partial failure only adds the rest."""
+    user = api_user(job)
+    # items deleted by the user, or added by an earlier attempt or another job, are left out
+    items = ShoppingListItem.query.filter(
+        ShoppingListItem.id.in_([entry['local_id'] for entry in entries]),
+        ShoppingListItem.upstream_id.is_(None)).with_for_update().all()
+    entries = [{"local_id": item.id, "name": item.name,
+                "item": ShoppingListItem.text(item.amount, item.unit, item.name)} for item in items]
+    added = {}
+    if job.attempts > 1:
+        # an earlier attempt may have reached the API before failing, don't add items twice
+        res = spoonacular.shopping_list(user.api_username, user.hash)
+        res.raise_for_status()
+        known = {upstream_id for (upstream_id,) in db.session.query(ShoppingListItem.upstream_id).filter(
+            ShoppingListItem.user_id == user.id, ShoppingListItem.upstream_id.isnot(None))}
+        unknown = {item['name'].lower(): item for aisle in res.json()['aisles']
+                   for item in aisle['items'] if item['id'] not in known}
+        for entry in entries:
+            if entry['name'].lower() in unknown:
+                added[entry['local_id']] = unknown.pop(entry['name'].lower())
+
+    def post(entry):
+        res = spoonacular.add_shopping_list_item(user.api_username, user.hash,
+                                                 {"item": entry['item'], "parse": True})
+        res.raise_for_status()
+        return res.json()
+
+    to_post = [entry for entry in entries if entry['local_id'] not in added]
+    errors = []
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WRITES) as executor:
+        futures = [(entry, executor.submit(post, entry)) for entry in to_post]
+    for (entry, future) in futures:
+        try:
+            added[entry['local_id']] = future.result()
+        except Exception as exc:
+            errors.append(exc)
+
+    for (local_id, data) in added.items():
+        updated = ShoppingListItem.query.filter_by(id=local_id).update(
+            {"upstream_id": data['id'], **ShoppingListItem.fields_from_api(data)})
+        if not updated:
+            # deleted by the user while the item was being added
+            enqueue(SHOPPING_LIST_DELETE, {"id": data['id']}, user_id=user.id)
+    db.session.commit()
+    if errors:
+        raise errors[0]
+
+
+@handler(SHOPPING_LIST_ADD)
+def add_shopping_list_item(job):
+    """Adds an item to a user's shopping list and fills in the API's details on the local copy."""
+    add_items(job, [{"name": job.payload['item'], **job.payload}])
+
+
+@handler(SHOPPING_LIST_ADD_MANY)
+def add_shopping_list_items(job):
+    """Adds several items to a user's shopping list concurrently."""
+    add_items(job, job.payload['items'])
+
+
+@handler(SHOPPING_LIST_DELETE)
+def delete_shopping_list_item(job):
+    """Deletes an item from a user's shopping list, items that are already gone are fine."""
+    user = api_user(job)
+    res = spoonacular.delete_shopping_list_item(user.api_username, user.hash,
+                                                job.payload['id'])
+    if res.status_code != 404:
+        res.raise_for_status()
@@ -0,0 +1,21 @@
+-- Tables added before the app had migrations, for databases created from the original
+-- models. Numbered first, as later migrations alter them.
+CREATE TABLE IF NOT EXISTS recipe_details (
+    recipe_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    image TEXT,
+    ingredients JSON,
+    instructions TEXT,
+    summary TEXT,
+    data JSON NOT NULL,
+    fetched_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_results (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    recipes JSON NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_search_results_user_id ON search_results (user_id);
+CREATE INDEX IF NOT EXISTS ix_search_results_created_at ON search_results (created_at);
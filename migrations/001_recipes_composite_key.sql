@@ -0,0 +1,18 @@
+-- Key saved recipes by (user_id, recipe_id), so several users can save the same recipe,
+-- and add a partial index for looking up a user's favourites.
+
+-- Rows without a user can't be keyed, and never showed up for anyone
+DELETE FROM recipes WHERE user_id IS NULL;
+UPDATE recipes SET favourite = false WHERE favourite IS NULL;
+
+ALTER TABLE recipes DROP CONSTRAINT recipes_pkey;
+-- recipe_id was created as a serial, it holds Spoonacular ids and never needs a default
+ALTER TABLE recipes ALTER COLUMN recipe_id DROP DEFAULT;
+DROP SEQUENCE IF EXISTS recipes_recipe_id_seq;
+
+ALTER TABLE recipes ALTER COLUMN user_id SET NOT NULL;
+ALTER TABLE recipes ALTER COLUMN favourite SET NOT NULL;
+ALTER TABLE recipes ALTER COLUMN favourite SET DEFAULT false;
+ALTER TABLE recipes ADD PRIMARY KEY (user_id, recipe_id);
+
+CREATE INDEX IF NOT EXISTS ix_recipes_user_favourites ON recipes (user_id, recipe_id) WHERE favourite;
@@ -0,0 +1,4 @@
+-- Users are committed at signup and connected to the API afterwards, so they have no
+-- API username or hash until provisioning.py gets to them
+ALTER TABLE users ALTER COLUMN hash DROP NOT NULL;
+ALTER TABLE users ALTER COLUMN api_username DROP NOT NULL;
@@ -0,0 +1,19 @@
+-- Durable queue for the API writes run by `flask worker`, see jobs.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSON NOT NULL,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    idempotency_key TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    max_attempts INTEGER NOT NULL,
+    run_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_user_id ON jobs (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_jobs_pending_idempotency_key ON jobs (idempotency_key)
+    WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS ix_jobs_due ON jobs (run_at) WHERE status IN ('pending', 'running');
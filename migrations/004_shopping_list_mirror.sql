@@ -0,0 +1,16 @@
+-- Local copy of every user's API shopping list, see ShoppingList.sync
+CREATE TABLE IF NOT EXISTS shopping_lists (
+    user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    synced_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shopping_list_items (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    upstream_id INTEGER,
+    name TEXT NOT NULL,
+    aisle TEXT NOT NULL,
+    amount DOUBLE PRECISION,
+    unit TEXT,
+    UNIQUE (user_id, upstream_id)
+);
+CREATE INDEX IF NOT EXISTS ix_shopping_list_items_user_id ON shopping_list_items (user_id);
@@ -0,0 +1,6 @@
+-- Long lived local copy of the substitutes the API has for each ingredient
+CREATE TABLE IF NOT EXISTS ingredient_substitutes (
+    ingredient_id INTEGER PRIMARY KEY,
+    data JSON NOT NULL,
+    fetched_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
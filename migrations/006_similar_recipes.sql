@@ -0,0 +1,6 @@
+-- Local copy of the similar recipes the API lists for each recipe
+CREATE TABLE IF NOT EXISTS similar_recipes (
+    recipe_id INTEGER PRIMARY KEY,
+    recipes JSON NOT NULL,
+    fetched_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Indexed search columns on the stored recipe details, for answering complexSearch locally
+ALTER TABLE recipe_details
+    ADD COLUMN IF NOT EXISTS cuisines TEXT[] NOT NULL DEFAULT '{}',
+    ADD COLUMN IF NOT EXISTS diets TEXT[] NOT NULL DEFAULT '{}',
+    ADD COLUMN IF NOT EXISTS ready_in_minutes INTEGER,
+    ADD COLUMN IF NOT EXISTS ingredients_vector TSVECTOR;
+
+UPDATE recipe_details SET
+    cuisines = ARRAY(SELECT lower(c) FROM json_array_elements_text(COALESCE(data->'cuisines', '[]')) c),
+    diets = ARRAY(SELECT lower(d) FROM json_array_elements_text(COALESCE(data->'diets', '[]')) d),
+    ready_in_minutes = (data->>'readyInMinutes')::INTEGER,
+    ingredients_vector = to_tsvector('english', COALESCE(
+        (SELECT string_agg(i->>'name', ' ') FROM json_array_elements(COALESCE(data->'extendedIngredients', '[]')) i), ''));
+
+CREATE INDEX IF NOT EXISTS ix_recipe_details_ingredients_vector ON recipe_details USING gin (ingredients_vector);
+CREATE INDEX IF NOT EXISTS ix_recipe_details_cuisines ON recipe_details USING gin (cuisines);
+CREATE INDEX IF NOT EXISTS ix_recipe_details_diets ON recipe_details USING gin (diets);
+CREATE INDEX IF NOT EXISTS ix_recipe_details_ready_in_minutes ON recipe_details (ready_in_minutes);
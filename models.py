@@ -1,13 +1,24 @@
 """Models for Fridge Raiders app (CAPSTONE ONE)."""
 
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
-import requests
-import os
+from sqlalchemy.dialects.postgresql import insert, ARRAY, TSVECTOR
+from datetime import datetime, timedelta
+from spoonacular import spoonacular
+from passwords import hash_pool, needs_rehash
+import secrets
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
-API_KEY = os.environ.get('API_KEY')
+
+
+class Stale:
+    """Mixin for local copies of API data, which go stale some time after they were stored."""
+
+    # the column holding when the copy was stored
+    stored_at_column = "fetched_at"
+
+    def is_stale(self, max_age):
+        """Returns True if the copy was stored more than max_age seconds ago."""
+        return getattr(self, self.stored_at_column) < datetime.utcnow() - timedelta(seconds=max_age)
 
 
 class User(db.Model):
@@ -23,8 +34,9 @@ class User(db.Model):
     image_url = db.Column(db.Text, nullable=False,
                           default="/static/no-image.png")
     password = db.Column(db.Text, nullable=False)
-    hash = db.Column(db.Text, nullable=False)
-    api_username = db.Column(db.Text, nullable=False)
+    # set by provisioning.py once the user is connected to the API, None until then
+    hash = db.Column(db.Text)
+    api_username = db.Column(db.Text)
 
     recipes = db.relationship("Recipe", backref="user")
     preferences = db.relationship("Preference", backref="user")
@@ -35,31 +47,56 @@ class User(db.Model):
 
     @classmethod
     def signup(cls, username, first_name, last_name, email, image_url, password):
-        """Signup user, hashes password and adds user to system."""
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
-        res = requests.post("https://api.spoonacular.com/users/connect", params={'apiKey': API_KEY}, json={
-            "username": username, "firstName": first_name, "lastName": last_name, "email": email})
-        data = res.json()
-        hash = data['hash']
-        api_username = data['username']
+        """Signup user, hashes password and adds user to system.
+
+        The user is connected to the API afterwards, see provisioning.py."""
+        hashed_pwd = hash_pool.hash(password)
         if image_url is None or image_url == '':
             image_url = cls.image_url.default.arg
         user = User(username=username, first_name=first_name, last_name=last_name,
-                    email=email, image_url=image_url, password=hashed_pwd, hash=hash, api_username=api_username)
+                    email=email, image_url=image_url, password=hashed_pwd)
 
         db.session.add(user)
 
         return user
 
+    @property
+    def is_provisioned(self):
+        """True once the user has an API username and hash for the shopping list."""
+        return self.hash is not None
+
+    def provision(self):
+        """Creates the user's API account and stores its username and hash.
+
+        The user's row stays locked until the account is stored, so the web workers and
+        `flask worker` never both create one. Users provisioned meanwhile are left as is."""
+        db.session.refresh(self, with_for_update=True)
+        if self.is_provisioned:
+            db.session.commit()
+            return
+        res = spoonacular.connect_user(self.username, self.first_name,
+                                       self.last_name, self.email)
+        res.raise_for_status()
+        data = res.json()
+        self.api_username = data['username']
+        self.hash = data['hash']
+        db.session.commit()
+
     @classmethod
     def authenticate(cls, username, password):
-        """Authenticate user for given username and password, else returns False."""
+        """Authenticate user for given username and password, else returns False.
+
+        Passwords hashed with a different cost than BCRYPT_LOG_ROUNDS are hashed again
+        while the plain password is at hand."""
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hash_pool.check(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_pool.hash(password)
+                    db.session.commit()
                 return user
 
         return False
@@ -69,16 +106,264 @@ class Recipe(db.Model):
     """Recipe model for app for storing user saved and favorited recipes."""
 
     __tablename__ = "recipes"
+    __table_args__ = (
+        # covers the favourites page without touching rows that aren't favourites
+        db.Index('ix_recipes_user_favourites', 'user_id', 'recipe_id',
+                 postgresql_where=db.text('favourite')),
+    )
 
     user_id = db.Column(db.Integer, db.ForeignKey(
-        "users.id", ondelete="cascade"))
-    recipe_id = db.Column(db.Integer, nullable=False, primary_key=True)
-    favourite = db.Column(db.Boolean, default=False)
+        "users.id", ondelete="cascade"), primary_key=True)
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    favourite = db.Column(db.Boolean, nullable=False,
+                          default=False, server_default=db.false())
 
     def __repr__(self):
         """Define representation for Recipe instance."""
         return f"<Recipe user_id:{self.user_id} recipe_id:{self.recipe_id} favourite:{self.favourite}>"
 
+    @classmethod
+    def save(cls, user_id, recipe_id):
+        """Adds a recipe to a user's saved recipes, if it is not there already."""
+        db.session.execute(insert(cls).values(user_id=user_id, recipe_id=recipe_id)
+                           .on_conflict_do_nothing())
+        db.session.commit()
+
+    @classmethod
+    def set_favourite(cls, user_id, recipe_id, favourite):
+        """Marks or unmarks one of a user's saved recipes as a favourite in one statement.
+
+        Returns False if the user has not saved the recipe."""
+        updated = cls.query.filter_by(user_id=user_id, recipe_id=recipe_id).update(
+            {cls.favourite: favourite}, synchronize_session=False)
+        db.session.commit()
+        return updated > 0
+
+
+# Diet choices of the search form, as the API names them in a recipe's diets
+DIET_NAMES = {'vegetarian': 'lacto ovo vegetarian', 'lacto-vegetarian': 'lacto ovo vegetarian',
+              'ovo-vegetarian': 'lacto ovo vegetarian', 'pescetarian': 'pescatarian',
+              'paleo': 'paleolithic', 'low fodmap': 'fodmap friendly', 'whole30': 'whole 30'}
+# Intolerances a recipe's diets rule out, the others are told by its ingredients
+INTOLERANCE_DIETS = {'dairy': 'dairy free', 'gluten': 'gluten free',
+                     'wheat': 'gluten free', 'grain': 'gluten free'}
+INTOLERANCE_INGREDIENTS = {
+    'egg': ['egg'],
+    'peanut': ['peanut'],
+    'seafood': ['fish', 'salmon', 'tuna', 'cod', 'anchovy', 'shrimp', 'prawn', 'crab',
+                'lobster', 'mussel', 'clam', 'oyster', 'scallop', 'squid'],
+    'sesame': ['sesame', 'tahini'],
+    'shellfish': ['shrimp', 'prawn', 'crab', 'lobster', 'mussel', 'clam', 'oyster', 'scallop'],
+    'soy': ['soy', 'tofu', 'edamame', 'miso', 'tempeh'],
+    'sulfite': ['wine', 'vinegar', 'dried fruit'],
+    'tree nut': ['almond', 'walnut', 'cashew', 'pecan', 'pistachio', 'hazelnut', 'macadamia'],
+}
+
+
+class RecipeDetail(Stale, db.Model):
+    """Recipe detail model for app, a local copy of the recipe information from the API.
+
+    The cuisines, diets, ready time and ingredients of every recipe are also kept in
+    indexed columns, so complexSearch can be answered from the recipes stored so far."""
+
+    __tablename__ = "recipe_details"
+
+    __table_args__ = (
+        db.Index('ix_recipe_details_ingredients_vector', 'ingredients_vector',
+                 postgresql_using='gin'),
+        db.Index('ix_recipe_details_cuisines', 'cuisines', postgresql_using='gin'),
+        db.Index('ix_recipe_details_diets', 'diets', postgresql_using='gin'),
+    )
+
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.Text, nullable=False)
+    image = db.Column(db.Text)
+    ingredients = db.Column(db.JSON)
+    instructions = db.Column(db.Text)
+    summary = db.Column(db.Text)
+    data = db.Column(db.JSON, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    # lowercased like the search form's choices
+    cuisines = db.Column(ARRAY(db.Text), nullable=False, default=list,
+                         server_default='{}')
+    diets = db.Column(ARRAY(db.Text), nullable=False, default=list,
+                      server_default='{}')
+    ready_in_minutes = db.Column(db.Integer, index=True)
+    # the ingredient names, stemmed so "eggs" is found by "egg"
+    ingredients_vector = db.Column(TSVECTOR)
+
+    def __repr__(self):
+        """Define representation for RecipeDetail instance."""
+        return f"<RecipeDetail recipe_id:{self.recipe_id} title:{self.title}>"
+
+    @classmethod
+    def store(cls, recipes):
+        """Inserts or refreshes the details for recipes fetched from the API."""
+        # one row per recipe id, postgres refuses to upsert the same row twice in a statement
+        rows = list({recipe['id']: {"recipe_id": recipe['id'],
+                                    "title": recipe.get('title', ''),
+                                    "image": recipe.get('image'),
+                                    "ingredients": recipe.get('extendedIngredients', []),
+                                    "instructions": recipe.get('instructions'),
+                                    "summary": recipe.get('summary'),
+                                    "data": recipe,
+                                    "fetched_at": datetime.utcnow(),
+                                    **cls.search_fields(recipe)} for recipe in recipes}.values())
+        if not rows:
+            return
+        stmt = insert(cls).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.recipe_id],
+            set_={column: stmt.excluded[column] for column in rows[0] if column != "recipe_id"})
+        db.session.execute(stmt)
+        db.session.commit()
+
+    @staticmethod
+    def search_fields(recipe):
+        """Returns the indexed search columns for a recipe from the API."""
+        names = " ".join(i.get('name') or '' for i in recipe.get('extendedIngredients', []))
+        return {"cuisines": [c.lower() for c in recipe.get('cuisines', [])],
+                "diets": [d.lower() for d in recipe.get('diets', [])],
+                "ready_in_minutes": recipe.get('readyInMinutes'),
+                "ingredients_vector": db.func.to_tsvector('english', names)}
+
+    @classmethod
+    def search(cls, choices, number=10):
+        """Answers a complexSearch from the stored recipes, best matches first.
+
+        choices are normalized search form choices, see normalize_search_data. Like the
+        API, any of the cuisines and all of the diets must match. Intolerances are ruled
+        out by the recipe's diets where the API flags them, otherwise by leaving out
+        recipes with the ingredients that usually cause them. Returns the recipes in
+        the short form of the API's search results."""
+        query = cls.query
+        if choices.get('cuisine'):
+            query = query.filter(cls.cuisines.overlap(choices['cuisine']))
+        diets = [DIET_NAMES.get(d, d) for d in choices.get('diet', [])]
+        diets += [INTOLERANCE_DIETS[i] for i in choices.get('intolerances', [])
+                  if i in INTOLERANCE_DIETS]
+        if diets:
+            query = query.filter(cls.diets.contains(sorted(set(diets))))
+        excluded = list(choices.get('excludeIngredients', []))
+        for intolerance in choices.get('intolerances', []):
+            excluded += INTOLERANCE_INGREDIENTS.get(intolerance, [])
+        for name in excluded:
+            query = query.filter(~cls.ingredients_vector.op('@@')(
+                db.func.phraseto_tsquery('english', name)))
+        ranks = []
+        for name in choices.get('includeIngredients', []):
+            included = db.func.phraseto_tsquery('english', name)
+            query = query.filter(cls.ingredients_vector.op('@@')(included))
+            ranks.append(db.func.ts_rank(cls.ingredients_vector, included))
+        order = [sum(ranks).desc(), cls.recipe_id] if ranks else [cls.recipe_id]
+        if choices.get('maxReadyTime') is not None:
+            query = query.filter(cls.ready_in_minutes <= choices['maxReadyTime'])
+        details = query.with_entities(cls.recipe_id, cls.title, cls.image,
+                                      cls.data['imageType'].as_string())
+        return [{"id": recipe_id, "title": title, "image": image, "imageType": image_type or 'jpg'}
+                for (recipe_id, title, image, image_type)
+                in details.order_by(*order).limit(number)]
+
+
+class IngredientSubstitute(Stale, db.Model):
+    """Ingredient substitute model for app, a local copy of the substitutes the API has for an ingredient."""
+
+    __tablename__ = "ingredient_substitutes"
+
+    ingredient_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # the API's answer as is, including the ones saying there are no substitutes
+    data = db.Column(db.JSON, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    def __repr__(self):
+        """Define representation for IngredientSubstitute instance."""
+        return f"<IngredientSubstitute ingredient_id:{self.ingredient_id}>"
+
+    @classmethod
+    def store(cls, substitutes):
+        """Inserts or refreshes the substitutes fetched from the API, given as {ingredient_id: data}."""
+        rows = [{"ingredient_id": ingredient_id, "data": data, "fetched_at": datetime.utcnow()}
+                for (ingredient_id, data) in substitutes.items()]
+        if not rows:
+            return
+        stmt = insert(cls).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.ingredient_id],
+            set_={"data": stmt.excluded.data, "fetched_at": stmt.excluded.fetched_at})
+        db.session.execute(stmt)
+        db.session.commit()
+
+
+class SimilarRecipes(Stale, db.Model):
+    """Similar recipes model for app, a local copy of the list of recipes the API finds similar to a recipe."""
+
+    __tablename__ = "similar_recipes"
+
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    recipes = db.Column(db.JSON, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    def __repr__(self):
+        """Define representation for SimilarRecipes instance."""
+        return f"<SimilarRecipes recipe_id:{self.recipe_id}>"
+
+    @classmethod
+    def store(cls, recipe_id, recipes):
+        """Inserts or refreshes the list of similar recipes fetched from the API."""
+        stmt = insert(cls).values(recipe_id=recipe_id, recipes=recipes,
+                                  fetched_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.recipe_id],
+            set_={"recipes": stmt.excluded.recipes, "fetched_at": stmt.excluded.fetched_at})
+        db.session.execute(stmt)
+        db.session.commit()
+
+
+class SearchResult(db.Model):
+    """Search result model for app for keeping the recipes returned by a search between requests.
+
+    Only the id is stored in the session cookie, the recipes stay in the database."""
+
+    __tablename__ = "search_results"
+
+    id = db.Column(db.Text, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        "users.id", ondelete="cascade"), index=True)
+    recipes = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        """Define representation for SearchResult instance."""
+        return f"<SearchResult id:{self.id} user_id:{self.user_id}>"
+
+    @classmethod
+    def save(cls, recipes, user_id, max_age, max_per_user):
+        """Stores a new result set, dropping expired sets and the user's oldest sets over max_per_user."""
+        cls.query.filter(cls.created_at < datetime.utcnow() -
+                         timedelta(seconds=max_age)).delete()
+        if user_id is not None:
+            old_ids = [result_id for (result_id,) in db.session.query(cls.id).filter_by(
+                user_id=user_id).order_by(cls.created_at.desc()).offset(max_per_user - 1)]
+            if old_ids:
+                cls.query.filter(cls.id.in_(old_ids)).delete()
+        result = SearchResult(id=secrets.token_urlsafe(16),
+                              user_id=user_id, recipes=recipes)
+        db.session.add(result)
+        db.session.commit()
+        return result
+
+    @classmethod
+    def lookup(cls, result_id, max_age):
+        """Returns the recipes for result_id, or None if the set is missing or expired."""
+        result = cls.query.get(result_id) if result_id else None
+        if result is None or result.created_at < datetime.utcnow() - timedelta(seconds=max_age):
+            return None
+        return result.recipes
+
 
 class Preference(db.Model):
     """Preference model for app for storing user preferences."""
@@ -94,8 +379,224 @@ class Preference(db.Model):
         return f"<Preferences for {self.user_id}>"
 
 
+class ShoppingList(Stale, db.Model):
+    """Shopping list model for app, when a user's local copy of their API shopping list was last synced."""
+
+    __tablename__ = "shopping_lists"
+    stored_at_column = "synced_at"
+
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        "users.id", ondelete="cascade"), primary_key=True)
+    synced_at = db.Column(db.DateTime, nullable=False,
+                          default=datetime.utcnow)
+
+    def __repr__(self):
+        """Define representation for ShoppingList instance."""
+        return f"<ShoppingList user_id:{self.user_id} synced_at:{self.synced_at}>"
+
+    @classmethod
+    def sync(cls, user_id, aisles, deleting=()):
+        """Brings a user's local items in line with the aisles of their API shopping list.
+
+        Only the items that changed are written. Items still being added, which have no
+        API id yet, are kept, and items in deleting, whose deletion is queued, are not
+        brought back."""
+        upstream = {item['id']: item for aisle in aisles for item in aisle['items']
+                    if item['id'] not in deleting}
+        local = {item.upstream_id: item for item in ShoppingListItem.query.filter(
+            ShoppingListItem.user_id == user_id, ShoppingListItem.upstream_id.isnot(None))}
+        for (upstream_id, item) in local.items():
+            if upstream_id not in upstream:
+                db.session.delete(item)
+        for (upstream_id, data) in upstream.items():
+            fields = ShoppingListItem.fields_from_api(data)
+            item = local.get(upstream_id)
+            if item is None:
+                db.session.add(ShoppingListItem(
+                    user_id=user_id, upstream_id=upstream_id, **fields))
+            else:
+                for (name, value) in fields.items():
+                    if getattr(item, name) != value:
+                        setattr(item, name, value)
+        shopping_list = cls.query.get(user_id)
+        if shopping_list is None:
+            db.session.add(cls(user_id=user_id))
+        else:
+            shopping_list.synced_at = datetime.utcnow()
+        db.session.commit()
+
+
+class ShoppingListItem(db.Model):
+    """Shopping list item model for app, the local copy of an item on a user's API shopping list."""
+
+    __tablename__ = "shopping_list_items"
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'upstream_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        "users.id", ondelete="cascade"), nullable=False, index=True)
+    # the item's id on the API, None until the worker has added it there
+    upstream_id = db.Column(db.Integer)
+    name = db.Column(db.Text, nullable=False)
+    aisle = db.Column(db.Text, nullable=False, default="Misc")
+    amount = db.Column(db.Float)
+    unit = db.Column(db.Text)
+
+    def __repr__(self):
+        """Define representation for ShoppingListItem instance."""
+        return f"<ShoppingListItem id:{self.id} user_id:{self.user_id} name:{self.name}>"
+
+    @property
+    def is_pending(self):
+        """True while the item has yet to be added to the API shopping list."""
+        return self.upstream_id is None
+
+    @staticmethod
+    def fields_from_api(data):
+        """Returns the columns for an item of an API shopping list."""
+        measure = data.get('measures', {}).get('original', {})
+        return {"name": data['name'], "aisle": data.get('aisle') or "Misc",
+                "amount": measure.get('amount'), "unit": measure.get('unit')}
+
+    @staticmethod
+    def text(amount, unit, name):
+        """Returns the item text the API parses, e.g. "2 cloves garlic"."""
+        return " ".join(part for part in (f"{amount:g}" if amount else "", unit or "", name) if part)
+
+    @classmethod
+    def add_ingredients(cls, user_id, ingredients):
+        """Adds recipe ingredients to a user's local items, adding up amounts with the same name and unit.
+
+        Ingredients are merged with each other and with the user's items, whether or not
+        they are on the API list yet. A job adding an item sends its amount as it is when
+        the job runs, and holds a lock on it meanwhile, so an amount merged into a pending
+        item is not lost. Returns the items that need adding to the API, and the API ids of
+        items that were merged into and so need replacing there. Nothing is committed."""
+        merged = {}
+        for ingredient in ingredients:
+            key = (ingredient['name'].lower(), (ingredient.get('unit') or '').lower())
+            (amount, aisle) = merged.get(key, (0, ingredient.get('aisle')))
+            merged[key] = (amount + (ingredient.get('amount') or 0), aisle)
+        # waits for a job that is adding one of the items, to see whether it got there
+        existing = {(item.name.lower(), (item.unit or '').lower()): item
+                    for item in cls.query.filter_by(user_id=user_id).order_by(cls.id).with_for_update()}
+        (items, replaced) = ([], [])
+        for ((name, unit), (amount, aisle)) in merged.items():
+            item = existing.get((name, unit))
+            if item is None:
+                item = cls(user_id=user_id, name=name, unit=unit,
+                           amount=amount, aisle=aisle or "Misc")
+                db.session.add(item)
+            else:
+                if item.upstream_id is not None:
+                    replaced.append(item.upstream_id)
+                    item.upstream_id = None
+                item.amount = (item.amount or 0) + amount
+            items.append(item)
+        db.session.flush()
+        return (items, replaced)
+
+    @classmethod
+    def aisles_for(cls, user_id):
+        """Returns a user's items grouped by aisle, as [{"aisle": ..., "items": [...]}]."""
+        aisles = {}
+        for item in cls.query.filter_by(user_id=user_id).order_by(cls.aisle, cls.name, cls.id):
+            aisles.setdefault(item.aisle, []).append(item)
+        return [{"aisle": aisle, "items": items} for (aisle, items) in aisles.items()]
+
+
+class Job(db.Model):
+    """Job model for app, a durable queue of API writes run by `flask worker`, see jobs.py."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # an identical write that is still waiting to run is not queued a second time
+        db.Index('ix_jobs_pending_idempotency_key', 'idempotency_key', unique=True,
+                 postgresql_where=db.text("status IN ('pending', 'running')")),
+        db.Index('ix_jobs_due', 'run_at',
+                 postgresql_where=db.text("status IN ('pending', 'running')")),
+    )
+
+    STATUSES = ('pending', 'running', 'done', 'failed')
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        "users.id", ondelete="cascade"), index=True)
+    idempotency_key = db.Column(db.Text)
+    status = db.Column(db.Text, nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    # when a pending job is due, or when the lease of a running job runs out
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    def __repr__(self):
+        """Define representation for Job instance."""
+        return f"<Job id:{self.id} kind:{self.kind} status:{self.status} attempts:{self.attempts}>"
+
+    @classmethod
+    def enqueue(cls, kind, payload, max_attempts, user_id=None, idempotency_key=None):
+        """Queues a job, unless a job with the same idempotency key has yet to run.
+
+        Returns True if the job was queued."""
+        stmt = insert(cls).values(kind=kind, payload=payload, user_id=user_id,
+                                  idempotency_key=idempotency_key, status='pending',
+                                  attempts=0, max_attempts=max_attempts,
+                                  run_at=datetime.utcnow(), created_at=datetime.utcnow(),
+                                  updated_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[cls.idempotency_key],
+            index_where=cls.status.in_(('pending', 'running')))
+        queued = db.session.execute(stmt).rowcount
+        db.session.commit()
+        return queued > 0
+
+    @classmethod
+    def claim(cls, lease):
+        """Takes the next due job and leases it for lease seconds, or returns None.
+
+        Jobs are locked with SKIP LOCKED, so any number of workers can claim side by
+        side. A running job whose lease ran out, because its worker died, is due again."""
+        now = datetime.utcnow()
+        job = (cls.query.filter(cls.status.in_(('pending', 'running')), cls.run_at <= now)
+               .order_by(cls.run_at, cls.id).with_for_update(skip_locked=True).first())
+        if job is not None:
+            job.status = 'running'
+            job.attempts += 1
+            job.run_at = now + timedelta(seconds=lease)
+            job.updated_at = now
+        db.session.commit()
+        return job
+
+    @classmethod
+    def pending_for(cls, user_id, kinds):
+        """Returns a user's jobs of the given kinds that have yet to run, oldest first."""
+        return (cls.query.filter(cls.user_id == user_id, cls.kind.in_(kinds),
+                                 cls.status.in_(('pending', 'running')))
+                .order_by(cls.id).all())
+
+
+class SchemaMigration(db.Model):
+    """The SQL migrations in migrations/ that have been applied to the database."""
+
+    __tablename__ = "schema_migrations"
+
+    name = db.Column(db.Text, primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+
 def connect_db(app):
     """Connect to database."""
 
     db.app = app
     db.init_app(app)
+    hash_pool.init_app(app)
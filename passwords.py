@@ -0,0 +1,68 @@
+"""Password hashing off the request threads for Fridge Raiders app (CAPSTONE ONE).
+
+bcrypt is deliberately slow, so a burst of signups and logins can keep every request
+thread of a worker busy hashing. Hashes are computed on a small pool of threads per
+worker instead (bcrypt releases the GIL while it works): at most BCRYPT_WORKERS hashes
+run at once, the rest wait their turn, and the other request threads keep serving
+pages. The work factor is BCRYPT_LOG_ROUNDS; hashes stored with a different cost are
+replaced the next time their user logs in.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from flask_bcrypt import Bcrypt
+from tracing import span
+
+bcrypt = Bcrypt()
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 2
+
+
+class HashPool:
+    """A bounded pool of threads that hashes and checks passwords."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='bcrypt')
+
+    def init_app(self, app):
+        """Sizes the pool from the app config."""
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+        app.config.setdefault('BCRYPT_WORKERS', DEFAULT_WORKERS)
+        if self.workers != app.config['BCRYPT_WORKERS']:
+            self.executor.shutdown(wait=False)
+            self.__init__(app.config['BCRYPT_WORKERS'])
+
+    def run(self, fn, *args):
+        """Runs fn on the pool and waits for its result."""
+        with span('hash'):
+            return self.executor.submit(fn, *args).result()
+
+    def hash(self, password):
+        """Returns the bcrypt hash of password at the configured cost."""
+        return self.run(bcrypt.generate_password_hash, password,
+                        log_rounds()).decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Returns True when password matches the stored hash."""
+        return self.run(bcrypt.check_password_hash, hashed, password)
+
+
+def log_rounds():
+    """Returns the work factor configured for the current app."""
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+
+
+def hash_cost(hashed):
+    """Returns the log rounds a bcrypt hash was made with, e.g. 12 for $2b$12$..."""
+    return int(hashed.split('$')[2])
+
+
+def needs_rehash(hashed):
+    """Returns True when a hash was made with a different cost than the configured one."""
+    return hash_cost(hashed) != log_rounds()
+
+
+hash_pool = HashPool()
@@ -0,0 +1,58 @@
+"""Background prefetching for Fridge Raiders app (CAPSTONE ONE).
+
+Some API data is cheap to fetch ahead of the request that needs it, like the similar
+recipes of the recipe being viewed. Those fetches are handed to a small pool of threads
+per worker, so the page that triggers them does not wait. A fetch for a key that is
+already queued is not queued again. Prefetches are speculative calls to the quota
+limiter: they never wait for points and are shed once the budget is down to
+SPOONACULAR_RESERVE, leaving the rest for the pages users are waiting on.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from quota import QuotaExceeded, speculative
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """A bounded pool of threads running prefetches in the app context of the app that
+    queued them."""
+
+    def __init__(self, app, workers=2):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='prefetch')
+        self.pending = {}
+        self.lock = Lock()
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) unless a prefetch for key is already queued or running.
+
+        Returns True if it was queued."""
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending[key] = self.executor.submit(self._run, key, fn, *args)
+            return True
+
+    def _run(self, key, fn, *args):
+        token = speculative.set(True)
+        try:
+            with self.app.app_context():
+                fn(*args)
+        except QuotaExceeded:
+            logger.debug("Prefetching %s was shed to save API points", key)
+        except Exception:
+            logger.warning("Prefetching %s failed", key, exc_info=True)
+        finally:
+            speculative.reset(token)
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Waits for the queued prefetches to finish, for tests and benchmarks."""
+        with self.lock:
+            futures = list(self.pending.values())
+        wait(futures, timeout=timeout)
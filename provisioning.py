@@ -0,0 +1,65 @@
+"""Spoonacular account provisioning for Fridge Raiders app (CAPSTONE ONE).
+
+The meal planner and shopping list need an API username and hash for every user, made
+by Spoonacular's users/connect. Signup no longer waits for that call: the user is
+committed right away and the account is connected on a background thread of the worker,
+retried with backoff while the API is down or out of quota. Users signed up while a
+worker restarted are picked up again the next time they open their shopping list, or
+all at once with `flask provision-users`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models import db, User
+from threading import Lock
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='provision')
+# ids of the users with a provisioning job queued or running in this worker
+pending = set()
+pending_lock = Lock()
+
+
+def provision_user(user_id):
+    """Connects a user to the API, retrying with backoff. Returns True once provisioned.
+
+    Runs in an app context, users that are already provisioned are left alone."""
+    retries = current_app.config['PROVISION_RETRIES']
+    backoff = current_app.config['PROVISION_BACKOFF']
+    for attempt in range(retries + 1):
+        user = User.query.get(user_id)
+        if user is None:
+            return False
+        if user.is_provisioned:
+            return True
+        try:
+            user.provision()
+            return True
+        except Exception:
+            logger.warning("Provisioning user %s failed, attempt %s of %s",
+                           user_id, attempt + 1, retries + 1, exc_info=True)
+            db.session.rollback()
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+    return False
+
+
+def schedule_provisioning(user_id):
+    """Queues a background job provisioning a user, unless one is already queued."""
+    with pending_lock:
+        if user_id in pending:
+            return
+        pending.add(user_id)
+    app = current_app._get_current_object()
+
+    def job():
+        try:
+            with app.app_context():
+                provision_user(user_id)
+        finally:
+            with pending_lock:
+                pending.discard(user_id)
+    executor.submit(job)
@@ -0,0 +1,169 @@
+"""Spoonacular quota accounting and rate limiting for Fridge Raiders app (CAPSTONE ONE)."""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from flask import has_request_context, request
+import asyncio
+import fcntl
+import json
+import time
+
+# Endpoints whose calls can be dropped to save points for the core pages
+NON_ESSENTIAL_ENDPOINTS = frozenset(['recipes/{id}/similar',
+                                     'food/ingredients/{id}/substitutes'])
+# Set while making calls nobody is waiting on yet, like prefetches, which are non-essential too
+speculative = ContextVar('speculative', default=False)
+
+
+class QuotaExceeded(Exception):
+    """Raised when an upstream call is shed or cannot get points from the budget in time."""
+
+
+def estimate_points(endpoint, params=None):
+    """Estimates the points a call will cost, following Spoonacular's pricing."""
+    params = params or {}
+    if endpoint == 'recipes/informationBulk':
+        return 1 + 0.5 * (len(params.get('ids', [])) - 1)
+    if endpoint in ('recipes/complexSearch', 'recipes/findByIngredients'):
+        return 1 + 0.01 * int(params.get('number', 10))
+    return 1
+
+
+def current_route():
+    """Returns the Flask endpoint of the current request, if any."""
+    return request.endpoint if has_request_context() else None
+
+
+class QuotaLimiter:
+    """Token bucket limiter for Spoonacular points, shared by the workers on a host.
+
+    The bucket and usage counters live in a small JSON file guarded by flock, so every
+    gunicorn worker draws from the same budget. When daily_quota is set the bucket refills
+    at that quota spread over the day, holding at most burst points. The points left that
+    the API reports in X-API-Quota-Left cap the bucket whether or not it is enabled.
+
+    Non-essential calls are shed once the budget falls below reserve, essential calls
+    wait up to max_wait seconds for points before giving up."""
+
+    def __init__(self, path, daily_quota=None, burst=None, reserve=0, max_wait=2):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.burst = burst if burst is not None else (daily_quota or 0) / 4
+        self.rate = daily_quota / 86400 if daily_quota else None
+        self.reserve = reserve
+        self.max_wait = max_wait
+
+    def _new_state(self, day):
+        return {"day": day, "tokens": self.burst, "updated": time.time(),
+                "quota_left": None, "quota_used": None,
+                "endpoints": {}, "routes": {}, "minutes": {}}
+
+    @contextmanager
+    def _state(self):
+        """Yields the shared state under an exclusive lock and writes it back afterwards."""
+        day = datetime.now(timezone.utc).date().isoformat()
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = self._new_state(day)
+                # the upstream quota resets at midnight UTC
+                if state["day"] != day:
+                    state = self._new_state(day)
+                now = time.time()
+                if self.rate:
+                    state["tokens"] = min(self.burst, state["tokens"] +
+                                          (now - state["updated"]) * self.rate)
+                state["updated"] = now
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, endpoint, cost, essential=None):
+        """Takes cost points from the budget.
+
+        Returns 0 once taken, or the seconds to wait before there will be enough.
+        Raises QuotaExceeded if the call should be shed instead."""
+        if essential is None:
+            essential = endpoint not in NON_ESSENTIAL_ENDPOINTS and not speculative.get()
+        reserve = 0 if essential else self.reserve
+        with self._state() as state:
+            left = state["quota_left"]
+            if left is not None and left - cost < reserve:
+                raise QuotaExceeded(
+                    f"Only {left} points left today, not calling {endpoint}.")
+            if not self.rate:
+                return 0
+            if state["tokens"] - cost < reserve:
+                if not essential:
+                    raise QuotaExceeded(
+                        f"Budget below reserve, shedding call to {endpoint}.")
+                return (cost - state["tokens"]) / self.rate
+            state["tokens"] -= cost
+            return 0
+
+    def acquire(self, endpoint, cost, essential=None):
+        """Takes cost points from the budget, waiting up to max_wait seconds for them."""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.try_acquire(endpoint, cost, essential)
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise QuotaExceeded(f"No budget left for {endpoint}.")
+            time.sleep(wait)
+
+    async def acquire_async(self, endpoint, cost, essential=None):
+        """Like acquire, but waits without blocking the event loop."""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.try_acquire(endpoint, cost, essential)
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise QuotaExceeded(f"No budget left for {endpoint}.")
+            await asyncio.sleep(wait)
+
+    def record(self, endpoint, route, estimated, headers):
+        """Accounts for the points a call used, as reported by the API's quota headers."""
+        points = float(headers.get('X-API-Quota-Request', estimated))
+        with self._state() as state:
+            if self.rate:
+                # settle the estimate taken up front against the real cost
+                state["tokens"] = min(
+                    self.burst, state["tokens"] + estimated - points)
+            if 'X-API-Quota-Left' in headers:
+                state["quota_left"] = float(headers['X-API-Quota-Left'])
+                state["tokens"] = min(state["tokens"], state["quota_left"])
+            if 'X-API-Quota-Used' in headers:
+                state["quota_used"] = float(headers['X-API-Quota-Used'])
+            route = route or '-'
+            state["endpoints"][endpoint] = state["endpoints"].get(
+                endpoint, 0) + points
+            state["routes"][route] = state["routes"].get(route, 0) + points
+            minute = int(state["updated"] // 60)
+            state["minutes"] = {m: p for (m, p) in state["minutes"].items()
+                                if int(m) > minute - 60}
+            state["minutes"][str(minute)] = state["minutes"].get(
+                str(minute), 0) + points
+
+    def status(self):
+        """Returns the current budget, the burn rate over the last hour and the points used
+        per endpoint and per route today."""
+        with self._state() as state:
+            return {"day": state["day"],
+                    "tokens": state["tokens"] if self.rate else None,
+                    "burst": self.burst if self.rate else None,
+                    "daily_quota": self.daily_quota,
+                    "quota_left": state["quota_left"],
+                    "quota_used": state["quota_used"],
+                    "points_last_hour": sum(state["minutes"].values()),
+                    "endpoints": state["endpoints"],
+                    "routes": state["routes"]}
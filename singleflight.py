@@ -0,0 +1,185 @@
+"""Coalescing of identical concurrent upstream calls for Fridge Raiders app (CAPSTONE ONE)."""
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class Abandoned(Exception):
+    """Set on the shared future of a call whose leader stopped before it finished,
+    e.g. because its task was cancelled. The callers waiting on it make the call again."""
+
+
+class SingleFlight:
+    """Runs one call per key at a time within a worker process.
+
+    The first caller for a key runs the call, callers arriving while it is in flight
+    wait for it and share its result (or exception). Works across threads, and the
+    async variant can be awaited from any event loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, key):
+        """Returns the future for key and whether the caller is the one to run the call."""
+        with self._lock:
+            if key in self._calls:
+                return self._calls[key], False
+            future = self._calls[key] = Future()
+            # a waiter being cancelled must not cancel the call for everyone else
+            future.set_running_or_notify_cancel()
+            return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            if not isinstance(error, Exception):
+                # cancelled or interrupted, don't hand that to the other callers
+                error = Abandoned(repr(error))
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, call):
+        """Returns call(), or the result of the identical call already in flight."""
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except Abandoned:
+                continue
+        try:
+            result = call()
+        except BaseException as error:
+            self._settle(key, future, error=error)
+            raise
+        self._settle(key, future, result=result)
+        return result
+
+    async def do_async(self, key, call):
+        """Returns await call(), or the result of the identical call already in flight."""
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return await asyncio.wrap_future(future)
+            except Abandoned:
+                continue
+        try:
+            result = await call()
+        except BaseException as error:
+            self._settle(key, future, error=error)
+            raise
+        self._settle(key, future, result=result)
+        return result
+
+
+class LockTable:
+    """Table of lock files in a local directory, coalescing identical calls across the
+    worker processes of a host.
+
+    The worker holding the lock for a key makes the call and publishes the result next
+    to the lock. Workers that had to wait for the lock reuse that result instead of
+    calling again, provided it was published after they started waiting. As nobody
+    waits longer than timeout seconds, older files are of no use to anyone: every
+    sweep_interval seconds publishing a result also sweeps them from the directory."""
+
+    def __init__(self, directory, timeout=10, sweep_interval=60):
+        self.directory = directory
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def acquire(self, key):
+        """Blocks until the lock for key is held, up to timeout seconds.
+
+        Returns the open lock file and the result published while waiting, if any."""
+        path = self._path(key)
+        started = time.time()
+        lock = open(path + '.lock', 'a+')
+        # keys in use are not swept
+        os.utime(lock.fileno())
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock, None
+        except BlockingIOError:
+            pass
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    # the holder looks stuck, make the call without coalescing
+                    return lock, None
+                time.sleep(0.01)
+        try:
+            if os.path.getmtime(path + '.json') >= started:
+                with open(path + '.json') as f:
+                    return lock, json.load(f)
+        except (OSError, ValueError):
+            pass
+        return lock, None
+
+    def publish(self, key, record):
+        """Publishes the result of the call for key to the workers waiting on it."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path + '.json')
+        if time.monotonic() - self._swept_at > self.sweep_interval:
+            self._swept_at = time.monotonic()
+            self.sweep()
+
+    def sweep(self):
+        """Deletes the results and unheld locks last used more than timeout seconds ago.
+
+        A worker opening a lock just as it is deleted may end up calling alongside
+        another one, it never shares a wrong result."""
+        cutoff = time.time() - self.timeout
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if not entry.name.endswith('.lock'):
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path, 'a+') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def release(self, lock):
+        """Releases a lock returned by acquire."""
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    @contextmanager
+    def hold(self, key):
+        """Holds the lock for key, yielding the result published while waiting, if any."""
+        lock, shared = self.acquire(key)
+        try:
+            yield shared
+        finally:
+            self.release(lock)
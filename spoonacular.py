@@ -0,0 +1,316 @@
+"""Spoonacular API client for Fridge Raiders app (CAPSTONE ONE)."""
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from quota import QuotaLimiter, estimate_points, current_route
+from singleflight import SingleFlight, LockTable
+from tracing import span
+from requests.structures import CaseInsensitiveDict
+import asyncio
+import tempfile
+import threading
+import requests
+import httpx
+import os
+
+API_BASE_URL = os.environ.get('API_BASE_URL', 'https://api.spoonacular.com/')
+
+# (connect, read) timeouts in seconds, searches and bulk lookups are slower upstream
+DEFAULT_TIMEOUT = (3.05, 10)
+TIMEOUTS = {
+    'recipes/complexSearch': (3.05, 15),
+    'recipes/findByIngredients': (3.05, 15),
+    'recipes/informationBulk': (3.05, 20),
+}
+RETRY_METHODS = frozenset(['GET', 'DELETE'])
+RETRY_STATUSES = (500, 502, 503, 504)
+# Headers that no longer apply once a response body has been decoded and shared
+UNSHARED_HEADERS = frozenset(
+    ['content-encoding', 'content-length', 'transfer-encoding', 'connection'])
+
+
+def build_params(api_key, params):
+    """Adds the apiKey to params, list values are sent comma-separated as the API expects."""
+    query = {'apiKey': api_key}
+    for (k, v) in (params or {}).items():
+        query[k] = ",".join(str(i) for i in v) if isinstance(v, list) else v
+    return query
+
+
+def flight_key(path, params):
+    """Returns the key identifying a GET call, for coalescing identical calls."""
+    return (path, tuple(sorted(build_params(None, params).items())))
+
+
+def shared_record(res):
+    """Returns the parts of a response needed to rebuild it in another worker."""
+    return {"status": res.status_code, "text": res.text,
+            "headers": {k: v for (k, v) in res.headers.items() if k.lower() not in UNSHARED_HEADERS}}
+
+
+class SpoonacularEndpoints:
+    """The endpoints used by the app, shared by the sync and async clients.
+
+    Each method returns whatever the client's get/post/delete return: a response for
+    the sync client and an awaitable response for the async client."""
+
+    def recipe_information(self, recipe_id):
+        """Gets the full information for a recipe."""
+        return self.get(f"recipes/{recipe_id}/information", endpoint='recipes/{id}/information')
+
+    def recipe_information_bulk(self, recipe_ids):
+        """Gets the full information for several recipes in one call."""
+        return self.get('recipes/informationBulk', params={'ids': list(recipe_ids)})
+
+    def similar_recipes(self, recipe_id):
+        """Gets recipes similar to a recipe."""
+        return self.get(f"recipes/{recipe_id}/similar", endpoint='recipes/{id}/similar')
+
+    def ingredient_substitutes(self, ingredient_id):
+        """Gets substitutes for an ingredient."""
+        return self.get(f"food/ingredients/{ingredient_id}/substitutes",
+                        endpoint='food/ingredients/{id}/substitutes')
+
+    def connect_user(self, username, first_name, last_name, email):
+        """Creates the API user needed for the meal planner and shopping list."""
+        return self.post('users/connect', json={"username": username, "firstName": first_name,
+                                                "lastName": last_name, "email": email})
+
+    def shopping_list(self, username, hash):
+        """Gets a user's shopping list."""
+        return self.get(f"mealplanner/{username}/shopping-list",
+                        endpoint='mealplanner/{username}/shopping-list',
+                        params={'username': username, 'hash': hash})
+
+    def add_shopping_list_item(self, username, hash, item):
+        """Adds an item to a user's shopping list."""
+        return self.post(f"mealplanner/{username}/shopping-list/items",
+                         endpoint='mealplanner/{username}/shopping-list/items',
+                         params={'username': username, 'hash': hash}, json=item)
+
+    def delete_shopping_list_item(self, username, hash, item_id):
+        """Deletes an item from a user's shopping list."""
+        return self.delete(f"mealplanner/{username}/shopping-list/items/{item_id}",
+                           endpoint='mealplanner/{username}/shopping-list/items/{id}',
+                           params={'username': username, 'hash': hash})
+
+
+class SpoonacularClient(SpoonacularEndpoints):
+    """Client for the Spoonacular API.
+
+    Owns one pooled keep-alive session per worker process, adds the apiKey to every
+    call, applies a timeout per endpoint and retries idempotent calls with backoff.
+    Calls go through the quota limiter, if one is given, before being sent. Identical
+    GET calls in flight at the same time are coalesced into one, across threads and,
+    with a lock table, across the workers of a host."""
+
+    def __init__(self, base_url=API_BASE_URL, api_key=None, pool_size=16, retries=3, backoff_factor=0.3,
+                 limiter=None, lock_table=None):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.api_key = api_key
+        self.limiter = limiter
+        self.flights = SingleFlight()
+        self.lock_table = lock_table
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        """Returns the session for this process, creating a new one after a fork."""
+        if self._session is None or self._pid != os.getpid():
+            retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                          status_forcelist=RETRY_STATUSES,
+                          allowed_methods=RETRY_METHODS,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            self._pid = os.getpid()
+        return self._session
+
+    def request(self, method, path, endpoint=None, params=None, json=None):
+        """Sends a request to the API and returns the response.
+
+        endpoint names the call for timeouts and quota accounting when path contains ids,
+        it defaults to path. Raises QuotaExceeded if the limiter has no points for the call."""
+        endpoint = endpoint or path
+        if method != 'GET':
+            return self._send(method, path, endpoint, params, json)
+        key = flight_key(path, params)
+        return self.flights.do(key, lambda: self._send_shared(key, path, endpoint, params))
+
+    def _send_shared(self, key, path, endpoint, params):
+        """Sends a GET request, or reuses the response another worker got for it meanwhile."""
+        if self.lock_table is None:
+            return self._send('GET', path, endpoint, params, None)
+        with self.lock_table.hold(key) as shared:
+            if shared is not None:
+                res = requests.Response()
+                res.status_code = shared["status"]
+                res.headers = CaseInsensitiveDict(shared["headers"])
+                res._content = shared["text"].encode('utf-8')
+                res.encoding = 'utf-8'
+                res.url = f"{self.base_url}{path}"
+                return res
+            res = self._send('GET', path, endpoint, params, None)
+            self.lock_table.publish(key, shared_record(res))
+            return res
+
+    def _send(self, method, path, endpoint, params, json):
+        """Takes the points for the call from the limiter, sends it and records its cost."""
+        cost = estimate_points(endpoint, params)
+        if self.limiter:
+            self.limiter.acquire(endpoint, cost)
+        with span('upstream', endpoint=endpoint, method=method) as attrs:
+            res = self.session.request(method, f"{self.base_url}{path}",
+                                       params=build_params(self.api_key, params), json=json,
+                                       timeout=TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+            attrs['status'] = res.status_code
+        if self.limiter:
+            self.limiter.record(endpoint, current_route(), cost, res.headers)
+        return res
+
+    def get(self, path, endpoint=None, params=None):
+        """Sends a GET request, retried on connection errors and 5xx responses."""
+        return self.request('GET', path, endpoint=endpoint, params=params)
+
+    def post(self, path, endpoint=None, params=None, json=None):
+        """Sends a POST request, never retried as it is not idempotent."""
+        return self.request('POST', path, endpoint=endpoint, params=params, json=json)
+
+    def delete(self, path, endpoint=None, params=None):
+        """Sends a DELETE request, retried like GET."""
+        return self.request('DELETE', path, endpoint=endpoint, params=params)
+
+
+class AsyncSpoonacularClient(SpoonacularEndpoints):
+    """Asynchronous client for the Spoonacular API, used to run independent calls concurrently.
+
+    The httpx client lives on an event loop in a background thread of each worker process,
+    so its connections stay pooled and alive across requests whatever loop the caller
+    (e.g. a Flask async view) runs on. Calls can be awaited from any event loop.
+    Identical GET calls are coalesced like in SpoonacularClient."""
+
+    def __init__(self, base_url=API_BASE_URL, api_key=None, max_connections=32, retries=3, backoff_factor=0.3,
+                 limiter=None, lock_table=None):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.api_key = api_key
+        self.limiter = limiter
+        self.flights = SingleFlight()
+        self.lock_table = lock_table
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._loop = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """Returns the background event loop for this process, starting it after a fork."""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._client = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever,
+                                 name="spoonacular-async", daemon=True).start()
+            return self._loop
+
+    async def _send_on_loop(self, method, path, endpoint, params, json):
+        """Sends the request on the background loop, retrying idempotent calls with backoff."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+        (connect, read) = TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        retries = self.retries if method in RETRY_METHODS else 0
+        for attempt in range(retries + 1):
+            try:
+                res = await self._client.request(method, f"{self.base_url}{path}",
+                                                 params=build_params(self.api_key, params), json=json,
+                                                 timeout=httpx.Timeout(read, connect=connect))
+                if res.status_code not in RETRY_STATUSES or attempt == retries:
+                    return res
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def request(self, method, path, endpoint=None, params=None, json=None):
+        """Sends a request to the API and returns the response.
+
+        Raises QuotaExceeded if the limiter has no points for the call."""
+        endpoint = endpoint or path
+        if method != 'GET':
+            return await self._send(method, path, endpoint, params, json)
+        key = flight_key(path, params)
+        return await self.flights.do_async(key, lambda: self._send_shared(key, path, endpoint, params))
+
+    async def _send_shared(self, key, path, endpoint, params):
+        """Sends a GET request, or reuses the response another worker got for it meanwhile."""
+        if self.lock_table is None:
+            return await self._send('GET', path, endpoint, params, None)
+        (lock, shared) = await asyncio.to_thread(self.lock_table.acquire, key)
+        try:
+            if shared is not None:
+                return httpx.Response(shared["status"], headers=shared["headers"], text=shared["text"],
+                                      request=httpx.Request('GET', f"{self.base_url}{path}"))
+            res = await self._send('GET', path, endpoint, params, None)
+            self.lock_table.publish(key, shared_record(res))
+            return res
+        finally:
+            self.lock_table.release(lock)
+
+    async def _send(self, method, path, endpoint, params, json):
+        """Takes the points for the call from the limiter, sends it and records its cost."""
+        cost = estimate_points(endpoint, params)
+        if self.limiter:
+            await self.limiter.acquire_async(endpoint, cost)
+        with span('upstream', endpoint=endpoint, method=method) as attrs:
+            future = asyncio.run_coroutine_threadsafe(
+                self._send_on_loop(method, path, endpoint, params, json), self.loop)
+            res = await asyncio.wrap_future(future)
+            attrs['status'] = res.status_code
+        if self.limiter:
+            self.limiter.record(endpoint, current_route(), cost, res.headers)
+        return res
+
+    def get(self, path, endpoint=None, params=None):
+        """Sends a GET request, retried on connection errors and 5xx responses."""
+        return self.request('GET', path, endpoint=endpoint, params=params)
+
+    def post(self, path, endpoint=None, params=None, json=None):
+        """Sends a POST request, never retried as it is not idempotent."""
+        return self.request('POST', path, endpoint=endpoint, params=params, json=json)
+
+    def delete(self, path, endpoint=None, params=None):
+        """Sends a DELETE request, retried like GET."""
+        return self.request('DELETE', path, endpoint=endpoint, params=params)
+
+
+def env_float(name):
+    """Returns the float value of an environment variable, or None if it is not set."""
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+# Without SPOONACULAR_DAILY_QUOTA points are only accounted for, not rate limited
+limiter = QuotaLimiter(os.environ.get('QUOTA_STATE_PATH', os.path.join(tempfile.gettempdir(), 'fridge-raiders-quota.json')),
+                       daily_quota=env_float('SPOONACULAR_DAILY_QUOTA'),
+                       burst=env_float('SPOONACULAR_BURST'),
+                       reserve=env_float('SPOONACULAR_RESERVE') or 0,
+                       max_wait=env_float('SPOONACULAR_MAX_WAIT') or 2)
+# Identical calls are always coalesced within a worker, across workers only with SINGLE_FLIGHT_DIR
+lock_table = LockTable(os.environ['SINGLE_FLIGHT_DIR']) if os.environ.get(
+    'SINGLE_FLIGHT_DIR') else None
+spoonacular = SpoonacularClient(
+    api_key=os.environ.get('API_KEY'), limiter=limiter, lock_table=lock_table)
+async_spoonacular = AsyncSpoonacularClient(
+    api_key=os.environ.get('API_KEY'), limiter=limiter, lock_table=lock_table)
@@ -0,0 +1,392 @@
+"""Offline stand-in for the Spoonacular API for Fridge Raiders app (CAPSTONE ONE).
+
+Implements every endpoint the app uses and answers them from recorded fixtures in
+fixtures/spoonacular, so the app, its tests and the benchmarks can run without network
+access or API points. Point the app at it with API_BASE_URL:
+
+    python stub_api.py
+    API_BASE_URL=http://localhost:5050/ flask run
+
+Recipes are stored one per file and searches are answered from them unless the exact
+search was recorded. Users and shopping lists are kept in memory. Settings come from
+the environment:
+
+    STUB_API_PORT          port to serve on, default 5050
+    STUB_API_FIXTURES      fixtures directory, default fixtures/spoonacular
+    STUB_API_LATENCY       seconds added to every response, default 0
+    STUB_API_JITTER        up to this many extra random seconds, default 0
+    STUB_API_ERROR_RATE    fraction of calls failing with a 503, default 0
+    STUB_API_DAILY_QUOTA   send X-API-Quota-* headers for this many points a day
+    STUB_API_RECORD_FROM   upstream base url, missing fixtures are fetched from it with
+                           API_KEY and recorded
+"""
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+from quota import estimate_points
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import requests
+
+FIXTURES_DIR = os.environ.get('STUB_API_FIXTURES', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'spoonacular'))
+
+# Diet and intolerance choices of the search form that map onto recipe flags
+DIET_FLAGS = {'vegetarian': 'vegetarian', 'lacto-vegetarian': 'vegetarian',
+              'vegan': 'vegan', 'gluten free': 'glutenFree'}
+INTOLERANCE_FLAGS = {'dairy': 'dairyFree', 'gluten': 'glutenFree',
+                     'wheat': 'glutenFree', 'grain': 'glutenFree'}
+NO_SUBSTITUTES = {"status": "failure",
+                  "message": "Could not find any substitutes for that ingredient."}
+
+
+class FixtureStore:
+    """Recorded API responses on disk, one JSON file per recipe, similar list,
+    substitutes list and search."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._recipes = None
+        self._lock = threading.Lock()
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, f"{key}.json")
+
+    def get(self, kind, key):
+        """Returns the fixture recorded for key, or None."""
+        try:
+            with open(self._path(kind, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, kind, key, data):
+        """Records a fixture."""
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+        if kind == 'recipes':
+            with self._lock:
+                self._recipes = None
+
+    def recipes(self):
+        """Returns every recorded recipe, the corpus searches are answered from."""
+        with self._lock:
+            if self._recipes is None:
+                directory = os.path.join(self.directory, 'recipes')
+                names = os.listdir(directory) if os.path.isdir(
+                    directory) else []
+                self._recipes = sorted((self.get('recipes', name[:-5]) for name in names if name.endswith('.json')),
+                                       key=lambda recipe: recipe['id'])
+            return self._recipes
+
+
+def split_list(value):
+    """Splits a comma (or |) separated query param into lowercase values."""
+    return [v.strip().lower() for v in (value or '').replace('|', ',').split(',') if v.strip()]
+
+
+def search_key(endpoint, args):
+    """Returns the fixture key of a search, from its endpoint and canonical query."""
+    query = sorted((k, v) for (k, v) in args.items(multi=True) if k != 'apiKey')
+    digest = hashlib.sha1(repr(query).encode()).hexdigest()[:12]
+    return f"{endpoint}-{digest}"
+
+
+def uses(recipe, name):
+    """Returns the recipe's ingredients matching an ingredient name."""
+    return [i for i in recipe.get('extendedIngredients', []) if name in i['name'].lower()]
+
+
+def parse_item(text, known_names):
+    """Splits a shopping list item like "2 cloves garlic" into (2.0, "cloves", "garlic").
+
+    The name is the longest ending that is a known ingredient name, otherwise the words
+    after the unit. Items without a leading amount count as one of the item."""
+    words = text.strip().lower().split()
+    try:
+        amount = float(words[0])
+    except (IndexError, ValueError):
+        return (1.0, "", " ".join(words))
+    rest = words[1:]
+    split = next((i for i in range(len(rest)) if " ".join(rest[i:]) in known_names),
+                 1 if len(rest) > 1 else 0)
+    return (amount, " ".join(rest[:split]), " ".join(rest[split:]))
+
+
+def summary(recipe):
+    """Returns the short form of a recipe used in search and similar results."""
+    return {"id": recipe['id'], "title": recipe['title'], "image": recipe.get('image'),
+            "imageType": recipe.get('imageType', 'jpg')}
+
+
+def complex_search(recipes, args):
+    """Answers a complexSearch from the recipe corpus."""
+    query = (args.get('query') or '').lower()
+    cuisines = split_list(args.get('cuisine'))
+    diets = split_list(args.get('diet'))
+    intolerances = split_list(args.get('intolerances'))
+    include = split_list(args.get('includeIngredients'))
+    exclude = split_list(args.get('excludeIngredients'))
+    max_ready_time = args.get('maxReadyTime', type=int)
+
+    def matches(recipe):
+        return (query in recipe['title'].lower()
+                and (not cuisines or any(c.lower() in cuisines for c in recipe.get('cuisines', [])))
+                and all(recipe.get(DIET_FLAGS.get(d, ''), d in recipe.get('diets', [])) for d in diets)
+                and all(recipe.get(INTOLERANCE_FLAGS[i], False) for i in intolerances if i in INTOLERANCE_FLAGS)
+                and all(uses(recipe, i) for i in include)
+                and not any(uses(recipe, i) for i in exclude)
+                and (max_ready_time is None or recipe.get('readyInMinutes', 0) <= max_ready_time))
+
+    found = [summary(recipe) for recipe in recipes if matches(recipe)]
+    offset = args.get('offset', 0, type=int)
+    number = args.get('number', 10, type=int)
+    return {"results": found[offset:offset + number], "offset": offset, "number": number,
+            "totalResults": len(found)}
+
+
+def find_by_ingredients(recipes, args):
+    """Answers a findByIngredients from the recipe corpus."""
+    names = split_list(args.get('ingredients'))
+    found = []
+    for recipe in recipes:
+        used = [i for name in names for i in uses(recipe, name)]
+        if not used:
+            continue
+        used_ids = {i['id'] for i in used}
+        missed = [i for i in recipe.get('extendedIngredients', [])
+                  if i['id'] not in used_ids]
+        found.append({**summary(recipe), "usedIngredientCount": len(used), "missedIngredientCount": len(missed),
+                      "usedIngredients": used, "missedIngredients": missed,
+                      "unusedIngredients": [{"name": name} for name in names if not uses(recipe, name)],
+                      "likes": recipe.get('aggregateLikes', 0)})
+    if args.get('ranking', 1, type=int) == 2:
+        found.sort(key=lambda r: (r['missedIngredientCount'], -r['usedIngredientCount']))
+    else:
+        found.sort(key=lambda r: (-r['usedIngredientCount'], r['missedIngredientCount']))
+    return found[:args.get('number', 10, type=int)]
+
+
+def similar_to(recipes, recipe_id, number):
+    """Returns the recipes sharing the most ingredients with a recipe."""
+    target = next((r for r in recipes if r['id'] == recipe_id), None)
+    if target is None:
+        return []
+    names = {i['name'] for i in target.get('extendedIngredients', [])}
+    scored = [(len(names & {i['name'] for i in r.get('extendedIngredients', [])}), r)
+              for r in recipes if r['id'] != recipe_id]
+    scored = [(score, r) for (score, r) in scored if score]
+    scored.sort(key=lambda pair: -pair[0])
+    return [{"id": r['id'], "title": r['title'], "imageType": r.get('imageType', 'jpg'),
+             "readyInMinutes": r.get('readyInMinutes'), "servings": r.get('servings'),
+             "sourceUrl": r.get('sourceUrl')} for (score, r) in scored[:number]]
+
+
+def create_stub_app(fixtures_dir=FIXTURES_DIR, latency=0, jitter=0, error_rate=0, daily_quota=None,
+                    record_from=None, api_key=None):
+    """Creates the stand-in API app."""
+    stub = Flask(__name__)
+    fixtures = FixtureStore(fixtures_dir)
+    users = {}
+    shopping_lists = {}
+    item_ids = itertools.count(1)
+    state_lock = threading.Lock()
+    used_points = [0]
+
+    def upstream(path, params=None):
+        """Fetches a missing fixture from the real API when recording, else returns None."""
+        if not record_from:
+            return None
+        res = requests.get(f"{record_from.rstrip('/')}/{path}",
+                           params={**(params or {}), 'apiKey': api_key}, timeout=20)
+        return res.json() if res.ok else None
+
+    def recipe(recipe_id):
+        data = fixtures.get('recipes', recipe_id)
+        if data is None:
+            data = upstream(f"recipes/{recipe_id}/information")
+            if data is not None:
+                fixtures.save('recipes', recipe_id, data)
+        return data
+
+    def recorded_search(endpoint, answer):
+        key = search_key(endpoint, request.args)
+        data = fixtures.get('searches', key)
+        if data is None and record_from:
+            params = {k: v for (k, v) in request.args.items() if k != 'apiKey'}
+            data = upstream(f"recipes/{endpoint}", params)
+            if data is not None:
+                fixtures.save('searches', key, data)
+        return data if data is not None else answer(fixtures.recipes(), request.args)
+
+    def failure(code, message):
+        return jsonify({"status": "failure", "code": code, "message": message}), code
+
+    @stub.before_request
+    def inject_faults():
+        """Adds the configured latency and fails the configured share of calls."""
+        delay = latency + random.uniform(0, jitter)
+        if delay:
+            time.sleep(delay)
+        if error_rate and random.random() < error_rate:
+            return failure(503, "Injected failure.")
+
+    @stub.after_request
+    def add_quota_headers(res):
+        """Reports points like the real API when a daily quota is configured."""
+        if daily_quota is not None and request.url_rule is not None:
+            endpoint = request.url_rule.rule.lstrip('/').replace(
+                '<int:', '{').replace('<', '{').replace('>', '}')
+            points = estimate_points(endpoint, {**request.args, 'ids': split_list(request.args.get('ids'))})
+            with state_lock:
+                used_points[0] += points
+                res.headers['X-API-Quota-Request'] = str(points)
+                res.headers['X-API-Quota-Used'] = str(used_points[0])
+                res.headers['X-API-Quota-Left'] = str(
+                    max(daily_quota - used_points[0], 0))
+        return res
+
+    @stub.route('/recipes/complexSearch')
+    def complex_search_view():
+        return jsonify(recorded_search('complexSearch', complex_search))
+
+    @stub.route('/recipes/findByIngredients')
+    def find_by_ingredients_view():
+        return jsonify(recorded_search('findByIngredients', find_by_ingredients))
+
+    @stub.route('/recipes/<int:id>/information')
+    def recipe_information(id):
+        data = recipe(id)
+        if data is None:
+            return failure(404, f"A recipe with the id {id} does not exist.")
+        return jsonify(data)
+
+    @stub.route('/recipes/informationBulk')
+    def recipe_information_bulk():
+        ids = [int(i) for i in split_list(request.args.get('ids'))]
+        missing = [i for i in ids if fixtures.get('recipes', i) is None]
+        if missing and record_from:
+            for data in upstream('recipes/informationBulk', {'ids': ",".join(str(i) for i in missing)}) or []:
+                fixtures.save('recipes', data['id'], data)
+        found = (fixtures.get('recipes', i) for i in ids)
+        return jsonify([data for data in found if data is not None])
+
+    @stub.route('/recipes/<int:id>/similar')
+    def similar_recipes(id):
+        data = fixtures.get('similar', id)
+        if data is None and record_from:
+            data = upstream(f"recipes/{id}/similar")
+            if data is not None:
+                fixtures.save('similar', id, data)
+        if data is None:
+            data = similar_to(fixtures.recipes(), id,
+                              request.args.get('number', 1, type=int))
+        return jsonify(data)
+
+    @stub.route('/food/ingredients/<int:id>/substitutes')
+    def ingredient_substitutes(id):
+        data = fixtures.get('substitutes', id)
+        if data is None and record_from:
+            data = upstream(f"food/ingredients/{id}/substitutes")
+            if data is not None:
+                fixtures.save('substitutes', id, data)
+        return jsonify(data or NO_SUBSTITUTES)
+
+    @stub.route('/users/connect', methods=["POST"])
+    def connect_user():
+        data = request.get_json(silent=True) or {}
+        base = data.get('username') or (data.get('email') or 'user').split('@')[0]
+        with state_lock:
+            username = f"{base}{len(users) + 1}"
+            hash = hashlib.sha1(username.encode()).hexdigest()
+            users[username] = hash
+            shopping_lists[username] = []
+        return jsonify({"status": "success", "username": username, "spoonacularPassword": "stub",
+                        "hash": hash})
+
+    def shopping_list_for(username):
+        """Returns the user's items, or None if the username and hash do not match."""
+        if users.get(username) != request.args.get('hash'):
+            return None
+        return shopping_lists[username]
+
+    @stub.route('/mealplanner/<username>/shopping-list')
+    def shopping_list(username):
+        items = shopping_list_for(username)
+        if items is None:
+            return failure(401, "You are not authorized.")
+        aisles = {}
+        with state_lock:
+            for item in items:
+                aisles.setdefault(item['aisle'], []).append(item)
+        return jsonify({"aisles": [{"aisle": aisle, "items": aisle_items} for (aisle, aisle_items) in aisles.items()],
+                        "cost": 0, "startDate": 0, "endDate": 0})
+
+    @stub.route('/mealplanner/<username>/shopping-list/items', methods=["POST"])
+    def add_shopping_list_item(username):
+        items = shopping_list_for(username)
+        if items is None:
+            return failure(401, "You are not authorized.")
+        data = request.get_json(silent=True) or {}
+        (amount, unit, name) = parse_item(data.get('item', ''), {i['name'] for r in fixtures.recipes()
+                                                                 for i in r.get('extendedIngredients', [])})
+        known = next((i for r in fixtures.recipes() for i in uses(r, name) if i['name'] == name), None)
+        item = {"id": next(item_ids), "name": name, "ingredientId": known['id'] if known else None,
+                "aisle": data.get('aisle') or (known['aisle'] if known else "Misc"),
+                "measures": {"original": {"amount": amount, "unit": unit}},
+                "pantryItem": False, "cost": 0}
+        with state_lock:
+            items.append(item)
+        return jsonify(item)
+
+    @stub.route('/mealplanner/<username>/shopping-list/items/<int:id>', methods=["DELETE"])
+    def delete_shopping_list_item(username, id):
+        items = shopping_list_for(username)
+        if items is None:
+            return failure(401, "You are not authorized.")
+        with state_lock:
+            items[:] = [item for item in items if item['id'] != id]
+        return jsonify({"status": "success"})
+
+    return stub
+
+
+def create_stub_app_from_env():
+    """Creates the stand-in API app configured from the environment."""
+    daily_quota = os.environ.get('STUB_API_DAILY_QUOTA')
+    return create_stub_app(latency=float(os.environ.get('STUB_API_LATENCY', 0)),
+                           jitter=float(os.environ.get('STUB_API_JITTER', 0)),
+                           error_rate=float(os.environ.get(
+                               'STUB_API_ERROR_RATE', 0)),
+                           daily_quota=float(
+                               daily_quota) if daily_quota else None,
+                           record_from=os.environ.get('STUB_API_RECORD_FROM'),
+                           api_key=os.environ.get('API_KEY'))
+
+
+_server = None
+
+
+def serve_in_background(stub=None):
+    """Serves the stand-in API on a free local port in a daemon thread, once per process.
+
+    Returns its base url, for API_BASE_URL."""
+    global _server
+    if _server is None:
+        _server = make_server('127.0.0.1', 0, stub or create_stub_app_from_env(),
+                              threaded=True)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{_server.server_port}/"
+
+
+if __name__ == '__main__':
+    create_stub_app_from_env().run(port=int(os.environ.get('STUB_API_PORT', 5050)),
+                                   threaded=True)
@@ -0,0 +1,135 @@
+"""App factory tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+import os
+import stub_api
+
+# Run against the offline stand-in API instead of the live Spoonacular API
+os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+os.environ['APP_PROFILE'] = 'test'
+
+from app import app, create_app, migration_names, MIGRATIONS_DIR
+from models import db, SchemaMigration
+from unittest import TestCase
+from unittest.mock import patch
+
+
+# The tables as the app first created them, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    image_url TEXT NOT NULL,
+    password TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    api_username TEXT NOT NULL
+);
+CREATE TABLE recipes (
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    recipe_id SERIAL PRIMARY KEY,
+    favourite BOOLEAN
+);
+CREATE TABLE preferences (
+    user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    preferences JSON
+);
+"""
+
+# Holds the tables of the apps that init-db is run against
+SCRATCH_SCHEMA = "init_db_test"
+
+
+class AppFactoryTestCase(TestCase):
+    """Test building the app for each profile."""
+
+    def test_prod_profile(self):
+        """Builds a lean app without statement logging or the debug toolbar."""
+        with patch.dict(os.environ, {'DATABASE_URL': "postgres://user@host/fridge_raiders"}):
+            app = create_app('prod')
+        self.assertEqual(app.config['SQLALCHEMY_DATABASE_URI'],
+                         "postgresql://user@host/fridge_raiders")
+        self.assertEqual(app.config['PROFILE'], 'prod')
+        self.assertFalse(app.config['SQLALCHEMY_ECHO'])
+        self.assertNotIn('debugtoolbar', app.blueprints)
+        self.assertIn('main.homepage', app.view_functions)
+
+    def test_dev_profile(self):
+        """Loads the debug toolbar when debugging in development."""
+        with patch.dict(os.environ, {'FLASK_DEBUG': '1', 'DATABASE_URL': "postgresql:///fridge_raiders"}):
+            app = create_app('dev')
+        self.assertIn('debugtoolbar', app.blueprints)
+
+    def test_missing_database_url(self):
+        """Refuses to build a prod or dev app without a database to connect to."""
+        with patch.dict(os.environ):
+            os.environ.pop('DATABASE_URL', None)
+            for profile in ('prod', 'dev'):
+                with self.assertRaisesRegex(RuntimeError, "DATABASE_URL"):
+                    create_app(profile)
+
+    def scratch_app(self, setup=""):
+        """Returns a test app whose tables live in a new schema holding only what setup creates."""
+        with app.app_context(), db.engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE; CREATE SCHEMA {SCRATCH_SCHEMA};"
+                                 f"SET LOCAL search_path TO {SCRATCH_SCHEMA}; {setup}")
+            url = db.engine.url.update_query_dict({'options': f"-csearch_path={SCRATCH_SCHEMA}"})
+        with patch.dict(os.environ, {'DATABASE_URL': url.render_as_string(hide_password=False)}):
+            scratch = create_app('test')
+        self.addCleanup(self.drop_scratch_schema, scratch)
+        return scratch
+
+    def drop_scratch_schema(self, scratch):
+        """Closes the scratch app's connections and drops its schema."""
+        with scratch.app_context():
+            db.engine.dispose()
+        with app.app_context(), db.engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE")
+
+    def test_init_db_new_database(self):
+        """Creates the tables of an empty database, then leaves them be."""
+        scratch = self.scratch_app()
+        # the commands only push the scratch app's context if no other app's is pushed
+        with scratch.app_context():
+            result = scratch.test_cli_runner().invoke(args=['init-db'])
+            self.assertIsNone(result.exception)
+            self.assertIn("Database tables created.", result.output)
+
+            result = scratch.test_cli_runner().invoke(args=['init-db'])
+        self.assertIsNone(result.exception)
+        self.assertIn("Database tables already exist, migrations applied.", result.output)
+        self.assertNotIn("Applied", result.output)
+
+    def test_init_db(self):
+        """Brings the tables of an existing database up to date from the command line."""
+        scratch = self.scratch_app(BASELINE_SCHEMA)
+        with scratch.app_context():
+            result = scratch.test_cli_runner().invoke(args=['init-db'])
+            self.assertIsNone(result.exception)
+            self.assertIn("Applied 001_recipes_composite_key.sql.", result.output)
+            self.assertIn("Database tables already exist, migrations applied.", result.output)
+            self.assertEqual(len(SchemaMigration.query.all()), len(migration_names()))
+
+    def test_migrations_from_baseline(self):
+        """Every migration applies in order to a database created by the original models."""
+        with app.app_context(), db.engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                conn.exec_driver_sql("CREATE SCHEMA migration_test; SET LOCAL search_path TO migration_test;")
+                conn.exec_driver_sql(BASELINE_SCHEMA)
+                for name in migration_names():
+                    with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                        conn.exec_driver_sql(f.read())
+                columns = {(table, column): nullable for (table, column, nullable) in conn.exec_driver_sql(
+                    "SELECT table_name, column_name, is_nullable FROM information_schema.columns "
+                    "WHERE table_schema = 'migration_test'")}
+                primary_key = [column for (column,) in conn.exec_driver_sql(
+                    "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid "
+                    "AND a.attnum = ANY(i.indkey) WHERE i.indrelid = 'recipes'::regclass AND i.indisprimary")]
+            finally:
+                trans.rollback()
+        self.assertEqual(columns[('users', 'hash')], 'YES')
+        self.assertEqual(sorted(primary_key), ['recipe_id', 'user_id'])
+        self.assertIn(('recipe_details', 'ingredients_vector'), columns)
+        self.assertIn(('search_results', 'recipes'), columns)
@@ -0,0 +1,57 @@
+"""Cache tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from unittest.mock import patch
+from cache import TTLCache
+
+
+class TTLCacheTestCase(TestCase):
+    """Test the in-memory TTL/LRU cache."""
+
+    def setUp(self):
+        """Create a small cache."""
+        self.cache = TTLCache(ttl=60, maxsize=2)
+
+    def test_get_and_set(self):
+        """Returns stored values and counts hits and misses."""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"id": 1})
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_expired_entries(self):
+        """Does not return entries older than the ttl."""
+        with patch('cache.time.monotonic', return_value=100):
+            self.cache.set(1, "recipe")
+        with patch('cache.time.monotonic', return_value=161):
+            self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """Evicts the least recently used entry once maxsize is reached."""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_get_many(self):
+        """Returns only the keys that are cached."""
+        self.cache.set(1, "one")
+        self.assertEqual(self.cache.get_many([1, 2]), {1: "one"})
+
+    def test_peek(self):
+        """Returns cached values without counting them or marking them as used."""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.assertEqual(self.cache.peek(1), "one")
+        self.assertIsNone(self.cache.peek(3))
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.peek(1))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
@@ -0,0 +1,77 @@
+"""Fridge matcher tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from unittest.mock import patch
+from fridge import FridgeIndex, FridgeCatalog
+import stub_api
+
+
+class FridgeIndexTestCase(TestCase):
+    """Test matching fridge ingredients against the recipe catalog."""
+
+    def setUp(self):
+        """Index the recipes of the stand-in API, which answers findByIngredients the same way."""
+        self.recipes = stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes()
+        self.index = FridgeIndex(self.recipes)
+
+    def test_counts(self):
+        """Counts used, missed and unused ingredients like findByIngredients."""
+        (recipe,) = [r for r in self.index.match(["cheese", "peas", "bacon"], number=10)
+                     if r['title'] == "Peas And Tarragon"]
+        self.assertEqual(recipe['usedIngredientCount'], 2)
+        self.assertEqual(recipe['missedIngredientCount'], 3)
+        self.assertEqual(recipe['unusedIngredientCount'], 1)
+        self.assertEqual({i['name'] for i in recipe['usedIngredients']},
+                         {"peas", "parmesan cheese"})
+        self.assertEqual(recipe['unusedIngredients'], [{"name": "bacon"}])
+        self.assertIn('amount', recipe['missedIngredients'][0])
+
+    def test_rankings(self):
+        """Ranking 1 maximizes used ingredients and ranking 2 minimizes missing ones."""
+        for ranking in (1, 2):
+            found = self.index.match(["cheese", "peas", "chicken"], ranking=ranking, number=10)
+            key = ((lambda r: (-r['usedIngredientCount'], r['missedIngredientCount'])) if ranking == 1
+                   else (lambda r: (r['missedIngredientCount'], -r['usedIngredientCount'])))
+            self.assertEqual([key(r) for r in found], sorted(key(r) for r in found))
+            self.assertTrue(all(r['usedIngredientCount'] for r in found))
+        self.assertEqual(self.index.match(["chicken", "peas"], ranking=1, number=1)[0]['title'],
+                         "Chicken And Pea Risotto")
+        self.assertEqual(len(self.index.match(["garlic"], number=2)), 2)
+
+    def test_whole_words(self):
+        """Fridge ingredients match whole words, not parts of other ingredients."""
+        index = FridgeIndex([
+            {"id": 1, "title": "Not An Omelette", "extendedIngredients": [
+                {"id": 11, "name": "eggplant"}, {"id": 12, "name": "unsalted butter"},
+                {"id": 13, "name": "chickpeas"}]},
+            {"id": 2, "title": "Omelette", "extendedIngredients": [
+                {"id": 21, "name": "eggs"}, {"id": 22, "name": "salt"},
+                {"id": 23, "name": "frozen peas"}, {"id": 24, "name": "chives"}]},
+        ])
+        found = index.match(["egg", "salt", "pea"])
+        self.assertEqual([r['title'] for r in found], ["Omelette"])
+        self.assertEqual((found[0]['usedIngredientCount'], found[0]['missedIngredientCount']), (3, 1))
+        self.assertEqual([i['name'] for i in found[0]['missedIngredients']], ["chives"])
+        self.assertEqual(index.match(["frozen peas"])[0]['title'], "Omelette")
+        self.assertEqual(index.match(["peas frozen"]), [])
+
+    def test_no_match(self):
+        """Recipes using none of the ingredients are left out."""
+        self.assertEqual(self.index.match(["durian"]), [])
+        self.assertEqual(self.index.match([]), [])
+        self.assertEqual(FridgeIndex([]).match(["peas"]), [])
+
+    def test_catalog_rebuilds(self):
+        """The catalog keeps its index until it is max_age seconds old."""
+        loads = []
+
+        def load():
+            loads.append(1)
+            return self.recipes
+        catalog = FridgeCatalog(load, max_age=60)
+        with patch('fridge.time.monotonic', return_value=100):
+            index = catalog.current()
+            self.assertIs(catalog.current(), index)
+        with patch('fridge.time.monotonic', return_value=161):
+            self.assertIsNot(catalog.current(), index)
+        self.assertEqual(len(loads), 2)
@@ -0,0 +1,83 @@
+"""Background job tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+import os
+import stub_api
+
+# Run against the offline stand-in API instead of the live Spoonacular API
+os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+os.environ['APP_PROFILE'] = 'test'
+
+from app import app
+from unittest import TestCase
+from datetime import datetime
+from models import db, Job
+from quota import QuotaExceeded
+from jobs import HANDLERS, enqueue, run_job, work
+
+app.app_context().push()
+db.create_all()
+
+
+class JobsTestCase(TestCase):
+    """Test queueing and running jobs."""
+
+    def setUp(self):
+        """Register a test handler that fails on demand."""
+        Job.query.delete()
+        db.session.commit()
+        self.errors = []
+        self.ran = []
+
+        def flaky(job):
+            self.ran.append(job.payload)
+            if self.errors:
+                raise self.errors.pop(0)
+        HANDLERS['test.flaky'] = flaky
+
+    def tearDown(self):
+        """Remove the test handler and its jobs."""
+        del HANDLERS['test.flaky']
+        db.session.rollback()
+        Job.query.delete()
+        db.session.commit()
+
+    def test_run(self):
+        """Runs due jobs once and marks them done."""
+        self.assertTrue(enqueue('test.flaky', {"n": 1}))
+        self.assertEqual(work(once=True), 1)
+        self.assertEqual(self.ran, [{"n": 1}])
+        self.assertEqual(Job.query.one().status, 'done')
+        self.assertEqual(work(once=True), 0)
+
+    def test_idempotency_key(self):
+        """A job is not queued twice while one with the same key has yet to run."""
+        self.assertTrue(enqueue('test.flaky', {}, idempotency_key="same"))
+        self.assertFalse(enqueue('test.flaky', {}, idempotency_key="same"))
+        work(once=True)
+        self.assertTrue(enqueue('test.flaky', {}, idempotency_key="same"))
+
+    def test_retry_with_backoff(self):
+        """Failed jobs are due again later, until they run out of attempts."""
+        self.errors = [RuntimeError("down")] * app.config['JOB_MAX_ATTEMPTS']
+        enqueue('test.flaky', {})
+        job = Job.claim(app.config['JOB_LEASE'])
+        run_job(job)
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn("down", job.last_error)
+
+        for _ in range(app.config['JOB_MAX_ATTEMPTS'] - 1):
+            job.run_at = datetime.utcnow()
+            db.session.commit()
+            run_job(Job.claim(app.config['JOB_LEASE']))
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNone(Job.claim(app.config['JOB_LEASE']))
+
+    def test_quota_exceeded(self):
+        """Jobs waiting for API points keep their attempts."""
+        self.errors = [QuotaExceeded("no points")]
+        enqueue('test.flaky', {})
+        job = Job.claim(app.config['JOB_LEASE'])
+        run_job(job)
+        self.assertEqual((job.status, job.attempts), ('pending', 0))
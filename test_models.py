@@ -1,10 +1,23 @@
 """Model tests for Fridge Raiders app (CAPSTONE ONE)."""
 
-from app import app
 import os
+import stub_api
+
+# Run against the offline stand-in API instead of the live Spoonacular API
+os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+os.environ['APP_PROFILE'] = 'test'
+
+from app import app
 from unittest import TestCase
+from unittest.mock import patch
 from sqlalchemy import exc
-from models import db, User, Recipe, Preference
+from models import db, User, Recipe, Preference, RecipeDetail, ShoppingList
+from datetime import datetime, timedelta
+from passwords import bcrypt, hash_cost
+from provisioning import provision_user
+from spoonacular import spoonacular
+import threading
+import time
 
 os.environ['DATABASE_URL'] = "postgresql:///fridge_raiders-test"
 app.config['SQLALCHEMY_ECHO'] = False
@@ -77,6 +90,42 @@ class ModelsTestCase(TestCase):
         self.assertEqual(tester.email, "test1@test.com")
         self.assertNotEqual(tester.password, "password")
         self.assertTrue(tester.password.startswith("$2b$"))
+        self.assertFalse(tester.is_provisioned)
+
+    def test_provision_user(self):
+        """Provisioning retries failed calls and stores the API username and hash."""
+        connect_user = spoonacular.connect_user
+        with patch.dict(app.config, {'PROVISION_BACKOFF': 0}), \
+                patch.object(spoonacular, 'connect_user',
+                             side_effect=[ConnectionError(), connect_user("testuser", "test", "user", "test@test.com")]):
+            self.assertTrue(provision_user(self.testuser_id))
+        user = User.query.get(self.testuser_id)
+        self.assertTrue(user.is_provisioned)
+        self.assertTrue(user.api_username.startswith("testuser"))
+
+    def test_provision_once(self):
+        """A user provisioned from two places at once gets a single API account."""
+        calls = []
+        connect_user = spoonacular.connect_user
+
+        def slow_connect_user(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            return connect_user(*args)
+
+        def provision():
+            with app.app_context():
+                User.query.get(self.testuser_id).provision()
+
+        with patch.object(spoonacular, 'connect_user', slow_connect_user):
+            threads = [threading.Thread(target=provision) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        db.session.expire_all()
+        self.assertTrue(User.query.get(self.testuser_id).is_provisioned)
 
     def test_invalid_username_signup(self):
         """Fails to create new instance of User if invalid username credentials."""
@@ -143,6 +192,15 @@ class ModelsTestCase(TestCase):
         self.assertFalse(User.authenticate(
             username=self.testuser.username, password="badpassword"))
 
+    def test_rehash_on_auth(self):
+        """Authenticate rehashes passwords stored with a different cost."""
+        self.testuser.password = bcrypt.generate_password_hash(
+            "testuser", rounds=5).decode('UTF-8')
+        db.session.commit()
+        user = User.authenticate(username="testuser", password="testuser")
+        self.assertEqual(hash_cost(user.password), app.config['BCRYPT_LOG_ROUNDS'])
+        self.assertTrue(User.authenticate(username="testuser", password="testuser"))
+
     def test_recipe_model(self):
         """Tests to see if basic recipe model works."""
         r = Recipe(user_id=self.testuser.id, recipe_id=12345, favourite=False)
@@ -171,3 +229,30 @@ class ModelsTestCase(TestCase):
 
         # does the repr method work?
         self.assertEqual(p.__repr__(), f"<Preferences for {self.p.user_id}>")
+
+    def test_is_stale(self):
+        """Copies of API data go stale max_age seconds after they were stored."""
+        hour_ago = datetime.utcnow() - timedelta(hours=1)
+        for copy in (RecipeDetail(fetched_at=hour_ago), ShoppingList(synced_at=hour_ago)):
+            self.assertTrue(copy.is_stale(60))
+            self.assertFalse(copy.is_stale(60 * 60 * 2))
+
+    def test_recipe_detail_search(self):
+        """Stored recipes answer a complexSearch with the same filters as the API."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+
+        def titles(**choices):
+            return [r['title'] for r in RecipeDetail.search(choices)]
+
+        self.assertEqual(set(titles(cuisine=['spanish'])),
+                         {"White Gazpacho", "Spanish Gazpacho Soup"})
+        self.assertEqual(titles(cuisine=['spanish'], diet=['gluten free']),
+                         ["Spanish Gazpacho Soup"])
+        self.assertEqual(titles(includeIngredients=['parmesan cheese'], maxReadyTime=15),
+                         ["Peas And Tarragon"])
+        self.assertNotIn("Cheese Omelette", titles(includeIngredients=['cheese'],
+                                                   intolerances=['egg']))
+        self.assertNotIn("Cheese Omelette", titles(excludeIngredients=['eggs']))
+        self.assertEqual(titles(intolerances=['dairy'], includeIngredients=['peas']),
+                         ["Pea And Mint Soup"])
+        self.assertEqual(len(RecipeDetail.search({}, number=3)), 3)
@@ -0,0 +1,75 @@
+"""Quota limiter tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from quota import QuotaLimiter, QuotaExceeded, estimate_points, speculative
+import os
+import tempfile
+
+
+class QuotaLimiterTestCase(TestCase):
+    """Test the shared token bucket for API points."""
+
+    def setUp(self):
+        """Create a limiter with its own state file."""
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.limiter = QuotaLimiter(self.path, daily_quota=150, burst=3,
+                                    reserve=1, max_wait=0)
+
+    def tearDown(self):
+        """Remove the state file."""
+        os.remove(self.path)
+
+    def test_estimate_points(self):
+        """Estimates the cost of bulk and search calls."""
+        self.assertEqual(estimate_points('recipes/informationBulk',
+                                         {'ids': [1, 2, 3]}), 2)
+        self.assertEqual(estimate_points('recipes/complexSearch',
+                                         {'number': 5}), 1.05)
+        self.assertEqual(estimate_points('recipes/{id}/information'), 1)
+
+    def test_essential_calls_use_whole_budget(self):
+        """Essential calls can use the budget down to zero, then fail."""
+        for _ in range(3):
+            self.limiter.acquire('recipes/{id}/information', 1)
+        with self.assertRaises(QuotaExceeded):
+            self.limiter.acquire('recipes/{id}/information', 1)
+
+    def test_non_essential_calls_are_shed(self):
+        """Non-essential calls are shed before the budget drops below the reserve."""
+        self.limiter.acquire('recipes/{id}/information', 1)
+        self.limiter.acquire('recipes/{id}/similar', 1)
+        with self.assertRaises(QuotaExceeded):
+            self.limiter.acquire('recipes/{id}/similar', 1)
+        self.limiter.acquire('recipes/{id}/information', 1)
+
+    def test_speculative_calls_are_shed(self):
+        """Calls made speculatively are shed like non-essential ones."""
+        self.limiter.acquire('recipes/informationBulk', 2)
+        token = speculative.set(True)
+        try:
+            with self.assertRaises(QuotaExceeded):
+                self.limiter.acquire('recipes/informationBulk', 1)
+        finally:
+            speculative.reset(token)
+        self.limiter.acquire('recipes/informationBulk', 1)
+
+    def test_record_quota_headers(self):
+        """Tracks points per endpoint and route and caps the budget by the points left."""
+        self.limiter.record('recipes/{id}/information', 'get_recipe', 1,
+                            {'X-API-Quota-Request': '1.5', 'X-API-Quota-Left': '2', 'X-API-Quota-Used': '148'})
+        status = self.limiter.status()
+        self.assertEqual(status['endpoints'], {'recipes/{id}/information': 1.5})
+        self.assertEqual(status['routes'], {'get_recipe': 1.5})
+        self.assertEqual(status['quota_left'], 2)
+        self.assertEqual(status['points_last_hour'], 1.5)
+        self.assertAlmostEqual(status['tokens'], 2, places=2)
+
+    def test_shared_between_limiters(self):
+        """Limiters using the same state file share one budget, like separate workers."""
+        other = QuotaLimiter(self.path, daily_quota=150, burst=3,
+                             reserve=1, max_wait=0)
+        self.limiter.acquire('recipes/{id}/information', 2)
+        other.acquire('recipes/{id}/information', 1)
+        with self.assertRaises(QuotaExceeded):
+            self.limiter.acquire('recipes/{id}/information', 1)
@@ -1,10 +1,23 @@
 """Recipe view tests for Fridge Raiders app (CAPSTONE ONE)."""
 
-from app import app, CURR_USER_KEY, create_search_string, get_saved_recipe_ids
 import os
+import stub_api
+
+# Run against the offline stand-in API instead of the live Spoonacular API
+os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+os.environ['APP_PROFILE'] = 'test'
+
+from app import app, CURR_USER_KEY, SEARCH_RESULTS_KEY, create_search_string, normalize_search_data, get_saved_recipe_ids
 from unittest import TestCase
-from models import db, connect_db, User, Recipe, Preference
+from unittest.mock import patch
+from models import db, connect_db, User, Recipe, Preference, SearchResult, IngredientSubstitute, SimilarRecipes, RecipeDetail
+from tracing import parse_server_timing
 from flask import session
+from spoonacular import spoonacular, async_spoonacular, limiter
+from quota import QuotaExceeded
+from datetime import datetime, timedelta
+import requests
+import httpx
 
 os.environ['DATABASE_URL'] = "postgresql:///fridge_raiders-test"
 
@@ -25,6 +38,11 @@ class RecipeViewsTestCase(TestCase):
 
     def setUp(self):
         """Create test client and add sample data."""
+        app.extensions['user_cache'].clear()
+        app.extensions['prefetcher'].wait()
+        SearchResult.query.delete()
+        IngredientSubstitute.query.delete()
+        SimilarRecipes.query.delete()
         User.query.delete()
         Recipe.query.delete()
         Preference.query.delete()
@@ -61,6 +79,17 @@ class RecipeViewsTestCase(TestCase):
         self.assertEqual(create_search_string({"cuisine": [
                          "italian", "greek", "korean"], "number": 5}), "cuisine=italian,greek,korean&number=5")
 
+    def test_normalize_search_data(self):
+        """Builds the same query string for equivalent searches."""
+        first = {"number": 5, "diet": ["Vegetarian"], "cuisine": ["korean", "italian"],
+                 "includeIngredients": " Peas,cheese ,"}
+        second = {"cuisine": ["italian", "korean"], "includeIngredients": "cheese, peas",
+                  "diet": ["vegetarian"], "number": 5}
+        self.assertEqual(create_search_string(normalize_search_data(first)),
+                         "cuisine=italian,korean&diet=vegetarian&includeIngredients=cheese,peas&number=5")
+        self.assertEqual(create_search_string(normalize_search_data(first)),
+                         create_search_string(normalize_search_data(second)))
+
     def test_search_recipes_loggedout_get(self):
         """Shows the search form for logged out users."""
         with self.client as c:
@@ -99,6 +128,53 @@ class RecipeViewsTestCase(TestCase):
             self.assertIn("Go to Recipe", str(resp.data))
             self.assertNotIn("tester", str(resp.data))
 
+    def test_search_prefetches_top_results(self):
+        """The details of the top search results are fetched before they are clicked."""
+        app.extensions['recipe_cache'].clear()
+        RecipeDetail.query.filter_by(recipe_id=1095841).delete()
+        db.session.commit()
+        with self.client as c:
+            complex_search_form_data = {"cuisine": "spanish", "diet": "vegetarian", "intolerances": [
+            ], "includeIngredients": "", "excludeIngredients": "", "maxReadyTime": 20, "number": "2", "save": False}
+            c.post('/recipes/search', data=complex_search_form_data)
+            app.extensions['prefetcher'].wait()
+            self.assertIsNotNone(
+                app.extensions['recipe_cache'].get(1095841))
+
+            resp = c.get('/recipes/1095841')
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+            self.assertNotIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+
+    def test_search_falls_back_to_stored_recipes(self):
+        """Searches are answered from the stored recipes when the API is unreachable."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        with self.client as c:
+            complex_search_form_data = {"cuisine": "spanish", "diet": "vegetarian", "intolerances": [
+            ], "includeIngredients": "", "excludeIngredients": "", "maxReadyTime": 20, "number": "2", "save": False}
+            with patch.object(spoonacular, 'get', side_effect=requests.ConnectionError("down")):
+                resp = c.post('/recipes/search',
+                              data=complex_search_form_data, follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+            self.assertNotIn("White Gazpacho", str(resp.data))
+
+    def test_search_stored_recipes_first(self):
+        """With LOCAL_SEARCH_FIRST the API is skipped when enough stored recipes match."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        with self.client as c:
+            complex_search_form_data = {"cuisine": "spanish", "intolerances": [
+            ], "includeIngredients": "cucumber", "excludeIngredients": "", "maxReadyTime": 30, "number": "2", "save": False}
+            with patch.dict(app.config, {'LOCAL_SEARCH_FIRST': True}), \
+                    patch.object(spoonacular, 'get') as get:
+                resp = c.post('/recipes/search',
+                              data=complex_search_form_data, follow_redirects=True)
+
+            get.assert_not_called()
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+            self.assertIn("White Gazpacho", str(resp.data))
+
     def test_search_recipes_user_post(self):
         """Handles the submitted search form for a user."""
         with self.client as c:
@@ -114,9 +190,11 @@ class RecipeViewsTestCase(TestCase):
             self.assertIn("Your Recipes from", str(resp.data))
             self.assertIn("Go to Recipe", str(resp.data))
             self.assertIn("tester", str(resp.data))
-            # Check that recipes returned in search are stored in session.
-            self.assertEqual(len(session['recipes']), 1)
-            self.assertIn("Spanish Gazpacho Soup", session['recipes'])
+            # Check that recipes returned in search are stored server side, not in the session.
+            self.assertNotIn('recipes', session)
+            recipes = SearchResult.query.get(session[SEARCH_RESULTS_KEY]).recipes
+            self.assertEqual(len(recipes), 1)
+            self.assertIn("Spanish Gazpacho Soup", [r['title'] for r in recipes])
 
     # def test_session_recipes(self):
     #     """Stores recipes returned from search in the session."""
@@ -128,17 +206,35 @@ class RecipeViewsTestCase(TestCase):
     #         self.assertIn("Spanish Gazpacho Soup", session['recipes'])
 
     def test_session_recipes_empty(self):
-        """Shows message to let user know that no recipes were found when session['recipes'] is empty."""
+        """Shows message to let user know that no recipes were found when the stored search results are empty."""
+        empty = SearchResult.save([], user_id=None, max_age=3600, max_per_user=5)
         with self.client as c:
             with c.session_transaction() as sess:
-                sess['recipes'] = []
+                sess[SEARCH_RESULTS_KEY] = empty.id
+
+            resp = c.get('/recipes', follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(
+                "Sorry, no recipes were found that match", str(resp.data))
 
+    def test_session_recipes_missing(self):
+        """Shows message to let user know that no recipes were found when there is no stored search."""
+        with self.client as c:
             resp = c.get('/recipes', follow_redirects=True)
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn(
                 "Sorry, no recipes were found that match", str(resp.data))
-            self.assertEqual(len(session['recipes']), 0)
+
+    def test_search_results_per_user_cap(self):
+        """Keeps only the newest result sets for a user."""
+        for i in range(4):
+            SearchResult.save([{"id": i}], user_id=self.testuser.id,
+                              max_age=3600, max_per_user=3)
+        results = SearchResult.query.filter_by(user_id=self.testuser.id).all()
+        self.assertEqual(len(results), 3)
+        self.assertNotIn([{"id": 0}], [r.recipes for r in results])
 
     def test_get_saved_recipe_ids(self):
         """Creates a list of recipe ids to be used by other view functions."""
@@ -168,6 +264,68 @@ class RecipeViewsTestCase(TestCase):
             self.assertIn("SAVE RECIPE", str(resp.data))
             self.assertIn("tester", str(resp.data))
 
+    def test_recipe_stored(self):
+        """A fetched recipe is written to recipe_details and read from there after a restart."""
+        app.extensions['recipe_cache'].clear()
+        RecipeDetail.query.filter_by(recipe_id=1095841).delete()
+        db.session.commit()
+        with self.client as c:
+            first = c.get('/recipes/1095841')
+            self.assertIn('upstream', parse_server_timing(
+                first.headers['Server-Timing']))
+            self.assertIsNotNone(RecipeDetail.query.get(1095841))
+
+            app.extensions['recipe_cache'].clear()
+            resp = c.get('/recipes/1095841')
+            self.assertNotIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+
+    def test_stale_recipe_refreshed(self):
+        """A stored recipe older than RECIPE_CATALOG_MAX_AGE is fetched from the API again."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        fetched_at = datetime.utcnow() - timedelta(days=30)
+        RecipeDetail.query.get(1095841).fetched_at = fetched_at
+        db.session.commit()
+        app.extensions['recipe_cache'].clear()
+        with self.client as c:
+            resp = c.get('/recipes/1095841')
+            self.assertIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+            db.session.expire_all()
+            self.assertGreater(
+                RecipeDetail.query.get(1095841).fetched_at, fetched_at)
+
+    def test_stale_recipe_served_when_api_fails(self):
+        """A stale stored recipe is still shown when the API cannot refresh it."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        RecipeDetail.query.get(1095841).fetched_at = datetime.utcnow() - timedelta(days=30)
+        db.session.commit()
+        app.extensions['recipe_cache'].clear()
+        with self.client as c:
+            with patch.object(async_spoonacular, 'recipe_information',
+                              side_effect=httpx.ConnectError("down")):
+                resp = c.get('/recipes/1095841')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+
+    def test_stale_recipe_served_when_quota_exhausted(self):
+        """A stale stored recipe is still shown once the day's API budget is used up."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        RecipeDetail.query.get(1095841).fetched_at = datetime.utcnow() - timedelta(days=30)
+        db.session.commit()
+        app.extensions['recipe_cache'].clear()
+        with self.client as c:
+            with patch.object(limiter, 'acquire_async',
+                              side_effect=QuotaExceeded("No budget left")) as acquire:
+                resp = c.get('/recipes/1095841')
+
+            acquire.assert_called()
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Spanish Gazpacho Soup", str(resp.data))
+
     def test_get_byIngredients_loggedout(self):
         """Redirects logged out user to homepage."""
         with self.client as c:
@@ -205,9 +363,28 @@ class RecipeViewsTestCase(TestCase):
                 "Click on an ingredient you are missing", str(resp.data))
             self.assertIn("tester", str(resp.data))
             self.assertIn("Peas And Tarragon", html)
-            # Check that recipes returned in search are saved in session.
-            self.assertEqual(len(session['recipes']), 5)
-            self.assertIn("Peas And Tarragon", session['recipes'])
+            # Check that recipes returned in search are stored server side, not in the session.
+            self.assertNotIn('recipes', session)
+            recipes = SearchResult.query.get(session[SEARCH_RESULTS_KEY]).recipes
+            self.assertEqual(len(recipes), 5)
+            self.assertIn("Peas And Tarragon", [r['title'] for r in recipes])
+
+    def test_byIngredients_falls_back_to_stored_recipes(self):
+        """What's in your Fridge? is answered from the stored recipes when the API is unreachable."""
+        RecipeDetail.store(stub_api.FixtureStore(stub_api.FIXTURES_DIR).recipes())
+        app.extensions['fridge_index'].clear()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            byIngredients_form_data = {"ingredients": "chicken, peas", "ranking": 1, "number": 2}
+            with patch.object(spoonacular, 'get', side_effect=requests.ConnectionError("down")):
+                resp = c.post('/recipes/byIngredients',
+                              data=byIngredients_form_data, follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Chicken And Pea Risotto", html)
+            self.assertIn("arborio rice", html)
 
     # def test_byIngredient_session_recipes(self):
     #     """Stores recipes returned from the byIngredients search."""
@@ -220,9 +397,11 @@ class RecipeViewsTestCase(TestCase):
 
     def test_byIngredient_session_empty(self):
         """Redirects and shows a message if there are not recipes returned."""
+        empty = SearchResult.save(
+            [], user_id=self.testuser.id, max_age=3600, max_per_user=5)
         with self.client as c:
             with c.session_transaction() as sess:
-                sess['recipes'] = []
+                sess[SEARCH_RESULTS_KEY] = empty.id
                 sess[CURR_USER_KEY] = self.testuser.id
             resp = c.get('/recipes/results', follow_redirects=True)
 
@@ -253,6 +432,32 @@ class RecipeViewsTestCase(TestCase):
             self.assertIn("Spanish Gazpacho Soup", str(resp.data))
             self.assertIn("Palak Paneer", str(resp.data))
 
+    def test_save_recipe_saved_by_another_user(self):
+        """Saves a recipe another user has already saved, and saving it twice is harmless."""
+        other = User.signup(username="other", first_name="other", last_name="user",
+                            email="other@test.com", password="otheruser", image_url=None)
+        db.session.commit()
+        db.session.add(Recipe(user_id=other.id, recipe_id=1095841))
+        db.session.commit()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post('/recipes/1095841/saved')
+            resp = c.post('/recipes/1095841/saved')
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Recipe.query.filter_by(
+                recipe_id=1095841).count(), 2)
+
+    def test_add_favourite_not_saved(self):
+        """Responds with a 404 when favouriting a recipe the user has not saved."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            resp = c.post('/recipes/1095841/favourite')
+
+            self.assertEqual(resp.status_code, 404)
+
     def test_add_favourite_loggedout(self):
         """Redirects and shows message to a logged out user."""
         with self.client as c:
@@ -327,6 +532,40 @@ class RecipeViewsTestCase(TestCase):
             self.assertIn(
                 "Could not find any substitutes for that ingredient.", str(resp.data))
 
+    def test_ingredient_substitutes_stored(self):
+        """Substitutes are fetched from the API once and then served from the database."""
+        with self.client as c:
+            first = c.get('/ingredient/2041')
+            self.assertIn('upstream', parse_server_timing(
+                first.headers['Server-Timing']))
+            resp = c.get('/ingredient/2041')
+            self.assertNotIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertIn("tarragon leaves", str(resp.data))
+
+    def test_prefetch_substitutes(self):
+        """Shows the substitutes of a recipe's ingredients inline when prefetching."""
+        with self.client as c:
+            resp = c.get('/recipes/1096010')
+            self.assertNotIn("tarragon leaves", str(resp.data))
+            with patch.dict(app.config, {'SUBSTITUTE_PREFETCH': True}):
+                resp = c.get('/recipes/1096010')
+            self.assertIn("tarragon leaves", str(resp.data))
+            self.assertIn('href="/ingredient/2041"', str(resp.data))
+            self.assertEqual(IngredientSubstitute.query.count(), 5)
+
+    def test_similar_recipes_warmed(self):
+        """Viewing a recipe fetches its similar recipes in the background."""
+        with self.client as c:
+            c.get('/recipes/1095841')
+            app.extensions['prefetcher'].wait()
+            self.assertIsNotNone(SimilarRecipes.query.get(1095841))
+
+            resp = c.get('/recipes/1095841/similar')
+            self.assertNotIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertIn("White Gazpacho", str(resp.data))
+
     def test_get_similar_recipes_loggedout(self):
         """Shows a list of recipes that are similar from the API."""
         with self.client as c:
@@ -0,0 +1,225 @@
+"""Spoonacular client tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from unittest.mock import patch
+from spoonacular import SpoonacularClient, AsyncSpoonacularClient, DEFAULT_TIMEOUT, TIMEOUTS
+from singleflight import SingleFlight, LockTable
+import asyncio
+import httpx
+import os
+import requests
+import tempfile
+import threading
+import time
+
+
+class SpoonacularClientTestCase(TestCase):
+    """Test the Spoonacular API client."""
+
+    def setUp(self):
+        """Create a client pointing at a fake base url."""
+        self.client = SpoonacularClient(
+            base_url="http://upstream.test", api_key="key")
+
+    def test_request_params(self):
+        """Adds the apiKey, joins list params and uses the endpoint timeout."""
+        with patch('requests.Session.request') as request:
+            self.client.recipe_information_bulk([1, 2, 3])
+        args, kwargs = request.call_args
+        self.assertEqual(
+            args, ('GET', "http://upstream.test/recipes/informationBulk"))
+        self.assertEqual(kwargs['params'], {'apiKey': 'key', 'ids': '1,2,3'})
+        self.assertEqual(kwargs['timeout'],
+                         TIMEOUTS['recipes/informationBulk'])
+
+    def test_default_timeout(self):
+        """Uses the default timeout for endpoints without their own."""
+        with patch('requests.Session.request') as request:
+            self.client.similar_recipes(42)
+        args, kwargs = request.call_args
+        self.assertEqual(args[1], "http://upstream.test/recipes/42/similar")
+        self.assertEqual(kwargs['timeout'], DEFAULT_TIMEOUT)
+
+    def test_session_per_process(self):
+        """Reuses the pooled session and creates a new one after a fork."""
+        session = self.client.session
+        self.assertIs(self.client.session, session)
+        with patch('spoonacular.os.getpid', return_value=-1):
+            self.assertIsNot(self.client.session, session)
+
+    def test_coalesces_identical_calls(self):
+        """Makes one upstream call for identical GET calls in flight together."""
+        calls = []
+
+        def fake_request(session, method, url, **kwargs):
+            calls.append(url)
+            time.sleep(0.1)
+            res = requests.Response()
+            res.status_code = 200
+            res._content = b'{"id": 1}'
+            return res
+
+        results = []
+        with patch('requests.Session.request', fake_request):
+            threads = [threading.Thread(target=lambda: results.append(self.client.recipe_information(1)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([res.json() for res in results], [{"id": 1}] * 4)
+
+    def test_lock_table_shares_result(self):
+        """Hands the result published by the lock holder to the workers waiting on it."""
+        with tempfile.TemporaryDirectory() as directory:
+            table = LockTable(directory)
+            other = LockTable(directory)
+            (lock, shared) = table.acquire('key')
+            self.assertIsNone(shared)
+            waiting = []
+            thread = threading.Thread(
+                target=lambda: waiting.append(other.acquire('key')))
+            thread.start()
+            time.sleep(0.05)
+            table.publish('key', {"status": 200})
+            table.release(lock)
+            thread.join()
+            (lock, shared) = waiting[0]
+            other.release(lock)
+            self.assertEqual(shared, {"status": 200})
+            with table.hold('key') as shared:
+                self.assertIsNone(shared)
+
+    def test_lock_table_sweeps_old_files(self):
+        """Deletes results and unheld locks nobody can be waiting on any more."""
+        with tempfile.TemporaryDirectory() as directory:
+            table = LockTable(directory, timeout=10, sweep_interval=0)
+            with table.hold('old'):
+                table.publish('old', {"status": 200})
+            held, _ = table.acquire('held')
+            past = time.time() - 60
+            for name in os.listdir(directory):
+                os.utime(os.path.join(directory, name), (past, past))
+            with table.hold('new'):
+                table.publish('new', {"status": 200})
+            table.release(held)
+            self.assertEqual(sorted(os.listdir(directory)), sorted(
+                [os.path.basename(table._path('held')) + '.lock',
+                 os.path.basename(table._path('new')) + '.lock',
+                 os.path.basename(table._path('new')) + '.json']))
+
+
+class AsyncSpoonacularClientTestCase(TestCase):
+    """Test the asynchronous Spoonacular API client."""
+
+    def setUp(self):
+        """Create a client pointing at a fake base url."""
+        self.client = AsyncSpoonacularClient(
+            base_url="http://upstream.test", api_key="key", backoff_factor=0)
+
+    def test_retries_idempotent_calls(self):
+        """Retries GET calls that fail with a 5xx response."""
+        responses = [httpx.Response(503), httpx.Response(200, json={"id": 1})]
+
+        async def fake_request(client, method, url, **kwargs):
+            return responses.pop(0)
+
+        with patch('httpx.AsyncClient.request', fake_request):
+            res = asyncio.run(self.client.recipe_information(1))
+        self.assertEqual(res.json(), {"id": 1})
+        self.assertEqual(responses, [])
+
+    def test_does_not_retry_posts(self):
+        """Returns the failed response of a POST call without retrying."""
+        responses = [httpx.Response(503), httpx.Response(200)]
+
+        async def fake_request(client, method, url, **kwargs):
+            return responses.pop(0)
+
+        with patch('httpx.AsyncClient.request', fake_request):
+            res = asyncio.run(self.client.connect_user(
+                "user", "first", "last", "email"))
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(len(responses), 1)
+
+    def test_coalesces_identical_calls(self):
+        """Makes one upstream call for identical GET calls awaited together."""
+        calls = []
+
+        async def fake_request(client, method, url, **kwargs):
+            calls.append(url)
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, json={"id": 1})
+
+        async def fetch_all():
+            return await asyncio.gather(*[self.client.recipe_information(1) for _ in range(4)])
+
+        with patch('httpx.AsyncClient.request', fake_request):
+            results = asyncio.run(fetch_all())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([res.json() for res in results], [{"id": 1}] * 4)
+
+
+class SingleFlightTestCase(TestCase):
+    """Test coalescing identical calls."""
+
+    def test_cancelled_leader(self):
+        """Callers waiting on a cancelled call make it again instead of waiting forever."""
+        flights = SingleFlight()
+        started = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append('slow')
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            calls.append('fast')
+            return "result"
+
+        async def run():
+            leader = asyncio.create_task(flights.do_async('k', slow))
+            await started.wait()
+            waiter = asyncio.create_task(flights.do_async('k', fast))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await asyncio.wait_for(waiter, 1)
+
+        self.assertEqual(asyncio.run(run()), "result")
+        self.assertEqual(calls, ['slow', 'fast'])
+        self.assertEqual(flights._calls, {})
+        self.assertEqual(flights.do('k', lambda: "again"), "again")
+
+    def test_interrupted_leader(self):
+        """A call stopped by a BaseException is released for the next caller."""
+        flights = SingleFlight()
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            flights.do('k', interrupted)
+        self.assertEqual(flights._calls, {})
+        self.assertEqual(flights.do('k', lambda: "result"), "result")
+
+    def test_cancelled_waiter(self):
+        """A waiter being cancelled leaves the call running for the others."""
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run():
+            leader = asyncio.create_task(flights.do_async('k', slow))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flights.do_async('k', slow))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            return await leader
+
+        self.assertEqual(asyncio.run(run()), "result")
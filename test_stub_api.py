@@ -0,0 +1,55 @@
+"""Stand-in API tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from stub_api import create_stub_app, FIXTURES_DIR
+
+
+class StubApiTestCase(TestCase):
+    """Test the offline stand-in for the Spoonacular API."""
+
+    def setUp(self):
+        """Create a client for a stand-in API over the recorded fixtures."""
+        self.client = create_stub_app(FIXTURES_DIR).test_client()
+
+    def test_complex_search(self):
+        """Answers searches from the recorded recipes."""
+        resp = self.client.get('/recipes/complexSearch',
+                               query_string={'cuisine': 'spanish', 'diet': 'vegetarian', 'maxReadyTime': 20})
+        self.assertEqual([r['title'] for r in resp.json['results']],
+                         ["Spanish Gazpacho Soup"])
+
+    def test_find_by_ingredients(self):
+        """Ranks recipes by the ingredients they use and miss."""
+        resp = self.client.get('/recipes/findByIngredients',
+                               query_string={'ingredients': 'peas,cheese', 'ranking': 1, 'number': 2})
+        self.assertEqual(len(resp.json), 2)
+        self.assertEqual(resp.json[0]['usedIngredientCount'], 2)
+
+    def test_missing_recipe(self):
+        """Responds like the API for recipes that were not recorded."""
+        resp = self.client.get('/recipes/1/information')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/recipes/informationBulk',
+                               query_string={'ids': '1,650484'})
+        self.assertEqual([r['title'] for r in resp.json], ["Palak Paneer"])
+
+    def test_shopping_list(self):
+        """Keeps a shopping list per connected user."""
+        user = self.client.post('/users/connect', json={"username": "tester"}).json
+        params = {'hash': user['hash']}
+        item = self.client.post(f"/mealplanner/{user['username']}/shopping-list/items",
+                                query_string=params, json={"item": "peas", "parse": True}).json
+        resp = self.client.get(
+            f"/mealplanner/{user['username']}/shopping-list", query_string=params)
+        self.assertEqual(resp.json['aisles'][0]['items'][0]['name'], "peas")
+        self.client.delete(
+            f"/mealplanner/{user['username']}/shopping-list/items/{item['id']}", query_string=params)
+        resp = self.client.get(
+            f"/mealplanner/{user['username']}/shopping-list", query_string=params)
+        self.assertEqual(resp.json['aisles'], [])
+
+    def test_injected_errors(self):
+        """Fails calls at the configured error rate."""
+        client = create_stub_app(FIXTURES_DIR, error_rate=1).test_client()
+        resp = client.get('/recipes/650484/information')
+        self.assertEqual(resp.status_code, 503)
@@ -0,0 +1,64 @@
+"""Request tracing tests for Fridge Raiders app (CAPSTONE ONE)."""
+
+from unittest import TestCase
+from flask import Flask, render_template_string
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from tracing import init_tracing, span, parse_server_timing, current_trace
+import json
+import os
+import tempfile
+
+
+class TracingTestCase(TestCase):
+    """Test the per-request timing and span traces."""
+
+    def setUp(self):
+        """Create a small traced app on an in-memory database."""
+        fd, self.trace_file = tempfile.mkstemp()
+        os.close(fd)
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite://"
+        app.config['TRACE_FILE'] = self.trace_file
+        db = SQLAlchemy(app)
+        init_tracing(app, db)
+
+        @app.route('/')
+        def index():
+            db.session.execute(text("SELECT 1"))
+            db.session.execute(text("SELECT 2"))
+            with span('upstream', endpoint='recipes/{id}/information'):
+                pass
+            return render_template_string("<p>{{ name }}</p>", name="traced")
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Remove the trace file."""
+        os.remove(self.trace_file)
+
+    def test_server_timing(self):
+        """Reports the time and count of each phase of a request."""
+        resp = self.client.get('/')
+        timing = parse_server_timing(resp.headers['Server-Timing'])
+        self.assertEqual(timing['db'][1], "2")
+        self.assertEqual(timing['upstream'][1], "1")
+        self.assertEqual(timing['render'][1], "1")
+        self.assertIn('app', timing)
+
+    def test_trace_file(self):
+        """Writes the spans of every request to the trace file."""
+        self.client.get('/')
+        with open(self.trace_file) as f:
+            trace = json.loads(f.readline())
+        self.assertEqual(trace['endpoint'], 'index')
+        self.assertEqual([s['name'] for s in trace['spans']],
+                         ['db', 'db', 'upstream', 'render'])
+        self.assertEqual(trace['spans'][2]['endpoint'],
+                         'recipes/{id}/information')
+
+    def test_span_outside_request(self):
+        """Spans outside of a request are not recorded."""
+        with span('upstream') as attrs:
+            attrs['status'] = 200
+        self.assertIsNone(current_trace.get())
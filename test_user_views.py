@@ -1,10 +1,23 @@
 """User view tests for Fridge Raiders app (CAPSTONE ONE)."""
 
-from app import app, CURR_USER_KEY
 import os
+import re
+import stub_api
+
+# Run against the offline stand-in API instead of the live Spoonacular API
+os.environ['API_BASE_URL'] = stub_api.serve_in_background()
+os.environ['APP_PROFILE'] = 'test'
+
+from app import app, CURR_USER_KEY
 from unittest import TestCase
+from unittest.mock import patch
 # from bs4 import BeautifulSoup
-from models import db, connect_db, User, Recipe, Preference
+from models import db, connect_db, User, Recipe, Preference, Job, ShoppingListItem, RecipeDetail
+from tracing import parse_server_timing
+from provisioning import provision_user
+from jobs import work
+from spoonacular import spoonacular, async_spoonacular
+import httpx
 
 os.environ['DATABASE_URL'] = "postgresql:///fridge_raiders-test"
 
@@ -25,6 +38,7 @@ class UserViewsTestCase(TestCase):
 
     def setUp(self):
         """Create test client and add sample data."""
+        app.extensions['user_cache'].clear()
         User.query.delete()
         Recipe.query.delete()
         Preference.query.delete()
@@ -42,6 +56,7 @@ class UserViewsTestCase(TestCase):
         self.testuser.id = self.testuser_id
 
         db.session.commit()
+        provision_user(self.testuser_id)
 
         recipe1 = Recipe(user_id=self.testuser.id,
                          recipe_id=1095745, favourite=True)
@@ -100,6 +115,21 @@ class UserViewsTestCase(TestCase):
             self.assertNotIn("testuser", html)
             self.assertNotIn("test@test.com", html)
 
+    def test_cached_current_user(self):
+        """Finds the logged in user without the database once they are cached."""
+        user_id = self.testuser.id
+        db.session.expunge_all()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            first = c.get('/')
+            resp = c.get('/')
+            self.assertIn('db', parse_server_timing(
+                first.headers['Server-Timing']))
+            self.assertNotIn('db', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertIn("testuser", str(resp.data))
+
     def test_update_user_profile3(self):
         """Tests POST request for update to user profile with invalid username given."""
         self.test3user = User.signup(username="test3user",
@@ -165,6 +195,38 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("testuser's Shopping List", html)
 
+    def test_shoppinglist_not_provisioned(self):
+        """Queues changes for users whose API account is not set up yet."""
+        self.testuser.hash = None
+        self.testuser.api_username = None
+        db.session.commit()
+        with self.client as c, patch('app.schedule_provisioning') as schedule:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            resp = c.get('/shoppinglist/add/cauliflower',
+                         follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("still being set up", html)
+            self.assertIn("cauliflower", html)
+            schedule.assert_called_with(self.testuser_id)
+
+            # the worker connects the user to the API before adding the item
+            self.assertEqual(work(once=True), 1)
+            self.assertTrue(User.query.get(self.testuser_id).is_provisioned)
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist")
+            self.assertIn("cauliflower", resp.get_data(as_text=True))
+
+    def test_signup_provisions_later(self):
+        """Signup commits the user and connects them to the API in the background."""
+        with self.client as c, patch('app.schedule_provisioning') as schedule:
+            resp = c.post('/signup', data={'username': 'newuser', 'first_name': 'new', 'last_name': 'user',
+                                           'email': 'new@test.com', 'password': 'newuser'})
+            self.assertEqual(resp.status_code, 302)
+            user = User.query.filter_by(username='newuser').one()
+            self.assertFalse(user.is_provisioned)
+            schedule.assert_called_once_with(user.id)
+
     def test_get_user_shoppinglist_invalid(self):
         """Does not show shoppinglist if invalid user id given."""
         with self.client as c:
@@ -186,6 +248,152 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("testuser's Shopping List", html)
             self.assertIn("cauliflower", html)
+            self.assertIn("Being added", html)
+
+    def test_add_to_shoppinglist_worker(self):
+        """The worker adds queued items to the shopping list, once however often they were added."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.get('/shoppinglist/add/cauliflower')
+            c.get('/shoppinglist/add/cauliflower')
+            self.assertEqual(Job.query.filter_by(user_id=self.testuser_id).count(), 1)
+            self.assertEqual(work(once=True), 1)
+
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count("cauliflower"), 1)
+            self.assertNotIn("Being added", html)
+
+            item_id = re.search(r'/shoppinglist/delete/(\d+)', html).group(1)
+            c.get(f"/shoppinglist/delete/{item_id}")
+            self.assertNotIn("cauliflower", c.get(
+                f"/user/{self.testuser.id}/shoppinglist").get_data(as_text=True))
+            work(once=True)
+            self.assertNotIn("cauliflower", c.get(
+                f"/user/{self.testuser.id}/shoppinglist").get_data(as_text=True))
+
+    def test_delete_while_adding(self):
+        """Items deleted before the worker added them end up off the API list too."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            html = c.get('/shoppinglist/add/cauliflower',
+                         follow_redirects=True).get_data(as_text=True)
+            item_id = re.search(r'/shoppinglist/delete/(\d+)', html).group(1)
+            c.get(f"/shoppinglist/delete/{item_id}")
+            self.assertEqual(work(once=True), 1)
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                         follow_redirects=True)
+            self.assertNotIn("cauliflower", resp.get_data(as_text=True))
+
+    def test_add_recipe_to_shoppinglist(self):
+        """Adds all of a recipe's ingredients in one job, adding up repeated ones."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            resp = c.post('/recipes/1095841/shoppinglist', follow_redirects=True)
+            self.assertIn("Added 7 ingredients", resp.get_data(as_text=True))
+            self.assertEqual(Job.query.filter_by(user_id=self.testuser_id).count(), 1)
+            self.assertEqual(work(once=True), 1)
+
+            c.post('/recipes/1095841/shoppinglist')
+            self.assertEqual(work(once=True), 8)
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                         follow_redirects=True)
+            self.assertEqual(resp.get_data(as_text=True).count("garlic"), 1)
+            garlic = ShoppingListItem.query.filter_by(
+                user_id=self.testuser_id, name="garlic").one()
+            self.assertEqual((garlic.amount, garlic.unit), (4, "cloves"))
+            self.assertIsNotNone(garlic.upstream_id)
+
+    def test_add_recipes_before_worker_runs(self):
+        """Ingredients added again while the first add is queued keep both amounts."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post('/recipes/1095841/shoppinglist')
+            c.post('/recipes/650484/shoppinglist')
+            work(once=True)
+            garlic = ShoppingListItem.query.filter_by(user_id=self.testuser_id, name="garlic").one()
+            self.assertEqual(garlic.amount, 5)
+            self.assertIsNotNone(garlic.upstream_id)
+
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                         follow_redirects=True)
+            self.assertEqual(resp.get_data(as_text=True).count("garlic"), 1)
+            garlic = ShoppingListItem.query.filter_by(user_id=self.testuser_id, name="garlic").one()
+            self.assertEqual(garlic.amount, 5)
+
+    def test_add_recipe_twice_while_queued(self):
+        """A repeated submission is skipped with a notice, a different choice is queued."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post('/recipes/1095841/shoppinglist',
+                   data={'selected': 1, 'ingredient': ['3', '4']})
+            resp = c.post('/recipes/1095841/shoppinglist',
+                          data={'selected': 1, 'ingredient': ['4', '3']}, follow_redirects=True)
+            self.assertIn("already being added", resp.get_data(as_text=True))
+            resp = c.post('/recipes/1095841/shoppinglist',
+                          data={'selected': 1, 'ingredient': ['0']}, follow_redirects=True)
+            self.assertIn("Added 1 ingredients", resp.get_data(as_text=True))
+            self.assertEqual(Job.query.filter_by(user_id=self.testuser_id).count(), 2)
+
+    def test_shoppinglist_sync_failure(self):
+        """Shows the local copy when the API could not sync it."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.get('/shoppinglist/add/cauliflower')
+            with patch.object(async_spoonacular, 'shopping_list',
+                              side_effect=httpx.ConnectError("down")):
+                resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                             follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("could not be refreshed", html)
+            self.assertIn("cauliflower", html)
+
+            async def unavailable(*args):
+                return httpx.Response(503, json={"status": "failure"},
+                                      request=httpx.Request('GET', "http://upstream.test/"))
+            with patch.object(async_spoonacular, 'shopping_list', unavailable):
+                resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                             follow_redirects=True)
+            self.assertIn("cauliflower", resp.get_data(as_text=True))
+
+    def test_add_recipe_ingredients_chosen(self):
+        """Adds only the chosen ingredients of a recipe."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post('/recipes/1095841/shoppinglist',
+                   data={'selected': 1, 'ingredient': ['3', '4']})
+            self.assertEqual(sorted(item.name for item in ShoppingListItem.query.filter_by(user_id=self.testuser_id)),
+                             ["garlic", "olive oil"])
+
+    def test_shoppinglist_mirror(self):
+        """Shows the shopping list from its local copy, synced from the API when asked."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            first = c.get(f"/user/{self.testuser.id}/shoppinglist")
+            self.assertIn('upstream', parse_server_timing(
+                first.headers['Server-Timing']))
+
+            # changed on the API behind the app's back
+            user = User.query.get(self.testuser_id)
+            spoonacular.add_shopping_list_item(
+                user.api_username, user.hash, {"item": "leeks", "parse": True})
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist")
+            self.assertNotIn('upstream', parse_server_timing(
+                resp.headers['Server-Timing']))
+            self.assertNotIn("leeks", resp.get_data(as_text=True))
+
+            resp = c.get(f"/user/{self.testuser.id}/shoppinglist?refresh=1",
+                         follow_redirects=True)
+            self.assertIn("leeks", resp.get_data(as_text=True))
 
     def test_delete_from_shoppinglist(self):
         """Deletes a given ingredient from user's shoppinglist."""
@@ -214,6 +422,30 @@ class UserViewsTestCase(TestCase):
                 user_id=self.testuser.id).all()
             self.assertEqual(len(saved_recipes), 2)
 
+    def test_saved_recipes_bulk_failure(self):
+        """Fetches saved recipes one at a time, in saved order, when informationBulk fails."""
+        async def unavailable(recipe_ids):
+            return httpx.Response(503, json={"status": "failure"},
+                                  request=httpx.Request('GET', "http://upstream.test/"))
+
+        app.extensions['recipe_cache'].clear()
+        RecipeDetail.query.filter(RecipeDetail.recipe_id.in_([1095745, 650484])).delete()
+        db.session.commit()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            with patch.object(async_spoonacular, 'recipe_information_bulk',
+                              side_effect=unavailable) as bulk:
+                resp = c.get(f"/user/{self.testuser.id}/saved-recipes")
+
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            bulk.assert_called_once()
+            self.assertIn("Mushroom Hummus Crostini", html)
+            self.assertIn("Palak Paneer", html)
+            self.assertLess(html.index("Mushroom Hummus Crostini"),
+                            html.index("Palak Paneer"))
+
     def test_get_user_saved_recipes_invalid(self):
         """Does not show saved recipes if loggedout user."""
         with self.client as c:
@@ -0,0 +1,138 @@
+"""Per-request timing and span traces for Fridge Raiders app (CAPSTONE ONE).
+
+Every request gets a trace that collects spans for the phases it goes through: loading
+the logged in user, password hashing, SQL statements, Spoonacular calls and template
+rendering. The totals per phase are sent back in a Server-Timing header, which browsers
+show in their network panel, and the spans can also be appended to a JSON lines file
+(TRACE_FILE) to look at slow requests after the fact.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request, template_rendered, before_render_template
+from sqlalchemy import event
+import json
+import threading
+import time
+
+# The trace of the current request, shared with the threads async views run on
+current_trace = ContextVar('current_trace', default=None)
+
+# Phases reported in the Server-Timing header, in the order they are sent
+PHASES = ('auth', 'hash', 'db', 'upstream', 'render')
+
+
+class Trace:
+    """The spans recorded while handling one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, started, duration, **attrs):
+        """Records a span, started is a perf_counter value."""
+        self.spans.append({"name": name, "start": started - self.started,
+                           "duration": duration, **attrs})
+
+    def totals(self):
+        """Returns the time spent and the number of spans per phase."""
+        totals = {}
+        for span in self.spans:
+            (duration, count) = totals.get(span["name"], (0, 0))
+            totals[span["name"]] = (duration + span["duration"], count + 1)
+        return totals
+
+    def server_timing(self):
+        """Returns the Server-Timing header value for the trace, durations in ms."""
+        totals = self.totals()
+        metrics = []
+        for phase in PHASES:
+            if phase in totals:
+                (duration, count) = totals[phase]
+                metrics.append(f'{phase};dur={duration * 1000:.1f};desc="{count}"')
+        metrics.append(
+            f"app;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed block as a span of the current request, if there is one."""
+    trace = current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        trace.add(name, started, time.perf_counter() - started, **attrs)
+
+
+def parse_server_timing(header):
+    """Returns {metric: (duration in ms, desc)} from a Server-Timing header value."""
+    metrics = {}
+    for metric in filter(None, (m.strip() for m in (header or '').split(','))):
+        (name, *params) = [p.strip() for p in metric.split(';')]
+        values = dict(p.split('=', 1) for p in params if '=' in p)
+        metrics[name] = (float(values.get('dur', 0)),
+                         values.get('desc', '').strip('"'))
+    return metrics
+
+
+def init_tracing(app, db):
+    """Traces every request of app, including the SQL statements run through db."""
+    trace_lock = threading.Lock()
+
+    def start_trace():
+        current_trace.set(Trace())
+    # start before any other before_request function, so loading the user is traced
+    app.before_request_funcs.setdefault(None, []).insert(0, start_trace)
+
+    @app.after_request
+    def add_server_timing(res):
+        trace = current_trace.get()
+        if trace is not None:
+            res.headers['Server-Timing'] = trace.server_timing()
+        return res
+
+    @app.teardown_request
+    def write_trace(error=None):
+        trace = current_trace.get()
+        current_trace.set(None)
+        path = app.config.get('TRACE_FILE')
+        if trace is None or not path:
+            return
+        line = json.dumps({"method": request.method, "path": request.path,
+                           "endpoint": request.endpoint, "error": repr(error) if error else None,
+                           "duration": time.perf_counter() - trace.started,
+                           "spans": trace.spans})
+        with trace_lock, open(path, 'a') as f:
+            f.write(line + "\n")
+
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('trace_started', []).append(time.perf_counter())
+
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['trace_started'].pop()
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add('db', started, time.perf_counter() - started,
+                      statement=statement.split(None, 1)[0].upper())
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', start_statement)
+        event.listen(db.engine, 'after_cursor_execute', end_statement)
+
+    def start_render(sender, template, context, **extra):
+        context['_trace_render_started'] = time.perf_counter()
+
+    def end_render(sender, template, context, **extra):
+        trace = current_trace.get()
+        started = context.pop('_trace_render_started', None)
+        if trace is not None and started is not None:
+            trace.add('render', started, time.perf_counter() - started,
+                      template=template.name)
+
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(end_render, app, weak=False)